@@ -0,0 +1,53 @@
+"""
+Compares the ORM and bulk Core load paths of convert_to_database.py on a synthetic corpus.
+
+Run from the repository root: python -m benchmarks.bulk_load --num-products 100000
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+
+from benchmarks.synthetic import make_corpus, TimedIterator
+from convert_to_database import load_orm, load_bulk
+from dvids_apps.bulk_load import create_loading_engine
+from dvids_apps.migrations import upgrade_schema
+
+
+def run(name: str, num_products: int, database_path: Path) -> float:
+    if name == "orm":
+        engine = create_engine(f"sqlite:///{database_path}")
+    else:
+        engine = create_loading_engine(database_path)
+    upgrade_schema(engine)
+    corpus = TimedIterator(make_corpus(num_products))
+    start = time.perf_counter()
+    if name == "orm":
+        load_orm(engine, corpus)
+    else:
+        load_bulk(engine, corpus, defer_indexes=name == "bulk-deferred")
+    elapsed = time.perf_counter() - start - corpus.elapsed
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM products")).scalar() == num_products
+    engine.dispose()
+    return elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-products", type=int, default=100_000, help="Size of the corpus. Default=%(default)s")
+    parser.add_argument("--loaders", type=str, nargs="+", default=["orm", "bulk", "bulk-deferred"],
+                        choices=["orm", "bulk", "bulk-deferred"], help="Load paths to benchmark")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in args.loaders:
+            elapsed = run(name, args.num_products, Path(temp_dir).joinpath(f"{name}.db"))
+            print(f"{name:>14}: {elapsed:.2f}s, {args.num_products / elapsed:,.0f} products/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
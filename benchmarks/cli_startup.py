@@ -0,0 +1,55 @@
+"""
+Times the startup of every dvids subcommand in a fresh interpreter: importing the command's module, and running it
+with --help. gpt-war --dry-run is timed as well, and a bare interpreter start is the baseline.
+
+Run from the repository root: python -m benchmarks.cli_startup --repeat 5
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from dvids_apps.cli import COMMANDS
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def best_time(command: list[str], repeat: int) -> float:
+    """
+    Fastest of repeat runs of a command, in seconds. The fastest run is the one least disturbed by the rest of the
+    machine
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=REPO_ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement. Default=%(default)s")
+    args = parser.parse_args()
+
+    baseline = best_time([sys.executable, "-c", "pass"], args.repeat)
+    print(f"interpreter start: {baseline * 1000:.0f}ms\n")
+    print(f"{'command':>14} {'import':>9} {'--help':>9}")
+    for name, command in COMMANDS.items():
+        import_time = best_time([sys.executable, "-c", f"import {command.module}"], args.repeat)
+        help_time = best_time([sys.executable, "dvids.py", name, "--help"], args.repeat)
+        print(f"{name:>14} {import_time * 1000:>7.0f}ms {help_time * 1000:>7.0f}ms")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_file = Path(temp_dir).joinpath("input.txt")
+        input_file.write_text("Marines and sailors took part in a humanitarian exercise on 3 March 2022.\n")
+        dry_run = best_time([sys.executable, "dvids.py", "gpt-war", "--type", "names", "--input", str(input_file),
+                             "--api-key", "unused", "--dry-run"], args.repeat)
+    print(f"\ngpt-war --dry-run: {dry_run * 1000:.0f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Compares decoding API responses into plain dicts (Response.json() and the TypedDict casts) with decoding them into the
+__slots__ records of dvids_apps.models.records: throughput for /search pages and /asset responses, the memory each
+decoded listing and product keeps alive, and the cost of mapping products to database rows.
+
+Run from the repository root: python -m benchmarks.decoding --num-products 20000
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable
+
+import ujson
+
+from benchmarks.mock_dvids import make_listing
+from benchmarks.synthetic import make_corpus
+from dvids_apps.bulk_load import product_to_rows
+from dvids_apps.models.records import ProductRecord, decode_asset, decode_search_page
+
+
+def best_time(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def retained_bytes(fn: Callable[[], list], count: int) -> float:
+    """
+    Bytes per item still allocated while the list fn builds is alive
+    """
+    gc.collect()
+    tracemalloc.start()
+    kept = fn()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current / count
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-products", type=int, default=20000, help="Default=%(default)s")
+    parser.add_argument("--page-size", type=int, default=50, help="Listings per search page. Default=%(default)s")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement. Default=%(default)s")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    products = [product for _, day in make_corpus(args.num_products, seed=args.seed) for product in day]
+    asset_bodies = [ujson.dumps({"results": product}).encode("utf-8") for product in products]
+    listings = [make_listing(product) for product in products]
+    search_bodies = [ujson.dumps({"page_info": {"total_results": len(listings), "results_per_page": args.page_size},
+                                  "results": listings[i:i + args.page_size]}).encode("utf-8")
+                     for i in range(0, len(listings), args.page_size)]
+    count = len(products)
+
+    # httpx's Response.json() decodes the body to text and parses it with the standard library
+    cases = [
+        ("search", "dict", lambda: [item for body in search_bodies for item in json.loads(body.decode())["results"]]),
+        ("search", "record", lambda: [item for body in search_bodies for item in decode_search_page(body)[1]]),
+        ("asset", "dict", lambda: [json.loads(body.decode())["results"] for body in asset_bodies]),
+        ("asset", "record", lambda: [ProductRecord.from_dict(decode_asset(body)) for body in asset_bodies]),
+    ]
+    print(f"{count} products, {len(search_bodies)} search pages\n")
+    print(f"{'response':>9} {'path':>7} {'decoded/s':>11} {'bytes each':>11}")
+    for response, path, fn in cases:
+        seconds = best_time(fn, args.repeat)
+        print(f"{response:>9} {path:>7} {count / seconds:>11,.0f} {retained_bytes(fn, count):>11,.0f}")
+
+    decoded = [decode_asset(body) for body in asset_bodies]
+    records = [ProductRecord.from_dict(product) for product in decoded]
+    print(f"\n{'to rows':>17} {'products/s':>11}")
+    for name, fn in [("dict", lambda: [product_to_rows(product) for product in decoded]),
+                     ("record", lambda: [record.to_rows() for record in records]),
+                     ("dict -> record", lambda: [ProductRecord.from_dict(product).to_rows() for product in decoded])]:
+        print(f"{name:>17} {count / best_time(fn, args.repeat):>11,.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
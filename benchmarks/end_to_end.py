@@ -0,0 +1,150 @@
+"""
+Runs the whole pipeline against the mock DVIDS API at several corpus sizes: download_dvids.py, convert_to_database.py,
+create_fake_war.py and (when the spaCy model is installed) build_vector_store.py. The download runs a second time as
+"redownload" to measure a historical re-download served from the HTTP cache the first one filled. Each stage runs as its own process
+through the dvids CLI and is reported with its wall time, products per second and peak memory.
+
+Run from the repository root: python -m benchmarks.end_to_end --scales 1000 10000 --latency 0.01 --error-rate 0.01
+"""
+import argparse
+import importlib.util
+import math
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import ujson
+
+from benchmarks.mock_dvids import MockDvidsServer
+from benchmarks.synthetic import make_corpus
+from dvids_apps.nlp import DEFAULT_MODEL
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BEGIN = datetime(2022, 1, 1)
+
+
+class StageResult(NamedTuple):
+    seconds: float
+    peak_memory_mb: Optional[float]
+
+
+def run_stage(arguments: list[str], env: dict[str, str], log_path: Path) -> StageResult:
+    """
+    Runs `dvids <arguments>` and measures it. Peak memory is the child's maximum resident set size, which needs
+    os.wait4 (not available on Windows)
+    """
+    start = time.perf_counter()
+    with open(log_path, "w") as log_file:
+        process = subprocess.Popen([sys.executable, "dvids.py", *arguments], cwd=REPO_ROOT, env=env,
+                                   stdout=log_file, stderr=subprocess.STDOUT)
+        peak_memory_mb = None
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            peak_memory_mb = usage.ru_maxrss / (1024 ** 2 if sys.platform == "darwin" else 1024)
+        else:
+            process.wait()
+    seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"dvids {arguments[0]} failed with exit code {process.returncode}, see {log_path}:\n"
+                           f"{log_path.read_text()[-2000:]}")
+    return StageResult(seconds, peak_memory_mb)
+
+
+def run_scale(num_products: int, args, work_dir: Path) -> list[dict]:
+    days = math.ceil(num_products / args.products_per_day)
+    begin = BEGIN.strftime("%Y%m%d")
+    end = (BEGIN + timedelta(days=days - 1)).strftime("%Y%m%d")
+    data_dir = work_dir.joinpath("data")
+    database = work_dir.joinpath("dvids.db")
+    download = ["--begin", begin, "--end", end, "--output-format", args.output_format,
+                "--max-concurrency", str(args.max_concurrency), "--requests-per-second", "0",
+                "--http-cache", str(work_dir.joinpath("http_cache"))]
+    stages = {
+        "download": ["download", *download, "--output-dir", str(data_dir)],
+        "redownload": ["download", *download, "--output-dir", str(work_dir.joinpath("data_again"))],
+        "convert": ["convert", "--data-dir", str(data_dir), "--begin", begin, "--end", end,
+                    "--output-file", str(database), "--defer-indexes", "--workers", str(args.workers)],
+        "fake-war": ["fake-war", "--database-path", str(database), "--begin-date", begin, "--end-date", end,
+                     "--output-dir", str(work_dir.joinpath("wars")), "--workers", str(args.workers)]
+    }
+    if importlib.util.find_spec(DEFAULT_MODEL) is not None:
+        stages["build-vectors"] = ["build-vectors", "--db-path", str(database),
+                                   "--output-dir", str(work_dir.joinpath("vectors")),
+                                   "--nlp-cache", str(work_dir.joinpath("nlp_cache.sqlite3"))]
+    else:
+        print(f"Skipping build-vectors, spaCy model {DEFAULT_MODEL} is not installed")
+
+    corpus = make_corpus(num_products, BEGIN, args.products_per_day, args.seed)
+    results = []
+    with MockDvidsServer(corpus, args.latency, args.error_rate, args.page_size, args.seed) as server:
+        env = {**os.environ, "DVIDS_API_ROOT": server.url, "DVIDS_SECRET_KEY": "benchmark",
+               # The NLP stage always loads the model itself
+               "DVIDS_NLP_SERVER": ""}
+        for name, arguments in stages.items():
+            result = run_stage(arguments, env, work_dir.joinpath(f"{name}.log"))
+            results.append({
+                "products": num_products,
+                "stage": name,
+                "seconds": result.seconds,
+                "products_per_second": num_products / result.seconds,
+                "peak_memory_mb": result.peak_memory_mb
+            })
+        print(f"{num_products} products: mock API answered {server.requests} requests, {server.errors} with "
+              f"injected errors and {server.not_modified} with 304 Not Modified, sending "
+              f"{server.bytes_sent / 1024 ** 2:.1f}MB")
+    connection = sqlite3.connect(database)
+    loaded = connection.execute("SELECT count(*) FROM products").fetchone()[0]
+    connection.close()
+    if loaded != num_products:
+        print(f"Warning: only {loaded} of {num_products} products made it into the database")
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000],
+                        help="Corpus sizes to run the pipeline at. Default=%(default)s")
+    parser.add_argument("--products-per-day", type=int, default=300, help="Default=%(default)s")
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="Seconds the mock API waits before answering each request. Default=%(default)s")
+    parser.add_argument("--error-rate", type=float, default=0.01,
+                        help="Fraction of mock API requests answered with a 503. Default=%(default)s")
+    parser.add_argument("--page-size", type=int, default=50, help="Search results per page. Default=%(default)s")
+    parser.add_argument("--max-concurrency", type=int, default=32,
+                        help="download_dvids.py --max-concurrency. Default=%(default)s")
+    parser.add_argument("--output-format", type=str, choices=["json", "jsonl"], default="json",
+                        help="download_dvids.py --output-format. Default=%(default)s")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="--workers for convert and fake-war. Default=%(default)s")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the corpus and the injected errors")
+    parser.add_argument("--json-output", type=Path,
+                        help="Also write the results to this JSON file, e.g. to compare runs for regressions")
+    args = parser.parse_args()
+
+    results = []
+    for num_products in args.scales:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            results.extend(run_scale(num_products, args, Path(temp_dir)))
+
+    print(f"\n{'products':>9} {'stage':>14} {'seconds':>9} {'products/s':>11} {'peak MB':>8}")
+    for result in results:
+        peak = f"{result['peak_memory_mb']:.0f}" if result["peak_memory_mb"] is not None else "n/a"
+        print(f"{result['products']:>9} {result['stage']:>14} {result['seconds']:>9.2f} "
+              f"{result['products_per_second']:>11,.0f} {peak:>8}")
+    if args.json_output:
+        with open(args.json_output, "w", encoding="utf-8") as output_file:
+            ujson.dump({"arguments": {key: str(value) for key, value in vars(args).items()}, "results": results},
+                       output_file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
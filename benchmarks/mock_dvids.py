@@ -0,0 +1,187 @@
+"""
+Local stand-in for the DVIDS API serving a synthetic corpus from /search and /asset, with configurable latency, page
+size and error rate. Responses carry an ETag and a Last-Modified date, conditional requests for unchanged responses
+get a 304, and bodies are gzipped for clients that accept it. Point download_dvids.py at it with DVIDS_API_ROOT.
+
+Run from the repository root to serve it on its own: python -m benchmarks.mock_dvids --num-products 5000 --port 8080
+"""
+import argparse
+import gzip
+import hashlib
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import ujson
+
+from benchmarks.synthetic import make_corpus
+
+# Every product in the corpus counts as last modified at this time
+LAST_MODIFIED = "Sat, 01 Jan 2022 00:00:00 GMT"
+# Bodies smaller than this aren't worth compressing
+MIN_GZIP_BYTES = 512
+
+# Fields of a product that show up in search listings, the rest is only returned by /asset
+LISTING_FIELDS = ("id", "type", "title", "date", "date_published", "timestamp", "unit_name", "branch", "keywords",
+                  "url")
+
+
+def make_listing(product: dict[str, Any]) -> dict[str, Any]:
+    """
+    The search result for a product, shaped like api_models.Product
+    """
+    listing = {field: product.get(field) for field in LISTING_FIELDS}
+    listing["short_description"] = (product.get("description") or "")[:300]
+    listing["publishdate"] = product.get("date_published")
+    return listing
+
+
+class MockDvidsServer:
+    """
+    Threaded HTTP server answering /search (paged by date) and /asset (by id) from a corpus of products. Every request
+    waits `latency` seconds first, and `error_rate` of them fail with a 503 like an overloaded API. Use as a context
+    manager, `url` is the API root to point clients at.
+    """
+
+    def __init__(self, corpus: Iterable[tuple[datetime, list[dict[str, Any]]]], latency: float = 0.0,
+                 error_rate: float = 0.0, page_size: int = 50, seed: int = 0, port: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.listings_by_date: dict[str, list[dict[str, Any]]] = {}
+        self.products_by_id: dict[str, dict[str, Any]] = {}
+        for date, products in corpus:
+            self.listings_by_date[date.date().isoformat()] = [make_listing(product) for product in products]
+            self.products_by_id.update((product["id"], product) for product in products)
+        self.requests = 0
+        self.errors = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "MockDvidsServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+    def search(self, query: dict[str, str]) -> tuple[int, Any]:
+        try:
+            date = datetime.fromisoformat(query["from_publishdate"]).date().isoformat()
+            page = int(query.get("page", 1))
+        except (KeyError, ValueError):
+            return 400, {"errors": ["Invalid search parameters"]}
+        listings = self.listings_by_date.get(date, [])
+        start = (page - 1) * self.page_size
+        return 200, {
+            "page_info": {"total_results": len(listings), "results_per_page": self.page_size},
+            "results": listings[start:start + self.page_size]
+        }
+
+    def asset(self, query: dict[str, str]) -> tuple[int, Any]:
+        product = self.products_by_id.get(query.get("id", ""))
+        if product is None:
+            return 404, {"errors": [f"No asset with id {query.get('id')}"]}
+        return 200, {"results": product}
+
+    def _make_handler(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so clients can reuse pooled connections like they would against the real API
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                if server.latency:
+                    time.sleep(server.latency)
+                split = urlsplit(self.path)
+                query = {key: values[-1] for key, values in parse_qs(split.query).items()}
+                if server.should_fail():
+                    status, body = 503, {"errors": ["Service temporarily unavailable"]}
+                elif split.path == "/search":
+                    status, body = server.search(query)
+                elif split.path == "/asset":
+                    status, body = server.asset(query)
+                else:
+                    status, body = 404, {"errors": [f"Unknown endpoint {split.path}"]}
+                payload = ujson.dumps(body).encode("utf-8")
+                # The ETag doesn't depend on the encoding, so a cached decoded body can still be revalidated
+                etag = '"' + hashlib.sha1(payload).hexdigest() + '"'
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    with server._lock:
+                        server.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if status == 200:
+                    self.send_header("ETag", etag)
+                    self.send_header("Last-Modified", LAST_MODIFIED)
+                if len(payload) >= MIN_GZIP_BYTES and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    payload = gzip.compress(payload, compresslevel=6)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                with server._lock:
+                    server.bytes_sent += len(payload)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-products", type=int, default=5000, help="Size of the corpus. Default=%(default)s")
+    parser.add_argument("--products-per-day", type=int, default=300,
+                        help="Products per date, starting at 20220101. Default=%(default)s")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds every request waits before it is answered. Default=%(default)s")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests answered with a 503. Default=%(default)s")
+    parser.add_argument("--page-size", type=int, default=50, help="Search results per page. Default=%(default)s")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on. Default=%(default)s")
+    args = parser.parse_args()
+    corpus = make_corpus(args.num_products, products_per_day=args.products_per_day)
+    with MockDvidsServer(corpus, args.latency, args.error_rate, args.page_size, port=args.port) as server:
+        print(f"Serving {len(server.products_by_id)} products on {server.url}, set DVIDS_API_ROOT={server.url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
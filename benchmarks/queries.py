@@ -0,0 +1,94 @@
+"""
+Times the scripts' database access patterns before and after upgrade_schema adds indexes and body_length.
+
+Run from the repository root: python -m benchmarks.queries --num-products 100000
+"""
+import argparse
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session, selectinload
+
+from benchmarks.synthetic import make_corpus, UNITS
+from convert_to_database import load_bulk
+from dvids_apps.bulk_load import create_loading_engine, drop_indexes
+from dvids_apps.migrations import upgrade_schema
+from dvids_apps.models.db_models import Base, Product
+
+QUERY_DATE = datetime(2022, 1, 15)
+
+
+def fake_war_by_date(session: Session, use_body_length: bool) -> int:
+    # create_fake_war.py --date
+    return len(session.execute(select(Product.title, Product.description).where(Product.date == QUERY_DATE)).all())
+
+
+def products_with_relationships(session: Session, use_body_length: bool) -> int:
+    # Loading a day's products along with their credits and files
+    query = select(Product).where(Product.date == QUERY_DATE).options(selectinload(Product.credits),
+                                                                      selectinload(Product.files))
+    return len(session.scalars(query).all())
+
+
+def summaries_by_length(session: Session, use_body_length: bool) -> int:
+    # create_summaries.py article selection
+    if use_body_length:
+        condition = Product.body_length.between(2000, 3000)
+    else:
+        condition = func.length(Product.body).between(2000, 3000)
+    return len(session.execute(select(Product.id).where(condition).limit(20)).all())
+
+
+def count_by_unit(session: Session, use_body_length: bool) -> int:
+    return session.execute(select(func.count()).where(Product.unit_name == UNITS[3])).scalar()
+
+
+QUERIES: dict[str, Callable[[Session, bool], int]] = {
+    "fake war by date": fake_war_by_date,
+    "day with credits/files": products_with_relationships,
+    "summaries by body length": summaries_by_length,
+    "count by unit": count_by_unit
+}
+
+
+def time_queries(engine, use_body_length: bool, repeat: int) -> dict[str, float]:
+    timings = {}
+    with Session(engine) as session:
+        for name, query in QUERIES.items():
+            start = time.perf_counter()
+            for _ in range(repeat):
+                query(session, use_body_length)
+            timings[name] = (time.perf_counter() - start) / repeat
+    return timings
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-products", type=int, default=100_000, help="Size of the corpus. Default=%(default)s")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query. Default=%(default)s")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        engine = create_loading_engine(Path(temp_dir).joinpath("queries.db"))
+        Base.metadata.create_all(engine)
+        # Start from the old schema: no secondary indexes
+        drop_indexes(engine)
+        load_bulk(engine, make_corpus(args.num_products))
+        before = time_queries(engine, False, args.repeat)
+        start = time.perf_counter()
+        upgrade_schema(engine)
+        print(f"upgrade_schema: {time.perf_counter() - start:.2f}s for {args.num_products} products")
+        after = time_queries(engine, True, args.repeat)
+        engine.dispose()
+    print(f"{'query':>26} {'before':>10} {'after':>10}")
+    for name in QUERIES:
+        print(f"{name:>26} {before[name] * 1000:>8.1f}ms {after[name] * 1000:>8.1f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Compares answering dashboard questions (counts per unit and branch, keyword frequencies) by scanning products and
+splitting keywords in Python with answering them from the rollups and keyword index, and measures what maintaining
+those costs during a bulk load.
+
+Run from the repository root: python -m benchmarks.rollups --num-products 100000
+"""
+import argparse
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable
+
+from sqlalchemy import select
+from sqlalchemy.engine import Connection
+
+from benchmarks.synthetic import make_corpus, TimedIterator, UNITS
+from convert_to_database import load_bulk
+from dvids_apps.bulk_load import create_loading_engine
+from dvids_apps.migrations import upgrade_schema
+from dvids_apps.models.db_models import Product
+from dvids_apps.rollups import facet_counts, normalize_keywords, top_keywords
+
+BEGIN = datetime(2022, 1, 1)
+END = datetime(2022, 1, 31)
+
+
+def scan_units(connection: Connection) -> Any:
+    query = select(Product.unit_name, Product.title).where(Product.date >= BEGIN, Product.date < datetime(2022, 2, 1))
+    products, titles = Counter(), {}
+    for unit_name, title in connection.execute(query):
+        products[unit_name] += 1
+        titles.setdefault(unit_name, set()).add(title)
+    return products.most_common()
+
+
+def scan_keywords(connection: Connection) -> Any:
+    query = select(Product.keywords).where(Product.date >= BEGIN, Product.date < datetime(2022, 2, 1))
+    return Counter(keyword for keywords in connection.execute(query).scalars()
+                   for keyword in normalize_keywords(keywords)).most_common(20)
+
+
+def scan_unit_keywords(connection: Connection) -> Any:
+    query = select(Product.keywords).where(Product.unit_name == UNITS[3])
+    return Counter(keyword for keywords in connection.execute(query).scalars()
+                   for keyword in normalize_keywords(keywords)).most_common(20)
+
+
+QUERIES: dict[str, tuple[Callable[[Connection], Any], Callable[[Connection], Any]]] = {
+    "products per unit": (scan_units, lambda connection: facet_counts(connection, "unit_name", BEGIN, END)),
+    "products per day": (
+        lambda connection: Counter(day.date() for day in connection.execute(select(Product.date)).scalars()),
+        lambda connection: facet_counts(connection, "day")
+    ),
+    "top keywords": (scan_keywords, lambda connection: top_keywords(connection, BEGIN, END)),
+    "top keywords of a unit": (scan_unit_keywords, lambda connection: top_keywords(connection, unit_name=UNITS[3])),
+    "units with a keyword": (
+        lambda connection: Counter(unit_name for unit_name, keywords in
+                                   connection.execute(select(Product.unit_name, Product.keywords))
+                                   if "aircraft" in normalize_keywords(keywords)),
+        lambda connection: facet_counts(connection, "unit_name", keyword="aircraft")
+    ),
+}
+
+
+def best_time(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-products", type=int, default=100_000, help="Size of the corpus. Default=%(default)s")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Default=%(default)s")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query. Default=%(default)s")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        load_times = {}
+        for name, defer_indexes in [("per batch", False), ("deferred", True)]:
+            engine = create_loading_engine(Path(temp_dir).joinpath(f"{name}.db"))
+            upgrade_schema(engine)
+            corpus = TimedIterator(make_corpus(args.num_products))
+            start = time.perf_counter()
+            load_bulk(engine, corpus, args.batch_size, defer_indexes)
+            load_times[name] = time.perf_counter() - start - corpus.elapsed
+            if name == "per batch":
+                with engine.connect() as connection:
+                    timings = {query_name: (best_time(lambda: scan(connection), args.repeat),
+                                            best_time(lambda: rollup(connection), args.repeat))
+                               for query_name, (scan, rollup) in QUERIES.items()}
+            engine.dispose()
+    print(f"{args.num_products} products")
+    for name, seconds in load_times.items():
+        print(f"load, rollups refreshed {name}: {seconds:.2f}s ({args.num_products / seconds:,.0f} products/s)")
+    print(f"\n{'query':>24} {'scan':>10} {'rollups':>10}")
+    for name, (scan_seconds, rollup_seconds) in timings.items():
+        print(f"{name:>24} {scan_seconds * 1000:>8.1f}ms {rollup_seconds * 1000:>8.1f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Measures the built-in extractive summarizer: throughput of each method by batch size and number of worker processes,
+and, given a database and the completion cache create_summaries.py filled with SMMRY responses, how closely each
+method agrees with SMMRY (shared sentences and ROUGE-1 against the stored summaries).
+
+Run from the repository root: python -m benchmarks.summarize --num-products 5000
+or, to measure agreement: python -m benchmarks.summarize --db-path dvids.db --cache-path dvids.db.completion_cache.sqlite3
+"""
+import argparse
+import re
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+from benchmarks.synthetic import make_corpus
+from dvids_apps.completions import ResponseCache, cache_key
+from dvids_apps.summarize import METHODS, SMMRY_DEFAULT_SENTENCES, split_sentences, summarize_batch, summarize_many
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize_sentence(sentence: str) -> str:
+    return " ".join(_WORD_PATTERN.findall(sentence.lower()))
+
+
+def sentence_f1(summary: str, reference: str) -> float:
+    """
+    F1 of the sentences two summaries share, compared by their words only
+    """
+    sentences = {normalize_sentence(sentence) for sentence in split_sentences(summary)}
+    reference_sentences = {normalize_sentence(sentence) for sentence in split_sentences(reference)}
+    if not sentences or not reference_sentences:
+        return float(sentences == reference_sentences)
+    shared = len(sentences & reference_sentences)
+    return 2 * shared / (len(sentences) + len(reference_sentences))
+
+
+def rouge_1(summary: str, reference: str) -> float:
+    """
+    ROUGE-1 F1: overlap of the summaries' word counts
+    """
+    words = Counter(_WORD_PATTERN.findall(summary.lower()))
+    reference_words = Counter(_WORD_PATTERN.findall(reference.lower()))
+    overlap = sum((words & reference_words).values())
+    if overlap == 0:
+        return 0.0
+    precision = overlap / sum(words.values())
+    recall = overlap / sum(reference_words.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def load_bodies(db_path: Path, limit: Optional[int]) -> list[str]:
+    from sqlalchemy import create_engine, select
+    from dvids_apps.models.db_models import Product
+    engine = create_engine(f"sqlite:///{db_path}")
+    query = select(Product.body).where(Product.body.is_not(None), Product.body != "").order_by(Product.id)
+    if limit is not None:
+        query = query.limit(limit)
+    with engine.connect() as connection:
+        # Normalized like create_summaries.py does before sending a body to SMMRY (and caching the response)
+        bodies = [body.replace("\r\n", "\n") for body in connection.execute(query).scalars()]
+    engine.dispose()
+    return bodies
+
+
+def stored_smmry_pairs(bodies: list[str], cache_path: Path) -> list[tuple[str, str]]:
+    """
+    (body, SMMRY summary) for the bodies whose default length SMMRY summary is in the completion cache
+    """
+    cache = ResponseCache(cache_path)
+    pairs = []
+    for body in bodies:
+        summary = cache.get(cache_key("smmry", None, body, {}))
+        if summary:
+            pairs.append((body, summary))
+    cache.close()
+    return pairs
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-products", type=int, default=5000,
+                        help="Size of the synthetic corpus timed without --db-path. Default=%(default)s")
+    parser.add_argument("--db-path", type=Path, help="Database to take the article bodies from")
+    parser.add_argument("--cache-path", type=Path,
+                        help="create_summaries.py's completion cache holding SMMRY summaries of the bodies")
+    parser.add_argument("--limit", type=int, help="Only use this many articles of the database")
+    parser.add_argument("--sentences", type=int, default=SMMRY_DEFAULT_SENTENCES,
+                        help="Sentences per summary when timing. Default=%(default)s")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Worker processes for the parallel run. Default=%(default)s")
+    args = parser.parse_args()
+
+    if args.db_path:
+        bodies = load_bodies(args.db_path, args.limit)
+    else:
+        bodies = [product["body"] for _, day in make_corpus(args.num_products) for product in day]
+    print(f"{len(bodies)} articles, {sum(len(body) for body in bodies) / max(len(bodies), 1):,.0f} characters on "
+          f"average\n")
+    print(f"{'method':>10} {'batch':>6} {'workers':>8} {'articles/s':>11}")
+    for method in METHODS:
+        for batch_size, workers in [(1, 1), (64, 1), (64, args.workers)]:
+            start = time.perf_counter()
+            for _ in summarize_many(bodies, args.sentences, method, workers, batch_size):
+                pass
+            seconds = time.perf_counter() - start
+            print(f"{method:>10} {batch_size:>6} {workers:>8} {len(bodies) / seconds:>11,.0f}")
+
+    if not args.db_path or not args.cache_path:
+        print("\nNo --db-path and --cache-path, skipping the agreement with stored SMMRY summaries")
+        return 0
+    pairs = stored_smmry_pairs(bodies, args.cache_path)
+    if not pairs:
+        print(f"\nNo SMMRY summaries of these articles in {args.cache_path}")
+        return 0
+    print(f"\nAgreement with {len(pairs)} stored SMMRY summaries (same number of sentences as SMMRY's)")
+    print(f"{'method':>10} {'sentence F1':>12} {'ROUGE-1 F1':>11}")
+    for method in METHODS:
+        sentence_scores = []
+        rouge_scores = []
+        for body, reference in pairs:
+            summary = summarize_batch([body], len(split_sentences(reference)), method)[0]
+            sentence_scores.append(sentence_f1(summary, reference))
+            rouge_scores.append(rouge_1(summary, reference))
+        print(f"{method:>10} {sum(sentence_scores) / len(pairs):>12.3f} {sum(rouge_scores) / len(pairs):>11.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
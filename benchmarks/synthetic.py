@@ -0,0 +1,81 @@
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Iterator
+
+BRANCHES = ["Army", "Navy", "Air Force", "Marines", "Coast Guard", "Joint", "Space Force"]
+UNITS = [f"{n}th Test Wing" for n in range(1, 60)] + [f"Task Force {n}" for n in range(1, 40)]
+WORDS = ("soldiers airmen sailors marines training exercise deployment readiness mission support base unit command "
+         "operation partnership community ceremony logistics aircraft vessel medical engineering patrol range "
+         "qualification leadership family holiday storm relief humanitarian equipment maintenance").split()
+
+
+def make_sentence(rng: random.Random, num_words: int) -> str:
+    return " ".join(rng.choices(WORDS, k=num_words)).capitalize() + "."
+
+
+def make_body(rng: random.Random, num_sentences: int) -> str:
+    return " ".join(make_sentence(rng, rng.randint(8, 25)) for _ in range(num_sentences))
+
+
+def make_product(rng: random.Random, product_id: int, date: datetime) -> dict[str, Any]:
+    """
+    Makes a fake product shaped like the /asset endpoint's ResolvedProduct
+    """
+    published = date + timedelta(seconds=rng.randint(0, 86399))
+    return {
+        "id": f"news:{product_id}",
+        "type": "news",
+        "title": make_sentence(rng, rng.randint(5, 12)).rstrip("."),
+        "description": make_sentence(rng, rng.randint(20, 45)),
+        "keywords": ", ".join(rng.sample(WORDS, rng.randint(2, 8))),
+        "date": date.isoformat(),
+        "date_published": published.isoformat(),
+        "timestamp": published.isoformat(),
+        "unit_name": rng.choice(UNITS),
+        "branch": rng.choice(BRANCHES),
+        "image": f"https://example.invalid/{product_id}.jpg",
+        "url": f"https://example.invalid/news/{product_id}",
+        "virin": f"{date:%y%m%d}-A-{product_id:05d}",
+        "body": make_body(rng, rng.randint(8, 40)),
+        "credits": [{"id": rng.randint(1, 10 ** 6), "name": make_sentence(rng, 2).rstrip("."), "rank": "Sgt.",
+                     "url": f"https://example.invalid/portfolio/{rng.randint(1, 10 ** 6)}"}
+                    for _ in range(rng.randint(1, 3))],
+        "files": [{"src": f"https://example.invalid/{product_id}-{i}.jpg", "type": "image/jpeg",
+                   "height": 1080, "width": 1920, "bitrate": None} for i in range(rng.randint(0, 3))]
+    }
+
+
+def make_corpus(num_products: int, begin: datetime = datetime(2022, 1, 1), products_per_day: int = 300,
+                seed: int = 0) -> Iterator[tuple[datetime, list[dict[str, Any]]]]:
+    """
+    Yields (date, products) pairs totalling num_products, products_per_day per date starting at begin
+    """
+    rng = random.Random(seed)
+    date = begin
+    product_id = 0
+    while product_id < num_products:
+        count = min(products_per_day, num_products - product_id)
+        yield date, [make_product(rng, product_id + i, date) for i in range(count)]
+        product_id += count
+        date += timedelta(days=1)
+
+
+class TimedIterator:
+    """
+    Wraps an iterator and accumulates the time spent producing items, so benchmarks can exclude corpus generation
+    """
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.elapsed = 0.0
+
+    def __iter__(self) -> 'TimedIterator':
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return next(self.iterator)
+        finally:
+            self.elapsed += time.perf_counter() - start
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+import argparse
+import sys
+from datetime import timedelta
+from itertools import chain
+
+from dvids_apps.helpers import path, iso_date, eprint
+from dvids_apps.nlp import DEFAULT_BATCH_SIZE
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-path", type=path, help="Path to database", required=True)
+    parser.add_argument("--output-dir", type=path, help="Directory to write the vector store to", required=True)
+    parser.add_argument("--field", type=str, choices=["body", "description", "title"], default="body",
+                        help="Product field to embed. Default=%(default)s")
+    parser.add_argument("--begin", type=iso_date, help="Begin date to include (YYYYMMDD format)")
+    parser.add_argument("--end", type=iso_date, help="End date to include (YYYYMMDD format)")
+    parser.add_argument("--nlp-cache", type=path,
+                        help="Path to the NLP result cache. Default=<db-path>.nlp_cache.sqlite3")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Number of texts per spaCy batch. Default=%(default)s")
+    parser.add_argument("--n-process", type=int, default=1,
+                        help="Number of processes spaCy parses with. Default=%(default)s")
+    parser.add_argument("--skip-duplicates", action="store_true",
+                        help="Only embed one product per near-duplicate cluster (needs a database loaded with "
+                             "--dedupe)")
+    args = parser.parse_args()
+
+    if not args.db_path.exists():
+        eprint(f"Error: database {args.db_path} does not exist")
+        return 1
+
+    from sqlalchemy import create_engine, select, func
+    from dvids_apps.dedupe import is_cluster_representative
+    from dvids_apps.models.db_models import Product
+    from dvids_apps.nlp import NlpEngine
+    from dvids_apps.vector_store import VectorStore
+
+    engine = create_engine(f"sqlite:///{args.db_path}")
+    field = getattr(Product, args.field)
+    conditions = [field.is_not(None)]
+    if args.begin:
+        conditions.append(Product.date >= args.begin)
+    if args.end:
+        conditions.append(Product.date < args.end + timedelta(days=1))
+    if args.skip_duplicates:
+        conditions.append(is_cluster_representative())
+
+    with engine.connect() as connection, \
+            NlpEngine("vectors", cache_path=args.nlp_cache or f"{args.db_path}.nlp_cache.sqlite3",
+                      batch_size=args.batch_size, n_process=args.n_process) as nlp_engine:
+        count = connection.execute(select(func.count()).select_from(Product).where(*conditions)).scalar()
+        if count == 0:
+            eprint("Error: no products to embed")
+            return 1
+        rows = connection.execution_options(yield_per=1000).execute(
+            select(Product.id, field).where(*conditions).order_by(Product.id)
+        )
+        vectors = nlp_engine.vectors((product_id, text) for product_id, text in rows)
+        # The vector size depends on the model, so look at the first one before creating the matrix
+        first = next(vectors)
+        store = VectorStore.build(args.output_dir, chain([first], vectors), count, first[1].shape[0])
+    print(f"Stored {len(store)} vectors in {args.output_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,248 @@
 #!/usr/bin/env python
 import argparse
 import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from typing import Optional, Any
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar, TYPE_CHECKING
 
-import ujson
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from dvids_apps.archives import daily_jsonl_path, is_jsonl_archive, read_jsonl, zip_members_by_date, iter_zip
+from dvids_apps.helpers import make_date_range, path, iso_date, eprint, bounded_map, DEFAULT_DEDUPE_THRESHOLD
+from dvids_apps.metrics import METRICS, Progress, profiled
 
-from dvids_apps.helpers import make_date_range, get_safe_datetime, path, iso_date, eprint
-from dvids_apps.models.db_models import Base, Product, Credit, Location, File
+if TYPE_CHECKING:
+    # SQLAlchemy (and everything built on it) is imported inside the functions that need it, so --help stays fast
+    from sqlalchemy.engine import Engine
+    from dvids_apps.bulk_load import ProductRows
+    from dvids_apps.dedupe import Deduplicator
+    from dvids_apps.models.db_models import Product
+    from dvids_apps.shards import ShardedDatabase
+
+ProductsByDate = Iterable[tuple[datetime, Iterable[dict[str, Any]]]]
+T = TypeVar("T")
+# (database, shard key, first date, last date, data directory, data zip, batch size, defer indexes, dedupe threshold)
+ShardJob = tuple["ShardedDatabase", str, datetime, datetime, Optional[Path], Optional[Path], int, bool,
+                 Optional[float]]
+
+
+def iter_date_files(data_dir: Path, begin: datetime, end: datetime) -> Iterator[tuple[datetime, list[Path]]]:
+    """
+    Yields the files holding each date's products: the JSON files in its YYYYMMDD folder and/or its packed
+    YYYYMMDD.jsonl.gz archive
+    """
+    for date in make_date_range(begin, end):
+        path_to_files: Path = data_dir.joinpath(date.strftime("%Y%m%d"))
+        jsonl_path = daily_jsonl_path(data_dir, date)
+        files: list[Path] = []
+        if path_to_files.exists():
+            # Only finished product files, not the temporary files of a download in progress
+            files.extend(path_to_files.glob("*.json"))
+        if jsonl_path.exists():
+            files.append(jsonl_path)
+        if not files:
+            eprint(f"Warning: no path found at {path_to_files} or {jsonl_path}")
+            continue
+        yield date, files
+
+
+def read_products(files: Iterable[Path]) -> Iterator[dict[str, Any]]:
+    from dvids_apps.bulk_load import read_product_file
+    for file in files:
+        if is_jsonl_archive(file):
+            yield from read_jsonl(file)
+        else:
+            yield read_product_file(file)
+
+
+def iter_data_dir(data_dir: Path, begin: datetime,
+                  end: datetime) -> Iterator[tuple[datetime, Iterator[dict[str, Any]]]]:
+    """
+    Yields each date in the range along with a lazy iterator over the products saved for that date
+    """
+    for date, files in iter_date_files(data_dir, begin, end):
+        yield date, read_products(files)
+
+
+def make_chunks(items: Iterable[T], chunk_size: int) -> Iterator[list[T]]:
+    chunk: list[T] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_file_chunks(data_dir: Path, begin: datetime, end: datetime, chunk_size: int) -> Iterator[list[Path]]:
+    for _, files in iter_date_files(data_dir, begin, end):
+        # A packed archive is already one file per day, it goes to a worker on its own
+        yield from make_chunks([file for file in files if not is_jsonl_archive(file)], chunk_size)
+        yield from ([file] for file in files if is_jsonl_archive(file))
+
+
+def iter_zip_chunks(zip_path: Path, begin: datetime, end: datetime, chunk_size: int) -> Iterator[list[str]]:
+    with zipfile.ZipFile(zip_path) as zip_file:
+        members_by_date = zip_members_by_date(zip_file, begin, end)
+    for names in members_by_date.values():
+        yield from make_chunks(names, chunk_size)
+
+
+def make_orm_product(json_data: dict[str, Any]) -> "Product":
+    from dvids_apps.bulk_load import product_to_rows
+    from dvids_apps.models.db_models import Product, Credit, File
+    product_row, credit_rows, file_rows = product_to_rows(json_data)
+    product = Product(**product_row)
+    for credit_row in credit_rows:
+        product.credits.append(Credit(**credit_row))
+    for file_row in file_rows:
+        product.files.append(File(**file_row))
+    return product
+
+
+def load_orm(engine: "Engine", products_by_date: ProductsByDate) -> int:
+    """
+    Loads products through the ORM, one commit per date. Slower than load_bulk but kept for comparison. The keyword
+    index and rollups are rebuilt at the end
+    """
+    from sqlalchemy.orm import sessionmaker
+    from dvids_apps.bulk_load import PRODUCTS_PARSED, PRODUCTS_WRITTEN, FLUSH_SECONDS
+    from dvids_apps.rollups import rebuild_keyword_index, rebuild_rollups
+    num_loaded = 0
+    session = sessionmaker(bind=engine)
+    with session() as session:
+        for _, products in products_by_date:
+            date_loaded = 0
+            for json_data in products:
+                session.add(make_orm_product(json_data))
+                PRODUCTS_PARSED.inc()
+                date_loaded += 1
+            with FLUSH_SECONDS.time():
+                session.commit()
+            PRODUCTS_WRITTEN.inc(date_loaded)
+            num_loaded += date_loaded
+    rebuild_keyword_index(engine)
+    rebuild_rollups(engine)
+    return num_loaded
+
+
+def load_bulk(engine: "Engine", products_by_date: ProductsByDate, batch_size: int = 5000,
+              defer_indexes: bool = False, deduplicator: Optional["Deduplicator"] = None) -> int:
+    """
+    Loads products with batched Core inserts. With defer_indexes the secondary indexes are dropped for the duration of
+    the load and rebuilt once at the end, which is much faster for large initial loads
+    """
+    from dvids_apps.bulk_load import BulkLoader, drop_indexes, create_indexes
+    if defer_indexes:
+        drop_indexes(engine)
+    with BulkLoader(engine, batch_size, deduplicator, refresh_rollups=not defer_indexes) as loader:
+        for _, products in products_by_date:
+            loader.add_many(products)
+    if defer_indexes:
+        create_indexes(engine)
+    return loader.rows_written
+
+
+def load_parallel(engine: "Engine", file_chunks: Iterable[list], workers: int, batch_size: int = 5000,
+                  defer_indexes: bool = False,
+                  parse_chunk: Optional[Callable[[list], list["ProductRows"]]] = None,
+                  deduplicator: Optional["Deduplicator"] = None) -> int:
+    """
+    Reads and parses files in a pool of worker processes while this process is the single SQLite writer. Chunks are
+    submitted a few at a time so parsed rows never pile up faster than they are written. parse_chunk defaults to
+    parsing a list of JSON/JSONL files
+    """
+    from dvids_apps.bulk_load import BulkLoader, drop_indexes, create_indexes, parse_product_files
+    if parse_chunk is None:
+        parse_chunk = parse_product_files
+    if defer_indexes:
+        drop_indexes(engine)
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            BulkLoader(engine, batch_size, deduplicator, refresh_rollups=not defer_indexes) as loader:
+        for rows_chunk in bounded_map(executor, parse_chunk, file_chunks, workers * 2):
+            for rows in rows_chunk:
+                loader.add_rows(rows)
+                if loader.full:
+                    loader.flush()
+    if defer_indexes:
+        create_indexes(engine)
+    return loader.rows_written
+
+
+def load_shard(job: ShardJob) -> tuple[str, int, list[str], list["ProductRows"]]:
+    """
+    Loads one shard's dates into the shard. Products whose own date belongs to another shard (their date differs from
+    the day they were published and downloaded under) aren't written but returned, for the caller to route to the
+    right shard once every shard is loaded. Returns (shard key, products written, ids of the products written,
+    products for other shards). Runs in the worker processes
+    """
+    from dvids_apps.bulk_load import BulkLoader, drop_indexes, create_indexes, product_to_rows
+    from dvids_apps.dedupe import Deduplicator
+    database, key, begin, end, data_dir, data_zip, batch_size, defer_indexes, dedupe_threshold = job
+    products_by_date = iter_data_dir(data_dir, begin, end) if data_dir else iter_zip(data_zip, begin, end)
+    deduplicator = None
+    if dedupe_threshold is not None:
+        deduplicator = Deduplicator(dedupe_threshold)
+    other_shards: list[ProductRows] = []
+    product_ids: list[str] = []
+    engine = database.loading_engine(key)
+    if defer_indexes:
+        drop_indexes(engine)
+    with BulkLoader(engine, batch_size, deduplicator, refresh_rollups=not defer_indexes) as loader:
+        for _, products in products_by_date:
+            for json_data in products:
+                rows = product_to_rows(json_data)
+                if database.shard_key(rows[0]["date"]) != key:
+                    other_shards.append(rows)
+                    continue
+                loader.add_rows(rows)
+                product_ids.append(rows[0]["id"])
+                if loader.full:
+                    loader.flush()
+    if defer_indexes:
+        create_indexes(engine)
+    engine.dispose()
+    return key, loader.rows_written, product_ids, other_shards
+
+
+def load_sharded(database: "ShardedDatabase", begin: datetime, end: datetime, data_dir: Optional[Path],
+                 data_zip: Optional[Path], workers: int, batch_size: int = 5000, defer_indexes: bool = False,
+                 dedupe_threshold: Optional[float] = None) -> int:
+    """
+    Loads a date range into a sharded database, each shard by its own process (up to workers at once) so the shards
+    are written in parallel instead of queueing on one SQLite write lock. Products are then routed to the shard of
+    their own date, and copies the loaded products left in other shards are deleted
+    """
+    from dvids_apps.bulk_load import PRODUCTS_PARSED, PRODUCTS_WRITTEN
+    from dvids_apps.dedupe import Deduplicator
+    from dvids_apps.shards import ShardedLoader
+    jobs = [(database, key, shard_begin, shard_end, data_dir, data_zip, batch_size, defer_indexes, dedupe_threshold)
+            for key, shard_begin, shard_end in database.shard_periods(begin, end)]
+    other_shards: list[ProductRows] = []
+    num_loaded = 0
+    deduplicator = Deduplicator(dedupe_threshold) if dedupe_threshold is not None else None
+    with ShardedLoader(database, batch_size, deduplicator) as loader:
+        with ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as executor:
+            results = bounded_map(executor, load_shard, jobs, workers * 2) if executor else map(load_shard, jobs)
+            for key, written, product_ids, rows in results:
+                if executor:
+                    # The workers' metrics stay in the workers. Products for other shards are counted once the
+                    # loader below parses them in
+                    PRODUCTS_PARSED.inc(len(product_ids))
+                    PRODUCTS_WRITTEN.inc(written)
+                eprint(f"Loaded {written} products into shard {key}")
+                num_loaded += written
+                loader.add_loaded(key, product_ids)
+                other_shards.extend(rows)
+        for rows in other_shards:
+            loader.add_rows(rows)
+    if other_shards:
+        eprint(f"Loaded {loader.rows_written} products dated outside the shard they were published in")
+        num_loaded += loader.rows_written
+    return num_loaded
 
 
 def main() -> int:
@@ -21,10 +253,35 @@ def main() -> int:
     data_source_group.add_argument("--data-zip", type=path,
                                    help="Path to a zip folder containing DVIDS data (expects folders in YYYYMMDD "
                                         "format)")
-    parser.add_argument("--output-file", type=path, help="Path to create database at", required=True)
+    parser.add_argument("--output-file", type=path, required=True,
+                        help="Path to create database at, or the directory to create the shards in with --shard-by")
     parser.add_argument("--begin", type=iso_date, help="Begin date to convert (YYYYMMDD format)")
     parser.add_argument("--end", type=iso_date, help="End date to convert (YYYYMMDD format)")
     parser.add_argument("--date", type=iso_date, help="Single date to convert (YYYYMMDD format)")
+    parser.add_argument("--loader", type=str, choices=["bulk", "orm"], default="bulk",
+                        help="How to write to the database, bulk uses batched Core inserts. Default=%(default)s")
+    parser.add_argument("--batch-size", type=int, default=5000,
+                        help="Number of products per insert batch for the bulk loader. Default=%(default)s")
+    parser.add_argument("--defer-indexes", action="store_true",
+                        help="Drop indexes during a bulk load and rebuild them afterwards (best for large loads)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes used to read and parse files with the bulk loader. "
+                             "Default=%(default)s")
+    parser.add_argument("--chunk-size", type=int, default=500,
+                        help="Number of files handed to a worker at a time with --workers. Default=%(default)s")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Assign near-duplicate cluster ids while loading (bulk loader only)")
+    parser.add_argument("--dedupe-threshold", type=float, default=DEFAULT_DEDUPE_THRESHOLD,
+                        help="Estimated body similarity at which two products are duplicates. Default=%(default)s")
+    parser.add_argument("--shard-by", type=str, choices=["year", "quarter", "month", "day"],
+                        help="Split the database into one SQLite file per period of the products' date, loaded in "
+                             "parallel with --workers (bulk loader only)")
+    parser.add_argument("--metrics-file", type=path,
+                        help="Write throughput and commit timing metrics here at the end of the run (Prometheus text "
+                             "format for .prom/.txt, JSON otherwise)")
+    parser.add_argument("--progress", action=argparse.BooleanOptionalAction,
+                        help="Show a live progress line on stderr. Default: on when stderr is a terminal")
+    parser.add_argument("--profile", type=path, help="Profile the run with cProfile and write the stats here")
     args = parser.parse_args()
 
     # Additional input validation
@@ -41,61 +298,92 @@ def main() -> int:
     else:
         begin = args.begin
         end = args.end
+    if args.shard_by:
+        if args.loader != "bulk":
+            eprint("Error: --shard-by is only supported with --loader bulk")
+            return 1
+        if not begin:
+            eprint("Error: --shard-by needs --date or --begin/--end")
+            return 1
+        if args.data_zip and not args.data_zip.exists():
+            eprint(f"Error: zip file {args.data_zip} does not exist")
+            return 1
+        return convert_sharded(args, begin, end)
 
-    engine = create_engine(f"sqlite:///{args.output_file}")
-    Base.metadata.create_all(engine)
-    session = sessionmaker(bind=engine)
+    from sqlalchemy import create_engine
+    from dvids_apps.bulk_load import create_loading_engine, parse_zip_members
+    from dvids_apps.dedupe import Deduplicator
+    from dvids_apps.migrations import upgrade_schema
 
-    with session() as session:
-        for date in make_date_range(begin, end):
-            if args.data_dir:
-                path_to_files: Path = args.data_dir.joinpath(date.strftime("%Y%m%d"))
-                if not path_to_files.exists():
-                    eprint(f"Warning: no path found at {path_to_files}")
-                    continue
-                for file in path_to_files.iterdir():
-                    with open(file, "r", encoding="utf-8") as json_file:
-                        try:
-                            json_data: dict[str, Any] = ujson.load(json_file)
-                        except ujson.JSONDecodeError as e:
-                            eprint(f"Unable to load json from {file}")
-                            raise e
-                        # Construct our objects
-                        product = Product(
-                            id=json_data.get("id"),
-                            branch=json_data.get("branch"),
-                            description=json_data.get("description"),
-                            keywords=json_data.get("keywords"),
-                            date=get_safe_datetime(json_data, "date"),
-                            date_published=get_safe_datetime(json_data, "date_published"),
-                            image=json_data.get("image"),
-                            timestamp=get_safe_datetime(json_data, "timestamp"),
-                            title=json_data.get("title"),
-                            unit_name=json_data.get("unit_name"),
-                            url=json_data.get("url"),
-                            virin=json_data.get("virin"),
-                            body=json_data.get("body")
-                        )
-                        for credit_data in json_data.get("credits", []):
-                            credit = Credit(
-                                credit_id=credit_data.get("id"),
-                                name=credit_data.get("name"),
-                                rank=credit_data.get("rank"),
-                                url=credit_data.get("url")
-                            )
-                            product.credits.append(credit)
-                        for file_data in json_data.get("files", []):
-                            file = File(
-                                src=file_data.get("src"),
-                                type=file_data.get("type"),
-                                height=file_data.get("height"),
-                                width=file_data.get("width"),
-                                bitrate=file_data.get("bitrate")
-                            )
-                            product.files.append(file)
-
-                        session.add(product)
-                session.commit()
+    if args.loader == "bulk":
+        engine = create_loading_engine(args.output_file)
+    else:
+        engine = create_engine(f"sqlite:///{args.output_file}")
+    upgrade_schema(engine)
+
+    if args.workers > 1 and args.loader != "bulk":
+        eprint("Error: --workers is only supported with --loader bulk")
+        return 1
+    if args.dedupe and args.loader != "bulk":
+        eprint("Error: --dedupe is only supported with --loader bulk")
+        return 1
+    deduplicator = None
+    if args.dedupe:
+        deduplicator = Deduplicator(args.dedupe_threshold)
+
+    if args.data_zip and not args.data_zip.exists():
+        eprint(f"Error: zip file {args.data_zip} does not exist")
+        return 1
+
+    show_progress = args.progress if args.progress is not None else sys.stderr.isatty()
+    progress = Progress(METRICS, [("parsed", "dvids_products_parsed_total"),
+                                  ("written", "dvids_products_written_total")])
+    try:
+        with profiled(args.profile), progress if show_progress else nullcontext():
+            if args.workers > 1:
+                if args.data_dir:
+                    load_parallel(engine, iter_file_chunks(args.data_dir, begin, end, args.chunk_size), args.workers,
+                                  args.batch_size, args.defer_indexes, deduplicator=deduplicator)
+                else:
+                    load_parallel(engine, iter_zip_chunks(args.data_zip, begin, end, args.chunk_size), args.workers,
+                                  args.batch_size, args.defer_indexes, partial(parse_zip_members, args.data_zip),
+                                  deduplicator)
+            else:
+                if args.data_dir:
+                    products_by_date = iter_data_dir(args.data_dir, begin, end)
+                else:
+                    products_by_date = iter_zip(args.data_zip, begin, end)
+                if args.loader == "bulk":
+                    load_bulk(engine, products_by_date, args.batch_size, args.defer_indexes, deduplicator)
+                else:
+                    load_orm(engine, products_by_date)
+    finally:
+        if args.metrics_file:
+            METRICS.write(args.metrics_file)
+    engine.dispose()
+    return 0
+
+
+def convert_sharded(args, begin: datetime, end: datetime) -> int:
+    from dvids_apps.shards import ShardedDatabase
+
+    try:
+        database = ShardedDatabase(args.output_file, args.shard_by)
+    except ValueError as e:
+        eprint(f"Error: {e}")
+        return 1
+    dedupe_threshold = args.dedupe_threshold if args.dedupe else None
+    show_progress = args.progress if args.progress is not None else sys.stderr.isatty()
+    progress = Progress(METRICS, [("parsed", "dvids_products_parsed_total"),
+                                  ("written", "dvids_products_written_total")])
+    try:
+        with profiled(args.profile), progress if show_progress else nullcontext():
+            load_sharded(database, begin, end, args.data_dir, args.data_zip, args.workers, args.batch_size,
+                         args.defer_indexes, dedupe_threshold)
+    finally:
+        if args.metrics_file:
+            METRICS.write(args.metrics_file)
+    return 0
 
 
 if __name__ == "__main__":
@@ -1,51 +1,226 @@
 #!/usr/bin/env python
 import argparse
+import itertools
+import os
 import sys
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, TextIO, TYPE_CHECKING
 
-from jinja2 import Environment, PackageLoader
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from dvids_apps.helpers import path, iso_date, eprint, bounded_map, make_temp_file
 
-from dvids_apps.helpers import path, iso_date, eprint
-from dvids_apps.models.db_models import Product
+if TYPE_CHECKING:
+    from jinja2 import Template
+    from sqlalchemy.engine import Connection
+
+DEFAULT_PAGE_SIZE = 500
+# products has a text primary key, so its implicit rowid is the insertion order wars have always been listed in
+ROWID_COLUMN = "products.rowid"
+
+War = tuple[str, list[str]]
+# (date, wars of the date, start index, end index, output directory)
+DateJob = tuple[datetime, list[War], int, Optional[int], Path]
+
+_template: Optional["Template"] = None
+
+
+def load_template() -> "Template":
+    """
+    The war layout. Compiled templates are kept in Jinja's bytecode cache (in the temp directory), so only the first
+    run pays for compiling it
+    """
+    from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader
+    env = Environment(
+        loader=PackageLoader("dvids_apps"),
+        bytecode_cache=FileSystemBytecodeCache()
+    )
+    return env.get_template("war_layout.jinja")
+
+
+def get_template() -> "Template":
+    """
+    The template loaded once per process
+    """
+    global _template
+    if _template is None:
+        _template = load_template()
+    return _template
+
+
+def iter_wars(connection: "Connection", date: datetime, start: int = 0, end: Optional[int] = None,
+              page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[War]:
+    """
+    Yields (title, distinct descriptions) for titles start to end of a date, in the order the titles first appear.
+    Negative indexes count from the last title, like slicing a list. The titles are paged in SQL and only title and
+    description are read, so at most one page is held in memory
+    """
+    from sqlalchemy import func, literal_column, or_, select
+    from dvids_apps.models.db_models import Product
+
+    rowid = literal_column(ROWID_COLUMN)
+    day = date.replace(hour=0, minute=0, second=0, microsecond=0)
+    on_date = (Product.date >= day, Product.date < day + timedelta(days=1))
+    if start < 0 or (end is not None and end < 0):
+        titles_query = select(Product.title).where(*on_date).group_by(Product.title).subquery()
+        count = connection.execute(select(func.count()).select_from(titles_query)).scalar()
+        start = max(count + start, 0) if start < 0 else start
+        end = max(count + end, 0) if end is not None and end < 0 else end
+    offset = start
+    while end is None or offset < end:
+        limit = page_size if end is None else min(page_size, end - offset)
+        titles = connection.execute(
+            select(Product.title).where(*on_date).group_by(Product.title)
+            .order_by(func.min(rowid)).limit(limit).offset(offset)
+        ).scalars().all()
+        if not titles:
+            return
+        descriptions_by_title: dict[Optional[str], dict[str, None]] = {title: {} for title in titles}
+        # IN never matches NULL, products without a title are one war of their own
+        title_condition = Product.title.in_([title for title in titles if title is not None])
+        if None in descriptions_by_title:
+            title_condition = or_(title_condition, Product.title.is_(None))
+        rows = connection.execute(
+            select(Product.title, Product.description)
+            .where(*on_date, title_condition)
+            .order_by(rowid)
+        )
+        for title, description in rows:
+            descriptions_by_title[title][description] = None
+        for title, descriptions in descriptions_by_title.items():
+            yield title, list(descriptions)
+        offset += len(titles)
+
+
+def iter_wars_by_date(connection: "Connection", begin: datetime,
+                      end: datetime) -> Iterator[tuple[datetime, list[War]]]:
+    """
+    Yields (date, wars) for every date from begin to end (inclusive) that has products, from a single pass over the
+    range. Rows come back ordered by date, so only one date's titles are grouped in memory at a time
+    """
+    from sqlalchemy import literal_column, select
+    from dvids_apps.models.db_models import Product
+
+    rows = connection.execution_options(yield_per=5000).execute(
+        select(Product.date, Product.title, Product.description)
+        .where(Product.date >= begin, Product.date < end + timedelta(days=1))
+        .order_by(Product.date, literal_column(ROWID_COLUMN))
+    )
+    current_date: Optional[datetime] = None
+    descriptions_by_title: dict[str, dict[str, None]] = {}
+    for date, title, description in rows:
+        date = date.replace(hour=0, minute=0, second=0, microsecond=0)
+        if date != current_date:
+            if descriptions_by_title:
+                yield current_date, [(title, list(items)) for title, items in descriptions_by_title.items()]
+            current_date, descriptions_by_title = date, {}
+        descriptions_by_title.setdefault(title, {})[description] = None
+    if descriptions_by_title:
+        yield current_date, [(title, list(items)) for title, items in descriptions_by_title.items()]
+
+
+def write_wars(template: "Template", date: datetime, wars: Iterator[War], output: TextIO) -> int:
+    """
+    Renders each war with template.generate() straight to the output, returns the number of wars written
+    """
+    count = 0
+    for title, entries in wars:
+        output.writelines(template.generate(title=title, date=date.strftime("%Y-%m-%d"), entries=entries))
+        output.write("\n")
+        count += 1
+    return count
+
+
+def write_date_file(job: DateJob) -> tuple[datetime, int]:
+    """
+    Renders the wars of one date to <output_dir>/YYYYMMDD.txt. The file is written to a temporary file and renamed
+    into place, so an interrupted run never leaves a partial date behind. Runs in the worker processes
+    """
+    date, wars, start, end, output_dir = job
+    file = output_dir.joinpath(f"{date.strftime('%Y%m%d')}.txt")
+    fd, temp_path = make_temp_file(file)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as output:
+            count = write_wars(get_template(), date, iter(wars[start:end]), output)
+        os.replace(temp_path, file)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return date, count
+
+
+def write_date_range(wars_by_date: Iterable[tuple[datetime, list[War]]], output_dir: Path, workers: int,
+                     start: int = 0, end_index: Optional[int] = None) -> int:
+    """
+    Writes one file per date (see iter_wars_by_date), rendering dates in a pool of worker processes while the next
+    dates are read. Returns the number of files written
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    jobs = ((date, wars, start, end_index, output_dir) for date, wars in wars_by_date)
+    files = 0
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for date, count in bounded_map(executor, write_date_file, jobs, workers * 2):
+                eprint(f"Wrote {count} wars for {date.strftime('%Y%m%d')}")
+                files += 1
+    else:
+        for date, count in map(write_date_file, jobs):
+            eprint(f"Wrote {count} wars for {date.strftime('%Y%m%d')}")
+            files += 1
+    return files
 
 
 def main() -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument("--database-path", type=path, required=True,
-                        help="Path to SQLite database file to get DVIDS data from")
-    parser.add_argument("--date", type=iso_date, required=True,
-                        help="Date to select data from. Only one date at a time")
-    parser.add_argument("--start", type=int, help="Start index of wars to use")
-    parser.add_argument("--end", type=int, help="End index of wars to use")
+                        help="Path to SQLite database file to get DVIDS data from, or to a sharded database's "
+                             "directory (only the shards of the requested dates are read)")
+    parser.add_argument("--date", type=iso_date,
+                        help="Date to select data from, printed to stdout unless --output-dir is given")
+    parser.add_argument("--begin-date", type=iso_date, help="Begin date of a range to write (YYYYMMDD format)")
+    parser.add_argument("--end-date", type=iso_date, help="End date of a range to write (YYYYMMDD format)")
+    parser.add_argument("--output-dir", type=path,
+                        help="Directory to write one file per date to (YYYYMMDD.txt). Required with "
+                             "--begin-date/--end-date")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes rendering dates with --output-dir. Default=%(default)s")
+    parser.add_argument("--start-index", "--start", type=int, help="Start index of wars to use")
+    parser.add_argument("--end-index", "--end", type=int, help="End index of wars to use")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE,
+                        help="Number of titles read from the database at a time. Default=%(default)s")
     args = parser.parse_args()
 
     if not args.database_path.exists():
         eprint(f"Error: database {args.database_path} does not exist")
         return 1
+    if args.date and (args.begin_date or args.end_date):
+        eprint("Error: use either --date or --begin-date/--end-date")
+        return 1
+    if args.date:
+        begin = end = args.date
+    elif args.begin_date and args.end_date:
+        begin, end = args.begin_date, args.end_date
+        if not args.output_dir:
+            eprint("Error: --output-dir is required with --begin-date/--end-date")
+            return 1
+    else:
+        eprint("Error: must specify --date or both --begin-date and --end-date")
+        return 1
 
-    engine = create_engine(f"sqlite:///{args.database_path}")
-    session = sessionmaker(bind=engine)
-    with session() as session:
-        descriptions_by_title: dict[str, set[str]] = defaultdict(set)
-        instance: Product
-        for instance in session.query(Product).filter(Product.date == args.date):
-            descriptions_by_title[instance.title].add(instance.description)
-        env = Environment(
-            loader=PackageLoader("dvids_apps")
-        )
-        template = env.get_template("war_layout.jinja")
-        start = 0
-        end = len(descriptions_by_title.items())
-        if args.start:
-            start = args.start
-        if args.end:
-            end = args.end
-        rendered_wars = [template.render(title=title, entries=items) for title, items
-                         in descriptions_by_title.items()]
-        for war in rendered_wars[start:end]:
-            print(war)
+    from dvids_apps.shards import iter_database_connections
+
+    # One connection for a single database file, or one per shard overlapping the dates. Shards split the dates into
+    # disjoint periods in order, so chaining them keeps the dates in order
+    connections = iter_database_connections(args.database_path, begin, end)
+    if args.output_dir:
+        wars_by_date = itertools.chain.from_iterable(iter_wars_by_date(connection, begin, end)
+                                                     for connection in connections)
+        files = write_date_range(wars_by_date, args.output_dir, args.workers, args.start_index or 0, args.end_index)
+        eprint(f"Wrote {files} files to {args.output_dir}")
+    else:
+        for connection in connections:
+            wars = iter_wars(connection, args.date, args.start_index or 0, args.end_index, args.page_size)
+            write_wars(get_template(), args.date, wars, sys.stdout)
 
     return 0
 
@@ -1,36 +1,64 @@
 import os
 import sys
 from argparse import ArgumentParser
-
-import httpx
-import openai
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from typing import Optional, TYPE_CHECKING
 
 from dvids_apps.helpers import path
-from dvids_apps.models.db_models import Product
+
+if TYPE_CHECKING:
+    from dvids_apps.completions import CompletionClient
+    from dvids_apps.models.db_models import Product
 
 
 SM_API_KEY = os.environ.get('SM_API_KEY')
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 
 
-def summarize_product(product: Product) -> str:
-    body_text = product.body.replace("\r\n", "\n")
-    with httpx.Client() as client:
-        resp = client.post(f"https://api.smmry.com?SM_API_KEY={SM_API_KEY}",
-                           data={'sm_api_input': body_text}, timeout=30).json()
-        return resp["sm_api_content"]
+def body_text(product: "Product") -> str:
+    return product.body.replace("\r\n", "\n")
+
+
+async def summarize_product(client: "CompletionClient", product: "Product", num_sentences: Optional[int] = None) -> str:
+    return await client.summarize_smmry(body_text(product), num_sentences)
+
 
+def local_summaries(bodies: list[str], args) -> list[str]:
+    from dvids_apps.summarize import SMMRY_DEFAULT_SENTENCES, summarize_many
+    num_sentences = args.summary_sentences or SMMRY_DEFAULT_SENTENCES
+    return list(summarize_many(bodies, num_sentences, args.summary_method, args.workers))
 
-def gpt_summarize_product(product: Product, model_type: str) -> str:
-    completion = openai.Completion.create(
+
+async def gpt_summarize_product(client: "CompletionClient", product: "Product", model_type: str) -> str:
+    choices = await client.complete(
+        f"Summarize the following article in 5-7 sentences with more sentences being preferred: {product.body}",
         model=model_type,
-        prompt=f"Summarize the following article in 5-7 sentences with more sentences being preferred: {product.body}",
         max_tokens=3000,
         temperature=0.2
     )
-    return '\n'.join([choice.text for choice in completion.choices])
+    return '\n'.join(choices)
+
+
+async def summarize_products(products: list["Product"], args) -> list[tuple[str, Optional[str]]]:
+    """
+    Creates the golden (local or SMMRY) and GPT summaries of every product concurrently, results are in product order.
+    With --golden-only the GPT summaries are None
+    """
+    import asyncio
+    from dvids_apps.completions import CompletionClient
+
+    async with CompletionClient(openai_api_key=OPENAI_API_KEY, smmry_api_key=SM_API_KEY, cache_path=args.cache_path,
+                                max_concurrency=args.max_concurrency) as client:
+        if args.golden == "smmry":
+            golden_summaries = asyncio.gather(*[summarize_product(client, product, args.summary_sentences)
+                                                for product in products])
+        else:
+            # In a thread so the summarizer runs while the GPT requests are in flight
+            golden_summaries = asyncio.to_thread(local_summaries, [body_text(product) for product in products], args)
+        if args.golden_only:
+            return [(golden_summary, None) for golden_summary in await golden_summaries]
+        gpt_summaries = asyncio.gather(*[gpt_summarize_product(client, product, args.model_type)
+                                         for product in products])
+        return list(zip(*await asyncio.gather(golden_summaries, gpt_summaries)))
 
 
 def main() -> int:
@@ -38,27 +66,53 @@ def main() -> int:
     parser.add_argument("--db-path", type=path, help="Path to database", required=True)
     parser.add_argument("--model-type", type=str, help="OpenAI model to use. Default=%(default)s",
                         default="text-davinci-003")
+    parser.add_argument("--cache-path", type=path,
+                        help="Path to the response cache. Default=<db-path>.completion_cache.sqlite3")
+    parser.add_argument("--max-concurrency", type=int, default=8,
+                        help="Maximum number of API requests in flight at once. Default=%(default)s")
+    parser.add_argument("--golden", type=str, choices=["local", "smmry"], default="local",
+                        help="Where the golden extractive summaries come from: the built-in summarizer or the SMMRY "
+                             "API. Default=%(default)s")
+    parser.add_argument("--golden-only", action="store_true", help="Only create the golden summaries, no GPT ones")
+    parser.add_argument("--summary-sentences", type=int,
+                        help="Number of sentences in a golden summary (SMMRY's SM_LENGTH). Default=7")
+    parser.add_argument("--summary-method", type=str, choices=["textrank", "tfidf", "frequency"], default="textrank",
+                        help="How the built-in summarizer ranks sentences. Default=%(default)s")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes running the built-in summarizer. Default=%(default)s")
+    parser.add_argument("--limit", type=int, default=20, help="Number of articles to summarize. Default=%(default)s")
+    parser.add_argument("--skip-duplicates", action="store_true",
+                        help="Only summarize one article per near-duplicate cluster (needs a database loaded with "
+                             "--dedupe)")
     args = parser.parse_args()
-    if SM_API_KEY is None:
+    if args.golden == "smmry" and SM_API_KEY is None:
         print("Error: must set the environment variable SM_API_KEY", file=sys.stderr)
         return 1
-    if OPENAI_API_KEY is None:
+    if not args.golden_only and OPENAI_API_KEY is None:
         print("Error: must set the environment variable OPENAI_API_KEY", file=sys.stderr)
         return 1
-    openai.api_key = OPENAI_API_KEY
+    if args.cache_path is None:
+        args.cache_path = f"{args.db_path}.completion_cache.sqlite3"
+    import asyncio
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from dvids_apps.dedupe import is_cluster_representative
+    from dvids_apps.models.db_models import Product
+
     # Connect to database
     engine = create_engine(f"sqlite:///{args.db_path}")
     session = sessionmaker(bind=engine)
 
     with session() as session:
         # Retrieve N articles
-        for product in session.query(Product).filter(text("length(body)>=2000 and length(body)<=3000"))[0:20]:
-            # Create summaries with SMMRY
-            golden_summary = summarize_product(product)
-            # Send articles to GPT
-            gpt_summary = gpt_summarize_product(product, args.model_type)
+        query = session.query(Product).filter(Product.body_length.between(2000, 3000))
+        if args.skip_duplicates:
+            query = query.filter(is_cluster_representative())
+        products = query[0:args.limit]
+        for golden_summary, gpt_summary in asyncio.run(summarize_products(products, args)):
             print(golden_summary)
-            print(gpt_summary)
+            if gpt_summary is not None:
+                print(gpt_summary)
     return 0
 
 
@@ -1,21 +1,35 @@
 #!/usr/bin/env python
 import argparse
-import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
 import json.decoder
+from contextlib import nullcontext
 import logging
 import math
 import os
 from pathlib import Path
-from typing import cast, Iterator, Union
-import httpx
+from typing import cast, AsyncIterator, Awaitable, Callable, Iterable, Iterator, Optional, TypeVar, Union, \
+    TYPE_CHECKING
 import sys
 
 from datetime import datetime, timedelta
 
 import ujson
 
-from dvids_apps.helpers import make_date_range
-from dvids_apps.models.api_models import SearchResponse, PageInfo, Product, ResolvedProduct, Error, AssetResponse
+from dvids_apps.archives import daily_jsonl_path, JsonlArchiveWriter
+from dvids_apps.helpers import make_date_range, make_temp_file
+from dvids_apps.manifest import STATUS_ERROR, STATUS_FETCHED
+from dvids_apps.metrics import METRICS, Progress, profiled
+from dvids_apps.models.api_models import PageInfo, ResolvedProduct, Error
+from dvids_apps.models.records import ListingRecord, ProductRecord, decode_asset, decode_search_page
+
+if TYPE_CHECKING:
+    # asyncio, httpx and SQLAlchemy are imported where they are used, so --help doesn't wait on them
+    import asyncio
+    import httpx
+    from dvids_apps.bulk_load import BulkLoader
+    from dvids_apps.http_cache import HttpCache
+    from dvids_apps.manifest import DownloadManifest
+    from dvids_apps.scheduler import RequestScheduler
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -24,9 +38,17 @@ handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(me
 logger.addHandler(handler)
 
 
-API_ROOT = 'https://api.dvidshub.net'
+# Overridable so the pipeline can be pointed at a local stand-in (see benchmarks/mock_dvids.py)
+API_ROOT = os.environ.get('DVIDS_API_ROOT', 'https://api.dvidshub.net')
 SECRET_KEY = os.environ.get('DVIDS_SECRET_KEY')
 
+PRODUCTS_FETCHED = METRICS.counter('dvids_products_fetched_total', 'Products resolved through the /asset endpoint')
+DATES_FETCHED = METRICS.counter('dvids_dates_fetched_total', 'Dates fetched, by whether they were complete')
+JSON_SECONDS = METRICS.histogram('dvids_json_decode_seconds', 'Time to decode a response body, by endpoint')
+SAVE_SECONDS = METRICS.histogram('dvids_save_seconds', 'Time to write a product to disk, by format')
+
+T = TypeVar('T')
+
 
 def make_query_string(**query_args) -> str:
     return '?' + '&'.join([f'{key}={value}' for key, value in query_args.items()])
@@ -37,88 +59,286 @@ def make_page_range(total_results: int, per_page: int) -> Iterator[int]:
         yield page
 
 
-async def get_response(client: httpx.AsyncClient, url_to_query: str, retry_attempt: int = 0) -> httpx.Response:
-    logger.debug('Making request to %s', url_to_query)
-    try:
-        response = await client.get(url_to_query)
-        return response
-    except httpx.HTTPError:
-        retry_time = 1 + retry_attempt
-        logger.warning('Exception thrown for url %s, retrying in %d seconds', url_to_query, retry_time)
-        await asyncio.sleep(retry_time)
-        return await get_response(client, url_to_query, retry_attempt + 1)
+async def get_response(client: "httpx.AsyncClient", scheduler: "RequestScheduler", url_to_query: str,
+                       cache: Optional["HttpCache"] = None, max_age: float = 0.0) -> "httpx.Response":
+    """
+    GETs a URL through the scheduler, or through the HTTP cache if one is given (serving it locally if it was cached
+    less than max_age seconds ago)
+    """
+    if cache is not None:
+        return await cache.get(client, scheduler, url_to_query, max_age)
+    return await scheduler.get(client, url_to_query)
 
 
-async def get_product_data(client: httpx.AsyncClient, product_id: str) -> Union[ResolvedProduct, Error]:
+async def get_product_data(client: "httpx.AsyncClient", scheduler: "RequestScheduler", product_id: str,
+                           cache: Optional["HttpCache"] = None, max_age: float = 0.0) -> Union[ResolvedProduct, Error]:
+    import httpx
     query_string = make_query_string(api_key=SECRET_KEY, id=product_id)
     url_to_query = f'{API_ROOT}/asset{query_string}'
-    response = await get_response(client, url_to_query)
+    try:
+        response = await get_response(client, scheduler, url_to_query, cache, max_age)
+    except httpx.HTTPError as e:
+        # The scheduler gave up retrying, only this product fails
+        logger.warning('Error with ID %s: %s', product_id, e)
+        return {'errors': [f'Error with ID {product_id}: {e}']}
     if response.status_code >= 400:
         logger.warning('Error with ID %s', product_id)
         try:
             return cast(Error, response.json())
         except json.decoder.JSONDecodeError:
             return {'errors': [f'Error with ID {product_id}']}
-    result: AssetResponse = cast(AssetResponse, response.json())
-    return result['results']
+    with JSON_SECONDS.time(endpoint='asset'):
+        return cast(ResolvedProduct, decode_asset(response.content))
 
 
-async def get_page_date(client: httpx.AsyncClient, date: datetime, page: int) -> Union[Error, tuple[PageInfo, list[Product]]]:
+async def get_page_date(client: "httpx.AsyncClient", scheduler: "RequestScheduler", date: datetime, page: int,
+                        cache: Optional["HttpCache"] = None,
+                        max_age: float = 0.0) -> Union[Error, tuple[PageInfo, list[ListingRecord]]]:
+    import httpx
     end_date = date + timedelta(hours=23, minutes=59, seconds=59)
     query_string = make_query_string(from_publishdate=date.isoformat(),
                                      to_publishdate=end_date.isoformat(),
                                      api_key=SECRET_KEY, short_description_length=300, page=page)
     url_to_query = f'{API_ROOT}/search{query_string}'
-    response = await get_response(client, url_to_query)
+    try:
+        response = await get_response(client, scheduler, url_to_query, cache, max_age)
+    except httpx.HTTPError as e:
+        logger.warning('Error getting page data for date %s, page %d: %s', date, page, e)
+        return {'errors': [f'Error getting page data for date {date}, page {page}: {e}']}
     if response.status_code >= 400:
         logger.warning('Error getting page data for date %s, page %d', date, page)
-        return cast(Error, response.json())
-    result: SearchResponse = cast(SearchResponse, response.json())
-    results: list[Product] = result['results']
-    return result['page_info'], results
+        try:
+            return cast(Error, response.json())
+        except json.decoder.JSONDecodeError:
+            return {'errors': [f'Error getting page data for date {date}, page {page}']}
+    with JSON_SECONDS.time(endpoint='search'):
+        return decode_search_page(response.content)
+
 
+def valid_product(product: ListingRecord) -> bool:
+    return 'graphics' not in product.id and 'publication_issue' not in product.id
 
-def valid_product(product: Product) -> bool:
-    return 'graphics' not in product['id'] and 'publication_issue' not in product['id']
+
+async def as_completed_bounded(coroutines: Iterable[Awaitable[T]], limit: int) -> AsyncIterator[T]:
+    """
+    Runs the coroutines as tasks and yields their results as they complete, like asyncio.as_completed, but only
+    starts a new one while fewer than limit are running or waiting to be consumed. A slow consumer holds back new
+    tasks instead of letting finished results pile up
+    """
+    import asyncio
+    pending: set[asyncio.Future] = set()
+    try:
+        for coroutine in coroutines:
+            while len(pending) >= limit:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+            pending.add(asyncio.ensure_future(coroutine))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
 
 
-async def get_date_data(date: datetime) -> list[ResolvedProduct]:
+async def get_date_data(client: "httpx.AsyncClient", scheduler: "RequestScheduler", date: datetime,
+                        on_product: Callable[[ResolvedProduct], Awaitable[None]],
+                        manifest: Optional["DownloadManifest"] = None, cache: Optional["HttpCache"] = None,
+                        max_pending: int = 100) -> tuple[int, bool]:
+    """
+    Gets every product published on the given date. Each resolved product is handed to on_product as soon as its
+    lookup completes, with at most max_pending lookups running or waiting on on_product, so memory stays bounded
+    however many products the date has. Returns the number of products resolved and whether the date was fetched
+    completely (no failed search pages or asset lookups). If a manifest is given, products that are unchanged since
+    they were last fetched are not looked up again. If a cache is given, responses are served from it for as long as
+    the date's age allows (see http_cache.max_age_for_date).
+    """
+    import asyncio
     logger.info('Getting data for date %s', date)
-    products_to_query: list[Product] = []
-    client: httpx.AsyncClient
-    async with httpx.AsyncClient() as client:
-        # Need to make one request first serially and then can get the rest parallel
-        initial_page_info, initial_results = await get_page_date(client, date, 1)
-        total_results = initial_page_info['total_results']
-        per_page = initial_page_info['results_per_page']
-        products_to_query.extend(initial_results)
-        if total_results > per_page:
-            # Need to paginate
-            page_results = await asyncio.gather(
-                *[get_page_date(client, date, page) for page in make_page_range(total_results, per_page)]
-            )
-            for _, results in page_results:
-                products_to_query.extend(results)
-        resolved_products = await asyncio.gather(
-            *[get_product_data(client, product['id']) for product in products_to_query if valid_product(product)]
+    max_age = 0.0
+    if cache is not None:
+        from dvids_apps.http_cache import max_age_for_date
+        max_age = max_age_for_date(date)
+    products_to_query: list[ListingRecord] = []
+    complete = True
+    # Need to make one request first serially and then can get the rest parallel
+    initial_page = await get_page_date(client, scheduler, date, 1, cache, max_age)
+    if isinstance(initial_page, dict):
+        logger.error('Unable to get data for date %s: %s', date, initial_page['errors'])
+        return 0, False
+    initial_page_info, initial_results = initial_page
+    total_results = initial_page_info['total_results']
+    per_page = initial_page_info['results_per_page']
+    products_to_query.extend(initial_results)
+    if total_results > per_page:
+        # Need to paginate, the scheduler keeps the number of requests in flight bounded
+        page_results = await asyncio.gather(
+            *[get_page_date(client, scheduler, date, page, cache, max_age)
+              for page in make_page_range(total_results, per_page)]
         )
-        valid_products = [product for product in resolved_products if 'id' in product]
-        return cast(list[ResolvedProduct], valid_products)
+        for page_result in page_results:
+            if isinstance(page_result, dict):
+                complete = False
+                continue
+            _, results = page_result
+            products_to_query.extend(results)
+    products_to_query = [product for product in products_to_query if valid_product(product)]
+    if manifest is not None:
+        manifest.record_listing(date, products_to_query)
+        changed_products = manifest.filter_changed(products_to_query)
+        logger.info('Skipping %d unchanged products for date %s', len(products_to_query) - len(changed_products),
+                    date)
+        products_to_query = changed_products
+
+    async def lookup(product_id: str) -> tuple[str, Union[ResolvedProduct, Error]]:
+        return product_id, await get_product_data(client, scheduler, product_id, cache, max_age)
+
+    resolved_count = 0
+    failed_ids: list[str] = []
+    lookups = (lookup(product.id) for product in products_to_query)
+    async for product_id, resolved in as_completed_bounded(lookups, max_pending):
+        if 'id' not in resolved:
+            failed_ids.append(product_id)
+            continue
+        PRODUCTS_FETCHED.inc()
+        resolved_count += 1
+        await on_product(cast(ResolvedProduct, resolved))
+    if failed_ids:
+        complete = False
+        if manifest is not None:
+            manifest.set_status(failed_ids, STATUS_ERROR)
+    return resolved_count, complete
+
+
+def save_product(parent_folder: Path, product: ResolvedProduct) -> None:
+    """
+    Writes a product to <parent_folder>/<id>.json through a temporary file, so an interrupted run never leaves a
+    truncated file behind
+    """
+    output_path = parent_folder.joinpath(f"{product['id'].replace(':', '_')}.json")
+    with SAVE_SECONDS.time(format='json'):
+        fd, temp_path = make_temp_file(output_path)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as output_file:
+                output_file.write(ujson.dumps(product))
+            os.replace(temp_path, output_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+def write_archive_product(archive: JsonlArchiveWriter, product: ResolvedProduct) -> None:
+    with SAVE_SECONDS.time(format='jsonl'):
+        archive.write(product)
+
 
+class ProductWriter:
+    """
+    Saves one date's products as they arrive, with the disk I/O done in a thread pool so the event loop keeps
+    fetching. json writes each product to its own file under YYYYMMDD/ (up to max_pending writes at once), so every
+    product is on disk as soon as its write finishes. jsonl streams the products into the date's archive, which
+    close() moves into place.
+    """
 
-def save_data(output_dir: str, date_saving: datetime, products_to_save: list[ResolvedProduct]) -> None:
-    date_folder = datetime.strftime(date_saving, '%Y%m%d')
-    parent_folder = Path(output_dir).joinpath(date_folder)
-    if not parent_folder.exists() and len(products_to_save) > 0:
-        parent_folder.mkdir(parents=True)
-    for product in products_to_save:
-        output_path = parent_folder.joinpath(f"{product['id'].replace(':', '_')}.json")
-        with open(output_path, 'w+', encoding='utf-8') \
-                as output_file:
-            output_file.write(ujson.dumps(product))
+    def __init__(self, output_dir: str, output_format: str, date: datetime, pool: Executor, max_pending: int = 32):
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.date = date
+        self.pool = pool
+        self.max_pending = max_pending
+        self.pending: set = set()
+        self.archive: Optional[JsonlArchiveWriter] = None
+        self.parent_folder = Path(output_dir).joinpath(datetime.strftime(date, '%Y%m%d'))
+        self._parent_folder_created = False
+
+    async def _wait_pending(self, return_when: str) -> None:
+        import asyncio
+        done, self.pending = await asyncio.wait(self.pending, return_when=return_when)
+        for future in done:
+            future.result()
+
+    async def write(self, product: ResolvedProduct) -> None:
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if self.output_format == 'jsonl':
+            if self.archive is None:
+                self.archive = await loop.run_in_executor(self.pool, JsonlArchiveWriter,
+                                                          daily_jsonl_path(self.output_dir, self.date))
+            # Lines of one archive have to be written in order, one at a time
+            await loop.run_in_executor(self.pool, write_archive_product, self.archive, product)
+            return
+        if not self._parent_folder_created:
+            self.parent_folder.mkdir(parents=True, exist_ok=True)
+            self._parent_folder_created = True
+        while len(self.pending) >= self.max_pending:
+            await self._wait_pending(asyncio.FIRST_COMPLETED)
+        self.pending.add(loop.run_in_executor(self.pool, save_product, self.parent_folder, product))
+
+    async def close(self) -> None:
+        """
+        Waits for every write to finish and commits the archive
+        """
+        import asyncio
+        if self.pending:
+            await self._wait_pending(asyncio.ALL_COMPLETED)
+        if self.archive is not None:
+            await asyncio.get_running_loop().run_in_executor(self.pool, self.archive.commit)
+            self.archive = None
+
+    async def abort(self) -> None:
+        """
+        Waits for the writes in progress and throws away the uncommitted archive. Product files already written are
+        kept
+        """
+        import asyncio
+        if self.pending:
+            await asyncio.wait(self.pending)
+            self.pending = set()
+        if self.archive is not None:
+            await asyncio.get_running_loop().run_in_executor(self.pool, self.archive.abort)
+            self.archive = None
+
+
+async def database_writer(product_queue: "asyncio.Queue", loader: "BulkLoader") -> None:
+    """
+    Consumes product records from the queue until it gets None, writing them to the database in batches. The
+    blocking database writes happen in a worker thread so fetching carries on while a batch is committed. A callable
+    in the queue is called once every record queued before it has been committed, that's when a date's products can
+    be recorded in the manifest. Pending callbacks are flushed early when the queue runs dry, so they never wait on
+    a batch that won't fill up.
+    """
+    import asyncio
+    on_commit: list[Callable[[], None]] = []
+
+    async def flush() -> None:
+        await asyncio.to_thread(loader.flush)
+        for callback in on_commit:
+            callback()
+        on_commit.clear()
+
+    while True:
+        item = await product_queue.get()
+        if item is None:
+            break
+        if isinstance(item, ProductRecord):
+            loader.add_record(item)
+        else:
+            on_commit.append(item)
+        if loader.full or (on_commit and product_queue.empty()):
+            await flush()
+    await flush()
+    logger.info('Wrote %d products to the database', loader.rows_written)
 
 
 async def async_main(args) -> int:
+    import asyncio
+    import httpx
+    from dvids_apps.http_cache import HttpCache
+    from dvids_apps.manifest import DownloadManifest
+    from dvids_apps.scheduler import RequestScheduler, http2_available, make_client
+
     begin_date_str = args.begin
     end_date_str = args.end
     date_str = args.date
@@ -128,12 +348,108 @@ async def async_main(args) -> int:
     if date_str:
         begin_date_str = date_str
         end_date_str = date_str
+    if not args.output_dir and not args.database_path:
+        logger.error('Must specify at least one of --output-dir or --database-path')
+        return 1
+    if args.http2 and not http2_available():
+        logger.error('--http2 needs the h2 package, install httpx[http2]')
+        return 1
     begin_date = datetime.strptime(begin_date_str, '%Y%m%d')
     end_date = datetime.strptime(end_date_str, '%Y%m%d')
-    for date_to_query in make_date_range(begin_date, end_date):
-        products_for_date = await get_date_data(date_to_query)
-        save_data(args.output_dir, date_to_query, products_for_date)
-        await asyncio.sleep(5)
+    scheduler = RequestScheduler(max_concurrency=args.max_concurrency, requests_per_second=args.requests_per_second,
+                                 max_retries=args.max_retries)
+    dates_to_query = iter(make_date_range(begin_date, end_date))
+    manifest: Optional[DownloadManifest] = None
+    if args.incremental:
+        if args.manifest:
+            manifest_path = Path(args.manifest)
+        elif args.output_dir:
+            manifest_path = Path(args.output_dir).joinpath('.manifest.sqlite3')
+        else:
+            manifest_path = Path(f'{args.database_path}.manifest.sqlite3')
+        Path(manifest_path).parent.mkdir(parents=True, exist_ok=True)
+        manifest = DownloadManifest(manifest_path)
+    cache: Optional[HttpCache] = None
+    if args.http_cache:
+        cache = HttpCache(args.http_cache, revalidate=args.http_cache_revalidate)
+    product_queue: Optional[asyncio.Queue] = None
+    database_task: Optional[asyncio.Task] = None
+    if args.database_path:
+        from sqlalchemy import create_engine
+        from dvids_apps.bulk_load import BulkLoader
+        from dvids_apps.migrations import upgrade_schema
+
+        engine = create_engine(f'sqlite:///{args.database_path}')
+        upgrade_schema(engine)
+        # Bounded so a slow writer applies back pressure to the fetchers instead of letting products pile up
+        product_queue = asyncio.Queue(maxsize=args.queue_size)
+        database_task = asyncio.create_task(database_writer(product_queue, BulkLoader(engine, args.batch_size)))
+
+    async def date_worker(client: httpx.AsyncClient) -> None:
+        # Workers share one date iterator, so several days are in flight at once and the scheduler (rather than a
+        # fixed sleep between days) decides how fast requests go out
+        for date_to_query in dates_to_query:
+            if manifest is not None and args.skip_completed_dates and manifest.is_date_complete(date_to_query):
+                logger.info('Skipping completed date %s', date_to_query)
+                continue
+            writer = None
+            if args.output_dir:
+                writer = ProductWriter(args.output_dir, args.output_format, date_to_query, writer_pool,
+                                       args.writer_threads * 2)
+            fetched_ids: list[str] = []
+
+            async def on_product(product: ResolvedProduct) -> None:
+                if writer is not None:
+                    await writer.write(product)
+                if product_queue is not None:
+                    if database_task.done():
+                        # Surface the writer's exception rather than blocking forever on a full queue
+                        database_task.result()
+                    await product_queue.put(ProductRecord.from_dict(product))
+                fetched_ids.append(product['id'])
+
+            try:
+                _, complete = await get_date_data(client, scheduler, date_to_query, on_product, manifest, cache,
+                                                  max(1, args.max_concurrency * 2))
+                if writer is not None:
+                    await writer.close()
+            except BaseException:
+                if writer is not None:
+                    await writer.abort()
+                raise
+            DATES_FETCHED.inc(complete=complete)
+            if manifest is None:
+                continue
+
+            def record_date(fetched_ids: list[str] = fetched_ids, date: datetime = date_to_query,
+                            complete: bool = complete) -> None:
+                manifest.set_status(fetched_ids, STATUS_FETCHED)
+                if complete:
+                    manifest.mark_date_complete(date)
+
+            # Only recorded once the date's products are all on disk and committed to the database, an interrupted
+            # date is fetched again
+            if product_queue is not None:
+                await product_queue.put(record_date)
+            else:
+                record_date()
+
+    writer_pool = ThreadPoolExecutor(max_workers=args.writer_threads, thread_name_prefix='writer')
+    try:
+        async with make_client(args.max_concurrency, args.http2) as client:
+            await asyncio.gather(*[date_worker(client) for _ in range(max(1, args.concurrent_dates))])
+        if product_queue is not None:
+            await product_queue.put(None)
+            await database_task
+    finally:
+        if database_task is not None and not database_task.done():
+            database_task.cancel()
+        if manifest is not None:
+            manifest.close()
+        if cache is not None:
+            cache.close()
+        writer_pool.shutdown()
+    return 0
 
 
 def main() -> None:
@@ -143,9 +459,66 @@ def main() -> None:
     parser.add_argument('--begin', type=str, help='Beginning date to query')
     parser.add_argument('--end', type=str, help='End date to query')
     parser.add_argument('--output-dir', type=str, help='Path to save output data to')
+    parser.add_argument('--output-format', type=str, choices=['json', 'jsonl'], default='json',
+                        help='json writes one file per product under YYYYMMDD/, jsonl packs each date into one '
+                             'YYYYMMDD.jsonl.gz archive. Default=%(default)s')
+    parser.add_argument('--writer-threads', type=int, default=4,
+                        help='Number of threads writing products to --output-dir. Default=%(default)s')
+    parser.add_argument('--database-path', type=str,
+                        help='Path to a SQLite database to stream products into as they are fetched (JSON files are '
+                             'only written if --output-dir is also given)')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Number of products per database insert batch. Default=%(default)s')
+    parser.add_argument('--queue-size', type=int, default=5000,
+                        help='Maximum number of fetched products waiting to be written to the database. '
+                             'Default=%(default)s')
+    parser.add_argument('--max-concurrency', type=int, default=10,
+                        help='Maximum number of requests in flight at once. Default=%(default)s')
+    parser.add_argument('--requests-per-second', type=float, default=10.0,
+                        help='Sustained request rate limit, 0 disables rate limiting. Default=%(default)s')
+    parser.add_argument('--max-retries', type=int, default=5,
+                        help='Maximum number of retries per request. Default=%(default)s')
+    parser.add_argument('--concurrent-dates', type=int, default=2,
+                        help='Number of dates to fetch concurrently. Default=%(default)s')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only fetch products that are new or changed since the last run (tracked in a manifest)')
+    parser.add_argument('--manifest', type=str,
+                        help='Path to the download manifest used by --incremental. Default=<output-dir>/'
+                             '.manifest.sqlite3')
+    parser.add_argument('--skip-completed-dates', action='store_true',
+                        help='With --incremental, skip dates that were already fetched completely')
+    parser.add_argument('--http-cache', type=str,
+                        help='Directory to cache API responses in. Responses are reused without a request while '
+                             'fresh (15 minutes for the last two days up to 30 days for dates older than a month) '
+                             'and revalidated with ETag/Last-Modified after that')
+    parser.add_argument('--http-cache-revalidate', action='store_true',
+                        help='Revalidate every cached response with the server instead of trusting fresh ones')
+    parser.add_argument('--http2', action=argparse.BooleanOptionalAction,
+                        help='Multiplex requests over one HTTP/2 connection. Default: on when the h2 package is '
+                             'installed')
+    parser.add_argument('--metrics-file', type=str,
+                        help='Write request, retry, timing and throughput metrics here at the end of the run '
+                             '(Prometheus text format for .prom/.txt, JSON otherwise)')
+    parser.add_argument('--progress', action=argparse.BooleanOptionalAction,
+                        help='Show a live progress line on stderr. Default: on when stderr is a terminal')
+    parser.add_argument('--profile', type=str, help='Profile the run with cProfile and write the stats here')
     args = parser.parse_args()
 
-    sys.exit(asyncio.run(async_main(args)))
+    import asyncio
+    progress_fields = [('requests', 'dvids_requests_total'), ('retries', 'dvids_request_retries_total'),
+                       ('dates', 'dvids_dates_fetched_total'), ('products', 'dvids_products_fetched_total')]
+    if args.http_cache:
+        progress_fields.append(('cached', 'dvids_http_cache_hits_total'))
+    if args.database_path:
+        progress_fields.append(('written', 'dvids_products_written_total'))
+    show_progress = args.progress if args.progress is not None else sys.stderr.isatty()
+    try:
+        with profiled(args.profile), Progress(METRICS, progress_fields) if show_progress else nullcontext():
+            exit_code = asyncio.run(async_main(args))
+    finally:
+        if args.metrics_file:
+            METRICS.write(args.metrics_file)
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
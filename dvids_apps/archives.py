@@ -0,0 +1,127 @@
+import gzip
+import os
+import re
+import zipfile
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+from typing import Any, Iterator, Union
+
+import ujson
+
+from dvids_apps.helpers import eprint, make_temp_file
+
+DATE_FOLDER_FORMAT = "%Y%m%d"
+JSONL_SUFFIX = ".jsonl.gz"
+_DATE_FOLDER_PATTERN = re.compile(r"^\d{8}$")
+
+
+def daily_jsonl_path(data_dir: Union[str, Path], date: datetime) -> Path:
+    """
+    Path of the packed archive for a date: one gzipped JSON document per line instead of a file per product
+    """
+    return Path(data_dir).joinpath(f"{date.strftime(DATE_FOLDER_FORMAT)}{JSONL_SUFFIX}")
+
+
+def is_jsonl_archive(file: Union[str, Path]) -> bool:
+    return str(file).endswith(JSONL_SUFFIX)
+
+
+def read_jsonl(file: Union[str, Path]) -> Iterator[dict[str, Any]]:
+    with gzip.open(file, "rt", encoding="utf-8") as jsonl_file:
+        for line_number, line in enumerate(jsonl_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield ujson.loads(line)
+            except ujson.JSONDecodeError as e:
+                eprint(f"Unable to load json from {file} line {line_number}")
+                raise e
+
+
+class JsonlArchiveWriter:
+    """
+    Streams products into a gzipped JSONL archive one at a time, for when they arrive one by one. They are written to a
+    temporary file which commit() renames into place, after copying over the products of the existing archive that
+    weren't written again, so readers never see a partially written day
+    """
+
+    def __init__(self, file: Union[str, Path]):
+        self.file = Path(file)
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        fd, self.temp_path = make_temp_file(self.file)
+        self._raw_file = os.fdopen(fd, "wb")
+        self._jsonl_file = gzip.open(self._raw_file, "wt", encoding="utf-8")
+        self.ids: set[str] = set()
+
+    def write(self, product: dict[str, Any]) -> None:
+        self._jsonl_file.write(ujson.dumps(product))
+        self._jsonl_file.write("\n")
+        self.ids.add(product["id"])
+
+    def _close(self) -> None:
+        self._jsonl_file.close()
+        self._raw_file.close()
+
+    def commit(self) -> int:
+        """
+        Moves the archive into place, returns the number of products written. If nothing was written the existing
+        archive is left as it is
+        """
+        if not self.ids:
+            self.abort()
+            return 0
+        try:
+            if self.file.exists():
+                for product in read_jsonl(self.file):
+                    if product["id"] not in self.ids:
+                        self._jsonl_file.write(ujson.dumps(product))
+                        self._jsonl_file.write("\n")
+            self._close()
+            os.replace(self.temp_path, self.file)
+        except BaseException:
+            self.abort()
+            raise
+        return len(self.ids)
+
+    def abort(self) -> None:
+        self._close()
+        if os.path.exists(self.temp_path):
+            os.unlink(self.temp_path)
+
+
+def zip_members_by_date(zip_file: zipfile.ZipFile, begin: datetime, end: datetime) -> dict[datetime, list[str]]:
+    """
+    Groups the .json members of a zip by their YYYYMMDD parent folder, keeping only dates within [begin, end]. The
+    folders may be nested (e.g. data/20230101/news_1.json). Only the central directory is read
+    """
+    members: dict[datetime, list[str]] = {}
+    for info in zip_file.infolist():
+        if info.is_dir() or not info.filename.endswith(".json"):
+            continue
+        folder = PurePosixPath(info.filename).parent.name
+        if not _DATE_FOLDER_PATTERN.match(folder):
+            continue
+        date = datetime.strptime(folder, DATE_FOLDER_FORMAT)
+        if begin <= date <= end:
+            members.setdefault(date, []).append(info.filename)
+    return dict(sorted(members.items()))
+
+
+def read_zip_member(zip_file: zipfile.ZipFile, name: str) -> dict[str, Any]:
+    # Decompressed straight from the archive, nothing is extracted to disk
+    with zip_file.open(name) as member:
+        try:
+            return ujson.load(member)
+        except ujson.JSONDecodeError as e:
+            eprint(f"Unable to load json from {name}")
+            raise e
+
+
+def iter_zip(zip_path: Union[str, Path], begin: datetime,
+             end: datetime) -> Iterator[tuple[datetime, Iterator[dict[str, Any]]]]:
+    """
+    Yields each date in the range found in the zip along with a lazy iterator over its products
+    """
+    with zipfile.ZipFile(zip_path) as zip_file:
+        for date, names in zip_members_by_date(zip_file, begin, end).items():
+            yield date, (read_zip_member(zip_file, name) for name in names)
@@ -0,0 +1,287 @@
+import zipfile
+from pathlib import Path
+from typing import Any, Iterable, Optional, Union
+
+import ujson
+from sqlalchemy import create_engine, delete, event, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from dvids_apps.archives import is_jsonl_archive, read_jsonl, read_zip_member
+from dvids_apps.dedupe import Deduplicator, remove_signatures
+from dvids_apps.helpers import eprint
+from dvids_apps.metrics import METRICS
+from dvids_apps.models.db_models import Base, Product, Credit, File, ProductKeyword, ProductSignature, SignatureBand
+from dvids_apps.models.records import ProductRecord, RowsTuple, parse_datetime
+from dvids_apps.rollups import index_keywords, rebuild_rollups, refresh_days
+from dvids_apps.search import drop_search_triggers, create_search_triggers, has_search_triggers, \
+    rebuild_search_index
+
+ProductRows = RowsTuple
+
+PRODUCTS_PARSED = METRICS.counter("dvids_products_parsed_total", "Products parsed into rows and queued for writing")
+PRODUCTS_WRITTEN = METRICS.counter("dvids_products_written_total", "Products inserted or updated in the database")
+FLUSH_SECONDS = METRICS.histogram("dvids_flush_seconds", "Time to write and commit one batch of products")
+
+
+def product_to_rows(json_data: dict[str, Any]) -> ProductRows:
+    """
+    Maps a resolved product (as returned by the /asset endpoint) to plain rows for the products, credits and files
+    tables. Builds the rows straight from the dict, going through a ProductRecord is slower when the record isn't kept
+    """
+    get = json_data.get
+    product_id = get("id")
+    product_row = {
+        "id": product_id,
+        "branch": get("branch"),
+        "description": get("description"),
+        "keywords": get("keywords"),
+        "date": parse_datetime(get("date")),
+        "date_published": parse_datetime(get("date_published")),
+        "image": get("image"),
+        "timestamp": parse_datetime(get("timestamp")),
+        "title": get("title"),
+        "unit_name": get("unit_name"),
+        "url": get("url"),
+        "virin": get("virin"),
+        "body": get("body")
+    }
+    credit_rows = [{
+        "credit_id": credit_data.get("id"),
+        "name": credit_data.get("name"),
+        "rank": credit_data.get("rank"),
+        "url": credit_data.get("url"),
+        "asset_id": product_id
+    } for credit_data in get("credits") or []]
+    file_rows = [{
+        "src": file_data.get("src"),
+        "type": file_data.get("type"),
+        "height": file_data.get("height"),
+        "width": file_data.get("width"),
+        "bitrate": file_data.get("bitrate"),
+        "asset_id": product_id
+    } for file_data in get("files") or []]
+    return product_row, credit_rows, file_rows
+
+
+def read_product_file(file: Union[str, Path]) -> dict[str, Any]:
+    with open(file, "rb") as json_file:
+        try:
+            return ujson.loads(json_file.read())
+        except ujson.JSONDecodeError as e:
+            eprint(f"Unable to load json from {file}")
+            raise e
+
+
+def parse_product_files(files: list[Path]) -> list[ProductRows]:
+    """
+    Reads and maps a chunk of product files to rows. Meant to run in a worker process, the rows are plain dicts so
+    they are cheap to send back to the writer
+    """
+    rows: list[ProductRows] = []
+    for file in files:
+        if is_jsonl_archive(file):
+            rows.extend(product_to_rows(json_data) for json_data in read_jsonl(file))
+        else:
+            rows.append(product_to_rows(read_product_file(file)))
+    return rows
+
+
+# Each worker process keeps its zip open between chunks instead of re-reading the central directory every time
+_open_zips: dict[str, zipfile.ZipFile] = {}
+
+
+def parse_zip_members(zip_path: Union[str, Path], names: list[str]) -> list[ProductRows]:
+    """
+    Like parse_product_files, but for members of a zip archive
+    """
+    zip_file = _open_zips.get(str(zip_path))
+    if zip_file is None:
+        zip_file = _open_zips[str(zip_path)] = zipfile.ZipFile(zip_path)
+    return [product_to_rows(read_zip_member(zip_file, name)) for name in names]
+
+
+class BulkLoader:
+    """
+    Collects product/credit/file rows and writes them in batches with executemany-style Core inserts, bypassing the
+    ORM unit of work. Products that already exist are updated in place and their credits/files replaced, so loading
+    the same data twice is safe. Each batch also updates the keyword index and recomputes the rollups of the days it
+    touched, unless refresh_rollups is off (create_indexes rebuilds them once after a load with dropped indexes).
+    """
+
+    def __init__(self, engine: Engine, batch_size: int = 1000, deduplicator: Optional[Deduplicator] = None,
+                 refresh_rollups: bool = True):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.deduplicator = deduplicator
+        self.refresh_rollups = refresh_rollups
+        # Keyed by product id so the last copy wins if the same product shows up twice in one batch
+        self.batch: dict[str, ProductRows] = {}
+        self.rows_written = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self.batch)
+
+    @property
+    def full(self) -> bool:
+        return self.pending >= self.batch_size
+
+    def add_rows(self, rows: ProductRows) -> None:
+        self.batch[rows[0]["id"]] = rows
+        PRODUCTS_PARSED.inc()
+
+    def add(self, json_data: dict[str, Any]) -> None:
+        self.add_rows(product_to_rows(json_data))
+
+    def add_record(self, record: ProductRecord) -> None:
+        self.add_rows(record.to_rows())
+
+    def add_many(self, products: Iterable[dict[str, Any]]) -> None:
+        for json_data in products:
+            self.add(json_data)
+            if self.full:
+                self.flush()
+
+    def flush(self) -> int:
+        """
+        Writes all pending rows in a single transaction, returns the number of products written
+        """
+        if not self.batch:
+            return 0
+        product_ids = list(self.batch)
+        product_rows = [rows[0] for rows in self.batch.values()]
+        credit_rows = [credit_row for rows in self.batch.values() for credit_row in rows[1]]
+        file_rows = [file_row for rows in self.batch.values() for file_row in rows[2]]
+        upsert = sqlite_insert(Product.__table__)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[Product.__table__.c.id],
+            set_={column.name: upsert.excluded[column.name] for column in Product.__table__.c
+                  if column.name != "id" and column.computed is None}
+        )
+        with FLUSH_SECONDS.time(), self.engine.begin() as connection:
+            # Only products that are already in the database need their old credits/files removed, checking the
+            # primary key first keeps fresh loads from scanning the child tables at all. Their old dates are the
+            # days whose rollups they leave
+            existing_dates: dict[str, Any] = {}
+            # Stay under SQLite's bound parameter limit
+            for i in range(0, len(product_ids), 500):
+                chunk = product_ids[i:i + 500]
+                existing_dates.update(connection.execute(
+                    select(Product.__table__.c.id, Product.__table__.c.date).where(Product.__table__.c.id.in_(chunk))
+                ).all())
+            existing_ids = list(existing_dates)
+            for i in range(0, len(existing_ids), 500):
+                chunk = existing_ids[i:i + 500]
+                connection.execute(delete(Credit.__table__).where(Credit.__table__.c.asset_id.in_(chunk)))
+                connection.execute(delete(File.__table__).where(File.__table__.c.asset_id.in_(chunk)))
+            connection.execute(upsert, product_rows)
+            if credit_rows:
+                connection.execute(insert(Credit.__table__), credit_rows)
+            if file_rows:
+                connection.execute(insert(File.__table__), file_rows)
+            if self.deduplicator is not None:
+                self.deduplicator.index_products(connection, product_rows)
+            index_keywords(connection, product_rows, existing_ids)
+            if self.refresh_rollups:
+                days = {row["date"].date() for row in product_rows}
+                days.update(date.date() for date in existing_dates.values() if date is not None)
+                refresh_days(connection, days)
+        written = len(product_rows)
+        self.rows_written += written
+        PRODUCTS_WRITTEN.inc(written)
+        self.batch = {}
+        return written
+
+    def __enter__(self) -> 'BulkLoader':
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.flush()
+
+
+def delete_products(engine: Engine, product_ids: list[str]) -> int:
+    """
+    Deletes products with their credits, files, keyword index entries and signatures, and recomputes the rollups of
+    the days they leave. Returns the number of products deleted
+    """
+    with engine.begin() as connection:
+        existing_dates: dict[str, Any] = {}
+        # Stay under SQLite's bound parameter limit
+        for i in range(0, len(product_ids), 500):
+            chunk = product_ids[i:i + 500]
+            existing_dates.update(connection.execute(
+                select(Product.__table__.c.id, Product.__table__.c.date).where(Product.__table__.c.id.in_(chunk))
+            ).all())
+        existing_ids = list(existing_dates)
+        for i in range(0, len(existing_ids), 500):
+            chunk = existing_ids[i:i + 500]
+            connection.execute(delete(Credit.__table__).where(Credit.__table__.c.asset_id.in_(chunk)))
+            connection.execute(delete(File.__table__).where(File.__table__.c.asset_id.in_(chunk)))
+            connection.execute(delete(ProductKeyword.__table__).where(ProductKeyword.__table__.c.asset_id.in_(chunk)))
+        remove_signatures(connection, existing_ids)
+        for i in range(0, len(existing_ids), 500):
+            chunk = existing_ids[i:i + 500]
+            connection.execute(delete(Product.__table__).where(Product.__table__.c.id.in_(chunk)))
+        refresh_days(connection, {date.date() for date in existing_dates.values() if date is not None})
+    return len(existing_ids)
+
+
+# Trade durability for speed while loading: a crash mid-load means re-running the load, which is idempotent anyway.
+# Only settings that last as long as the connection, journal_mode=WAL would stick to the database file
+LOADING_PRAGMAS = (
+    "PRAGMA synchronous=OFF",
+    "PRAGMA cache_size=-262144",
+    "PRAGMA temp_store=MEMORY"
+)
+
+
+def create_loading_engine(database_path: Union[str, Path]) -> Engine:
+    """
+    Creates an engine whose connections are tuned for bulk loading. Only use it for the duration of the load
+    """
+    engine = create_engine(f"sqlite:///{database_path}")
+
+    @event.listens_for(engine, "connect")
+    def set_loading_pragmas(dbapi_connection, _connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for pragma in LOADING_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return engine
+
+
+# Tables whose indexes are queried while loading (near-duplicate lookups), so they are never dropped
+LOAD_TIME_TABLES = frozenset({ProductSignature.__tablename__, SignatureBand.__tablename__})
+
+
+def drop_indexes(engine: Engine) -> None:
+    """
+    Drops every secondary index defined on the models and the triggers maintaining the search index, so a large load
+    doesn't maintain them row by row
+    """
+    for table in Base.metadata.sorted_tables:
+        if table.name in LOAD_TIME_TABLES:
+            continue
+        for index in table.indexes:
+            index.drop(engine, checkfirst=True)
+    drop_search_triggers(engine)
+
+
+def create_indexes(engine: Engine) -> None:
+    """
+    (Re)creates every secondary index defined on the models and refreshes the query planner statistics. If the search
+    index triggers were dropped, they are recreated and the search index is rebuilt in one pass. The rollups are
+    rebuilt too, for loads that didn't refresh them batch by batch
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    if not has_search_triggers(engine):
+        create_search_triggers(engine)
+        rebuild_search_index(engine)
+    rebuild_rollups(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
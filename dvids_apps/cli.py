@@ -0,0 +1,58 @@
+import importlib
+import sys
+from typing import NamedTuple, Optional
+
+
+class Command(NamedTuple):
+    module: str
+    help: str
+
+
+# Subcommand -> module whose main() runs it. Modules are only imported when their command runs, and the scripts
+# themselves import SQLAlchemy, httpx, spaCy etc. after parsing their arguments, so `dvids <command> --help` and
+# dry runs never load them
+COMMANDS: dict[str, Command] = {
+    "download": Command("download_dvids", "Download products from the DVIDS API"),
+    "convert": Command("convert_to_database", "Load downloaded products into a SQLite database"),
+    "upgrade": Command("upgrade_database", "Upgrade a database to the current schema"),
+    "export": Command("export_columnar", "Export products to a Parquet dataset"),
+    "search": Command("search_products", "Full-text search over products"),
+    "facets": Command("product_facets", "Count products by day, unit, branch or keyword"),
+    "fake-war": Command("create_fake_war", "Render fake wars from a date's products"),
+    "gpt-war": Command("gpt_war_cli", "Send a prompt about an input to a GPT model"),
+    "summarize": Command("create_summaries", "Compare SMMRY and GPT summaries of products"),
+    "ner": Command("ner_extraction", "Compare spaCy and GPT named entities"),
+    "score": Command("semantic_scoring", "Score the similarity of summary pairs"),
+    "build-vectors": Command("build_vector_store", "Build a vector store of product embeddings"),
+    "nearest": Command("nearest_articles", "Find the articles nearest to a product or text"),
+    "nlp-server": Command("dvids_apps.nlp_server", "Keep spaCy models loaded for the NLP commands")
+}
+
+
+def print_usage(file=sys.stdout) -> None:
+    print("usage: dvids <command> [arguments]\n\ncommands:", file=file)
+    width = max(len(name) for name in COMMANDS)
+    for name, command in COMMANDS.items():
+        print(f"  {name:<{width}}  {command.help}", file=file)
+    print("\nRun dvids <command> --help for the arguments of a command", file=file)
+
+
+def run_command(name: str, arguments: list[str]) -> Optional[int]:
+    """
+    Runs a command's main() as if its script had been called with the given arguments
+    """
+    module = importlib.import_module(COMMANDS[name].module)
+    sys.argv = [f"dvids {name}", *arguments]
+    return module.main()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print_usage()
+        return 0
+    if argv[0] not in COMMANDS:
+        print(f"dvids: unknown command {argv[0]}\n", file=sys.stderr)
+        print_usage(sys.stderr)
+        return 2
+    return run_command(argv[0], argv[1:]) or 0
@@ -0,0 +1,128 @@
+import os
+from datetime import datetime, timedelta
+from itertools import groupby
+from pathlib import Path
+from typing import Iterator, Optional, Sequence, Union
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow.fs import LocalFileSystem
+from sqlalchemy import select, DateTime, Integer
+from sqlalchemy.engine import Engine
+
+from dvids_apps.models.db_models import Product
+
+DAY_FORMAT = "%Y%m%d"
+PARTITION_KEY = "day"
+PARTITIONING = ds.partitioning(pa.schema([(PARTITION_KEY, pa.string())]), flavor="hive")
+
+
+def _arrow_type(column) -> pa.DataType:
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    return pa.string()
+
+
+PRODUCTS_SCHEMA = pa.schema([(column.name, _arrow_type(column)) for column in Product.__table__.c])
+
+
+def _day_of(row) -> str:
+    return (row.date or datetime(1970, 1, 1)).strftime(DAY_FORMAT)
+
+
+def partition_path(output_dir: Union[str, Path], day: str) -> Path:
+    return Path(output_dir).joinpath(f"{PARTITION_KEY}={day}", "products.parquet")
+
+
+def export_products(engine: Engine, output_dir: Union[str, Path], begin: Optional[datetime] = None,
+                    end: Optional[datetime] = None, batch_size: int = 10_000) -> int:
+    """
+    Exports the products table to Parquet, one file per day under output_dir/day=YYYYMMDD/. Rows are streamed from the
+    database in batches so memory stays bounded by batch_size, and each day's file is written to a temporary path
+    and renamed into place. Returns the number of products exported
+    """
+    products = Product.__table__
+    query = select(products).order_by(products.c.date)
+    if begin:
+        query = query.where(products.c.date >= begin)
+    if end:
+        query = query.where(products.c.date < end + timedelta(days=1))
+    count = 0
+    current_day: Optional[str] = None
+    writer: Optional[pq.ParquetWriter] = None
+    temp_path: Optional[Path] = None
+
+    def finish_day() -> None:
+        if writer is not None:
+            writer.close()
+            os.replace(temp_path, partition_path(output_dir, current_day))
+
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=batch_size).execute(query)
+        for partition in result.partitions():
+            for day, day_rows in groupby(partition, key=_day_of):
+                if day != current_day:
+                    finish_day()
+                    current_day = day
+                    final_path = partition_path(output_dir, day)
+                    final_path.parent.mkdir(parents=True, exist_ok=True)
+                    # Dot-prefixed so dataset discovery ignores it if an export is interrupted
+                    temp_path = final_path.with_name(f".{final_path.name}.tmp")
+                    writer = pq.ParquetWriter(temp_path, PRODUCTS_SCHEMA, compression="zstd")
+                day_rows = [row._asdict() for row in day_rows]
+                writer.write_table(pa.Table.from_pylist(day_rows, schema=PRODUCTS_SCHEMA))
+                count += len(day_rows)
+    finish_day()
+    return count
+
+
+def open_products(dataset_dir: Union[str, Path]) -> ds.Dataset:
+    """
+    Opens an exported products dataset. Files are memory-mapped rather than read into memory
+    """
+    return ds.dataset(str(dataset_dir), format="parquet", partitioning=PARTITIONING,
+                      filesystem=LocalFileSystem(use_mmap=True))
+
+
+def _day_filter(begin: Optional[datetime], end: Optional[datetime]) -> Optional[ds.Expression]:
+    # Filtering on the partition key prunes whole files before any data is read
+    expression = None
+    if begin:
+        expression = ds.field(PARTITION_KEY) >= begin.strftime(DAY_FORMAT)
+    if end:
+        end_expression = ds.field(PARTITION_KEY) <= end.strftime(DAY_FORMAT)
+        expression = end_expression if expression is None else expression & end_expression
+    return expression
+
+
+def load_products(dataset_dir: Union[str, Path], columns: Optional[Sequence[str]] = None,
+                  begin: Optional[datetime] = None, end: Optional[datetime] = None,
+                  filter: Optional[ds.Expression] = None) -> pa.Table:
+    """
+    Loads the given columns (all of them if None) for products in [begin, end]. Only the requested columns are
+    decoded, so skipping body makes scans over years of articles cheap
+    """
+    return open_products(dataset_dir).to_table(columns=list(columns) if columns else None,
+                                               filter=_combine(_day_filter(begin, end), filter))
+
+
+def iter_product_batches(dataset_dir: Union[str, Path], columns: Optional[Sequence[str]] = None,
+                         begin: Optional[datetime] = None, end: Optional[datetime] = None,
+                         filter: Optional[ds.Expression] = None, batch_size: int = 10_000) -> Iterator[pa.RecordBatch]:
+    """
+    Like load_products but yields record batches, for scans that don't fit in memory
+    """
+    yield from open_products(dataset_dir).to_batches(columns=list(columns) if columns else None,
+                                                     filter=_combine(_day_filter(begin, end), filter),
+                                                     batch_size=batch_size)
+
+
+def _combine(first: Optional[ds.Expression], second: Optional[ds.Expression]) -> Optional[ds.Expression]:
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return first & second
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import sqlite3
+from pathlib import Path
+from typing import Any, Iterable, NamedTuple, Optional, Union
+
+import httpx
+import ujson
+
+from dvids_apps.scheduler import RequestScheduler
+
+OPENAI_COMPLETIONS_URL = "https://api.openai.com/v1/completions"
+SMMRY_URL = "https://api.smmry.com"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS completion_cache (
+    key TEXT PRIMARY KEY,
+    service TEXT NOT NULL,
+    model TEXT,
+    response TEXT NOT NULL
+);
+"""
+
+
+class CompletionError(Exception):
+    pass
+
+
+class Choice(NamedTuple):
+    text: str
+    # "stop" when the model finished, "length" when it was cut off at max_tokens. None for responses cached before
+    # the reason was kept
+    finish_reason: Optional[str]
+
+
+def cache_key(service: str, model: Optional[str], prompt: str, params: dict[str, Any]) -> str:
+    hashed_prompt = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return hashlib.sha256(ujson.dumps([service, model, hashed_prompt, params], sort_keys=True).encode("utf-8")) \
+        .hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent cache of successful responses keyed by (service, model, prompt hash, params)
+    """
+
+    def __init__(self, cache_path: Union[str, Path]):
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.executescript(_SCHEMA)
+        self.connection.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self.connection.execute("SELECT response FROM completion_cache WHERE key = ?", (key,)).fetchone()
+        return ujson.loads(row[0]) if row else None
+
+    def put(self, key: str, service: str, model: Optional[str], response: Any) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO completion_cache (key, service, model, response) VALUES (?, ?, ?, ?)",
+            (key, service, model, ujson.dumps(response))
+        )
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class CompletionClient:
+    """
+    Async client for OpenAI completions and SMMRY summaries. All requests share one pooled HTTP connection and go
+    through a RequestScheduler (bounded concurrency, rate limiting, retries with backoff). With a cache path, every
+    successful response is stored so re-running an experiment never pays for the same prompt twice.
+
+    Use as an async context manager:
+
+        async with CompletionClient(openai_api_key=key, cache_path="cache.sqlite3") as client:
+            texts = await client.complete_many(prompts, model="text-davinci-003")
+    """
+
+    def __init__(self, openai_api_key: Optional[str] = None, smmry_api_key: Optional[str] = None,
+                 cache_path: Optional[Union[str, Path]] = None, max_concurrency: int = 8,
+                 requests_per_second: float = 5.0, max_retries: int = 5, timeout: float = 60.0):
+        self.openai_api_key = openai_api_key
+        self.smmry_api_key = smmry_api_key
+        self.cache = ResponseCache(cache_path) if cache_path else None
+        self.scheduler = RequestScheduler(max_concurrency=max_concurrency, requests_per_second=requests_per_second,
+                                          max_retries=max_retries)
+        self.client = httpx.AsyncClient(timeout=timeout,
+                                        limits=httpx.Limits(max_connections=max_concurrency,
+                                                            max_keepalive_connections=max_concurrency))
+
+    async def __aenter__(self) -> "CompletionClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+        if self.cache is not None:
+            self.cache.close()
+
+    async def complete(self, prompt: str, model: str, max_tokens: int = 1024, temperature: float = 0.2) -> list[str]:
+        """
+        Returns the text of every choice of a completion
+        """
+        return [choice.text for choice in await self.complete_choices(prompt, model, max_tokens, temperature)]
+
+    async def complete_choices(self, prompt: str, model: str, max_tokens: int = 1024,
+                               temperature: float = 0.2) -> list[Choice]:
+        """
+        Returns every choice of a completion with the reason it finished, so a caller can tell a cut off answer
+        """
+        if not self.openai_api_key:
+            raise CompletionError("No OpenAI API key set")
+        params = {"max_tokens": max_tokens, "temperature": temperature}
+        key = cache_key("openai", model, prompt, params)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                # Older entries hold only the texts
+                return [Choice(choice, None) if isinstance(choice, str) else Choice(*choice) for choice in cached]
+        response = await self.scheduler.request(
+            self.client, "POST", OPENAI_COMPLETIONS_URL,
+            headers={"Authorization": f"Bearer {self.openai_api_key}"},
+            json={"model": model, "prompt": prompt, **params}
+        )
+        if response.status_code >= 400:
+            raise CompletionError(f"OpenAI request failed with status {response.status_code}: {response.text}")
+        choices = [Choice(choice["text"], choice.get("finish_reason")) for choice in response.json()["choices"]]
+        if self.cache is not None:
+            self.cache.put(key, "openai", model, [list(choice) for choice in choices])
+        return choices
+
+    async def complete_many(self, prompts: Iterable[str], model: str, max_tokens: int = 1024,
+                            temperature: float = 0.2) -> list[list[str]]:
+        """
+        Runs completions for many prompts concurrently (bounded by the scheduler), results are in prompt order
+        """
+        return await asyncio.gather(*[self.complete(prompt, model, max_tokens, temperature) for prompt in prompts])
+
+    async def summarize_smmry(self, text: str, num_sentences: Optional[int] = None) -> str:
+        """
+        Returns the SMMRY extractive summary of a text, num_sentences long (SMMRY's SM_LENGTH, 7 by default)
+        """
+        if not self.smmry_api_key:
+            raise CompletionError("No SMMRY API key set")
+        # Without a length the key is the one summaries were always cached under
+        params = {"SM_LENGTH": num_sentences} if num_sentences is not None else {}
+        key = cache_key("smmry", None, text, params)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        response = await self.scheduler.request(self.client, "POST", SMMRY_URL,
+                                                params={"SM_API_KEY": self.smmry_api_key, **params},
+                                                data={"sm_api_input": text})
+        if response.status_code >= 400:
+            raise CompletionError(f"SMMRY request failed with status {response.status_code}: {response.text}")
+        result = response.json()
+        if "sm_api_error" in result:
+            raise CompletionError(f"SMMRY error {result['sm_api_error']}: {result.get('sm_api_message')}")
+        summary = result["sm_api_content"]
+        if self.cache is not None:
+            self.cache.put(key, "smmry", None, summary)
+        return summary
@@ -0,0 +1,164 @@
+import hashlib
+import re
+import zlib
+from typing import Any, Optional
+
+import numpy as np
+from sqlalchemy import select, delete, insert, literal_column, or_, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.elements import ColumnElement
+
+from dvids_apps.helpers import DEFAULT_DEDUPE_THRESHOLD
+from dvids_apps.models.db_models import Product, ProductSignature, SignatureBand
+
+NUM_PERMUTATIONS = 128
+# 16 bands of 8 rows: pairs above ~0.7 Jaccard similarity almost always share a bucket, pairs below ~0.5 rarely do
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // NUM_BANDS
+SHINGLE_SIZE = 5
+DEFAULT_THRESHOLD = DEFAULT_DEDUPE_THRESHOLD
+# Smallest prime above 2^32, the permutations are (a * x + b) mod p over 32 bit shingle hashes
+_PRIME = np.uint64(4294967311)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_WORD_PATTERN = re.compile(r"\w+")
+
+_generator = np.random.default_rng(20230101)
+# Kept below 2^31 so a * x + b can't overflow 64 bits. Seeded: signatures must be comparable across runs
+_A = _generator.integers(1, 2 ** 31, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _generator.integers(0, 2 ** 31, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """
+    32 bit hashes of the text's overlapping word n-grams (lowercased, punctuation ignored)
+    """
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        shingles = {" ".join(words)} if words else set()
+    else:
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64,
+                       count=len(shingles))
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """
+    MinHash signature of a text, None if it has no words
+    """
+    hashes = shingle_hashes(text)
+    if hashes.size == 0:
+        return None
+    permuted = (np.outer(_A, hashes) + _B[:, None]) % _PRIME & _MAX_HASH
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def estimated_similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """
+    Estimated Jaccard similarity of the shingle sets two signatures came from
+    """
+    return float(np.count_nonzero(first == second)) / first.size
+
+
+def band_buckets(signature: np.ndarray) -> list[int]:
+    """
+    One bucket per band. The band number is hashed in, so a bucket can only match the same band of another signature
+    """
+    buckets = []
+    for band in range(NUM_BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(band.to_bytes(2, "little") + rows.tobytes(), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "little", signed=True))
+    return buckets
+
+
+class Deduplicator:
+    """
+    Assigns every ingested product a near-duplicate cluster id. Each body's MinHash signature is stored in
+    product_signatures and its LSH band buckets in signature_bands, new products are compared only against earlier
+    products sharing a bucket. A product whose estimated similarity with a candidate reaches the threshold joins
+    the candidate's cluster, otherwise it starts its own (cluster id = its own id).
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+
+    def _find_cluster(self, connection: Connection, signature: np.ndarray, buckets: list[int]) -> Optional[str]:
+        candidates = connection.execute(
+            select(ProductSignature.asset_id, ProductSignature.signature, ProductSignature.cluster_id)
+            .join(SignatureBand, SignatureBand.asset_id == ProductSignature.asset_id)
+            .where(SignatureBand.bucket.in_(buckets))
+            .distinct()
+        ).all()
+        best_cluster, best_similarity = None, self.threshold
+        for _, candidate_signature, cluster_id in candidates:
+            similarity = estimated_similarity(signature, np.frombuffer(candidate_signature, dtype=np.uint32))
+            if similarity >= best_similarity:
+                best_cluster, best_similarity = cluster_id, similarity
+        return best_cluster
+
+    def index_products(self, connection: Connection, product_rows: list[dict[str, Any]]) -> None:
+        """
+        Signs and clusters a batch of product rows inside the caller's transaction. Products are handled one at a
+        time so duplicates within the same batch are found too
+        """
+        for product_row in product_rows:
+            product_id = product_row["id"]
+            signature = minhash(product_row.get("body") or "")
+            existing = connection.execute(
+                select(ProductSignature.signature).where(ProductSignature.asset_id == product_id)
+            ).scalar()
+            if signature is not None and existing == signature.tobytes():
+                # Re-ingested without changes, keep its cluster
+                continue
+            if existing is not None:
+                remove_signatures(connection, [product_id])
+            if signature is None:
+                continue
+            buckets = band_buckets(signature)
+            cluster_id = self._find_cluster(connection, signature, buckets) or product_id
+            connection.execute(insert(ProductSignature), [{"asset_id": product_id, "signature": signature.tobytes(),
+                                                           "cluster_id": cluster_id}])
+            connection.execute(insert(SignatureBand), [{"bucket": bucket, "asset_id": product_id}
+                                                       for bucket in buckets])
+
+
+def _replace_representative(connection: Connection, cluster_id: str) -> None:
+    """
+    Hands a cluster whose representative left it to the earliest remaining member, so the members aren't left
+    pointing at a product that is no longer one of them
+    """
+    representative = connection.execute(
+        select(ProductSignature.asset_id).where(ProductSignature.cluster_id == cluster_id)
+        .order_by(literal_column("product_signatures.rowid")).limit(1)
+    ).scalar()
+    if representative is not None:
+        connection.execute(update(ProductSignature).where(ProductSignature.cluster_id == cluster_id)
+                           .values(cluster_id=representative))
+
+
+def remove_signatures(connection: Connection, product_ids: list[str]) -> None:
+    """
+    Removes the signatures and band buckets of products whose body changed or which are deleted. The clusters they
+    represented get a new representative
+    """
+    # Stay under SQLite's bound parameter limit
+    for i in range(0, len(product_ids), 500):
+        chunk = product_ids[i:i + 500]
+        clusters = connection.execute(
+            select(ProductSignature.asset_id, ProductSignature.cluster_id).where(ProductSignature.asset_id.in_(chunk))
+        ).all()
+        connection.execute(delete(SignatureBand).where(SignatureBand.asset_id.in_(chunk)))
+        connection.execute(delete(ProductSignature).where(ProductSignature.asset_id.in_(chunk)))
+        for asset_id, cluster_id in clusters:
+            if asset_id == cluster_id:
+                _replace_representative(connection, cluster_id)
+
+
+def is_cluster_representative() -> ColumnElement:
+    """
+    Condition keeping one product per near-duplicate cluster, for queries on Product. Products without a signature
+    (no body, or ingested before deduplication) are always kept
+    """
+    cluster_ids = select(ProductSignature.cluster_id).where(ProductSignature.asset_id == Product.id) \
+        .scalar_subquery()
+    return or_(cluster_ids.is_(None), cluster_ids == Product.id)
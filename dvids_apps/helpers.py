@@ -1,7 +1,32 @@
+import os
 import sys
+import tempfile
+from collections import deque
+from concurrent.futures import Executor
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Iterator, Any, Optional
+from typing import Iterator, Any, Optional, Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Estimated body similarity at which dvids_apps.dedupe counts two products as duplicates. Defined here so command line
+# defaults can show it without importing NumPy
+DEFAULT_DEDUPE_THRESHOLD = 0.8
+
+# Read once at import: reading the umask means setting it, which isn't safe once other threads create files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def make_temp_file(target: Path) -> tuple[int, str]:
+    """
+    Creates a temporary file next to target, to be renamed onto it once fully written. tempfile.mkstemp makes files
+    only their owner can read, this one gets the permissions open() would have given target. Returns (fd, path)
+    """
+    fd, temp_path = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+    os.chmod(temp_path, 0o666 & ~_UMASK)
+    return fd, temp_path
 
 
 def make_date_range(start: datetime, end: datetime) -> Iterator[datetime]:
@@ -18,7 +43,7 @@ def get_safe_datetime(data_dict: dict[str, Any], key_name: str) -> datetime:
     try:
         val = data_dict.get(key_name)
         return datetime.fromisoformat(val)
-    except ValueError or TypeError:
+    except (ValueError, TypeError):
         return datetime(1970, 1, 1, 0, 0, 0)
 
 
@@ -30,5 +55,19 @@ def iso_date(arg_string: str) -> Optional[datetime]:
     return datetime.strptime(arg_string, "%Y%m%d")
 
 
+def bounded_map(executor: Executor, fn: Callable[[T], R], items: Iterable[T], max_in_flight: int) -> Iterator[R]:
+    """
+    Like executor.map, but only keeps max_in_flight tasks submitted at a time so results can't pile up in memory
+    when the consumer is slower than the workers. Results are yielded in order
+    """
+    in_flight = deque()
+    for item in items:
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().result()
+        in_flight.append(executor.submit(fn, item))
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
 def eprint(*args, sep=' ', end='\n') -> None:
     print(*args, sep=sep, end=end, file=sys.stderr)
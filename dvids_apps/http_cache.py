@@ -0,0 +1,209 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import NamedTuple, Optional, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+
+from dvids_apps.metrics import METRICS
+from dvids_apps.scheduler import RequestScheduler
+
+# Query parameters that identify the caller rather than the resource, left out of cache keys so a new key doesn't
+# invalidate the cache (and the key never ends up in the index)
+SECRET_PARAMETERS = frozenset({'api_key'})
+
+# How long a response for a date stays fresh, by how old the date is. Recent listings still change as units publish
+# and edit products, older dates practically never do
+DATE_AGE_MAX_AGES = (
+    (timedelta(days=2), 15 * 60),
+    (timedelta(days=7), 6 * 3600),
+    (timedelta(days=30), 24 * 3600),
+)
+HISTORICAL_MAX_AGE = 30 * 24 * 3600
+
+CACHE_HITS = METRICS.counter('dvids_http_cache_hits_total',
+                             'Responses served from the HTTP cache, by whether they were fresh or revalidated')
+CACHE_BYTES = METRICS.counter('dvids_http_cache_bytes_total', 'Response bytes served from the HTTP cache')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS http_responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+def max_age_for_date(date: datetime, now: Optional[datetime] = None) -> float:
+    """
+    Seconds a response about the given date may be served from the cache without asking the server again
+    """
+    age = (now or datetime.now()) - date
+    for max_date_age, max_age in DATE_AGE_MAX_AGES:
+        if age < max_date_age:
+            return max_age
+    return HISTORICAL_MAX_AGE
+
+
+def cache_url(url: str) -> str:
+    """
+    The URL a response is cached under: secret parameters removed and the rest sorted, so the same resource always
+    gets the same key
+    """
+    split = urlsplit(url)
+    query = sorted((key, value) for key, value in parse_qsl(split.query, keep_blank_values=True)
+                   if key not in SECRET_PARAMETERS)
+    return urlunsplit((split.scheme, split.netloc, split.path, urlencode(query), ''))
+
+
+def cache_key(url: str) -> str:
+    return hashlib.sha256(cache_url(url).encode('utf-8')).hexdigest()
+
+
+class CacheEntry(NamedTuple):
+    url: str
+    digest: str
+    content_type: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+class HttpCache:
+    """
+    On-disk cache of successful GET responses. Bodies are stored gzipped under objects/ by the SHA-256 of their
+    content, so identical bodies (empty search pages, unchanged assets) are stored once. An SQLite index maps each
+    URL to its body and validators (ETag/Last-Modified). Use get() in place of RequestScheduler.get(): fresh entries
+    are served without a request, stale ones are revalidated with a conditional request and refreshed on a 304.
+    With revalidate, every entry is treated as stale. The index and the bodies are read and written on a thread of
+    the cache's own, one at a time, so get() never blocks the event loop on disk.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], revalidate: bool = False):
+        self.cache_dir = Path(cache_dir)
+        self.revalidate = revalidate
+        self.objects_dir = self.cache_dir.joinpath('objects')
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        # Only ever used from the pool's single thread once created
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='http-cache')
+        self.connection = sqlite3.connect(self.cache_dir.joinpath('index.sqlite3'), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # Losing the last few entries in a crash only costs refetching them
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(_SCHEMA)
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.pool.shutdown()
+        self.connection.close()
+
+    def __enter__(self) -> 'HttpCache':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects_dir.joinpath(digest[:2], f'{digest[2:]}.gz')
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        row = self.connection.execute(
+            'SELECT url, digest, content_type, etag, last_modified, fetched_at FROM http_responses WHERE key = ?',
+            (cache_key(url),)
+        ).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def read_body(self, entry: CacheEntry) -> Optional[bytes]:
+        try:
+            with gzip.open(self._object_path(entry.digest), 'rb') as object_file:
+                return object_file.read()
+        except (OSError, EOFError):
+            # Removed or truncated, the entry is treated as missing
+            return None
+
+    def write_body(self, body: bytes) -> str:
+        digest = hashlib.sha256(body).hexdigest()
+        object_path = self._object_path(digest)
+        if object_path.exists():
+            return digest
+        object_path.parent.mkdir(exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=object_path.parent, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw_file, gzip.GzipFile(fileobj=raw_file, mode='wb', mtime=0) as object_file:
+                object_file.write(body)
+            os.replace(temp_path, object_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return digest
+
+    def store(self, url: str, response: httpx.Response) -> None:
+        digest = self.write_body(response.content)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO http_responses (key, url, digest, content_type, etag, last_modified, fetched_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (cache_key(url), cache_url(url), digest, response.headers.get('Content-Type'),
+             response.headers.get('ETag'), response.headers.get('Last-Modified'), time.time())
+        )
+        self.connection.commit()
+
+    def load(self, url: str) -> tuple[Optional[CacheEntry], Optional[bytes]]:
+        """
+        The entry for a URL and its body, a body is None if the entry is missing or its object is gone
+        """
+        entry = self.lookup(url)
+        return entry, self.read_body(entry) if entry is not None else None
+
+    def touch(self, url: str) -> None:
+        """
+        Marks an entry as fresh again after the server confirmed it is unchanged
+        """
+        self.connection.execute('UPDATE http_responses SET fetched_at = ? WHERE key = ?',
+                                (time.time(), cache_key(url)))
+        self.connection.commit()
+
+    async def get(self, client: httpx.AsyncClient, scheduler: RequestScheduler, url: str,
+                  max_age: float) -> httpx.Response:
+        """
+        GETs a URL through the cache. Entries younger than max_age seconds are returned without a request (a max_age
+        of 0 always revalidates). Only 200 responses without Cache-Control: no-store are cached, anything else is
+        returned as the scheduler got it
+        """
+        loop = asyncio.get_running_loop()
+        entry, body = await loop.run_in_executor(self.pool, self.load, url)
+        if body is not None and not self.revalidate and time.time() - entry.fetched_at < max_age:
+            CACHE_HITS.inc(kind='fresh')
+            CACHE_BYTES.inc(len(body))
+            return self._cached_response(url, entry, body)
+        headers = {}
+        if body is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        response = await scheduler.request(client, 'GET', url, headers=headers)
+        if response.status_code == 304 and body is not None:
+            await loop.run_in_executor(self.pool, self.touch, url)
+            CACHE_HITS.inc(kind='revalidated')
+            CACHE_BYTES.inc(len(body))
+            return self._cached_response(url, entry, body)
+        if response.status_code == 200 and 'no-store' not in response.headers.get('Cache-Control', ''):
+            await loop.run_in_executor(self.pool, self.store, url, response)
+        return response
+
+    @staticmethod
+    def _cached_response(url: str, entry: CacheEntry, body: bytes) -> httpx.Response:
+        headers = {'Content-Type': entry.content_type} if entry.content_type else {}
+        return httpx.Response(200, headers=headers, content=body, request=httpx.Request('GET', url))
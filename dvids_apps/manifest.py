@@ -0,0 +1,132 @@
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Union
+
+from dvids_apps.models.records import ListingRecord, parse_datetime
+
+STATUS_PENDING = 'pending'
+STATUS_FETCHED = 'fetched'
+STATUS_ERROR = 'error'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS manifest_products (
+    id TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    timestamp TEXT,
+    date_published TEXT,
+    status TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_manifest_products_date ON manifest_products (date);
+CREATE TABLE IF NOT EXISTS manifest_dates (
+    date TEXT PRIMARY KEY,
+    completed_at TEXT NOT NULL
+);
+"""
+
+
+def _date_key(date: datetime) -> str:
+    return date.strftime('%Y%m%d')
+
+
+class DownloadManifest:
+    """
+    Local record of what has already been downloaded. Tracks each product id with the timestamp/date_published it
+    had in the search listing and its fetch status, plus which dates finished cleanly, so re-runs can skip unchanged
+    products and resume interrupted ranges.
+    """
+
+    def __init__(self, manifest_path: Union[str, Path]):
+        self.connection = sqlite3.connect(manifest_path)
+        self.connection.executescript(_SCHEMA)
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> 'DownloadManifest':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def is_date_complete(self, date: datetime) -> bool:
+        row = self.connection.execute('SELECT 1 FROM manifest_dates WHERE date = ?', (_date_key(date),)).fetchone()
+        return row is not None
+
+    def mark_date_complete(self, date: datetime) -> None:
+        self.connection.execute('INSERT OR REPLACE INTO manifest_dates (date, completed_at) VALUES (?, ?)',
+                                (_date_key(date), datetime.now().isoformat()))
+        self.connection.commit()
+
+    def filter_changed(self, products: Iterable[ListingRecord]) -> list[ListingRecord]:
+        """
+        Returns the products which were not fetched before or whose timestamp changed since they were fetched
+        """
+        products = list(products)
+        fetched = {product_id: timestamp for product_id, (timestamp, status)
+                   in self._stored([product.id for product in products]).items() if status == STATUS_FETCHED}
+        # Compared as dates, so a timestamp recorded in another ISO format (by an older version) still matches
+        return [product for product in products
+                if product.id not in fetched or parse_datetime(fetched[product.id]) != product.timestamp]
+
+    def record_listing(self, date: datetime, products: Iterable[ListingRecord]) -> None:
+        """
+        Upserts products seen in a search listing. Products whose timestamp changed go back to pending
+        """
+        products = list(products)
+        stored = self._stored([product.id for product in products])
+        now = datetime.now().isoformat()
+        rows = []
+        for product in products:
+            status = STATUS_PENDING
+            if product.id in stored:
+                timestamp, stored_status = stored[product.id]
+                # Compared as dates, a timestamp an older version stored as the API's string keeps its status
+                if parse_datetime(timestamp) == product.timestamp:
+                    status = stored_status
+            rows.append((product.id, _date_key(date), _as_text(product.timestamp), _as_text(product.date_published),
+                         status, now))
+        self.connection.executemany(
+            """
+            INSERT INTO manifest_products (id, date, timestamp, date_published, status, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                date = excluded.date,
+                date_published = excluded.date_published,
+                status = excluded.status,
+                timestamp = excluded.timestamp,
+                updated_at = excluded.updated_at
+            """,
+            rows
+        )
+        self.connection.commit()
+
+    def _stored(self, product_ids: list[str]) -> dict[str, tuple[str, str]]:
+        """
+        (timestamp, status) of the given products already in the manifest
+        """
+        stored: dict[str, tuple[str, str]] = {}
+        # Stay under SQLite's bound parameter limit
+        for i in range(0, len(product_ids), 500):
+            chunk = product_ids[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for product_id, timestamp, status in self.connection.execute(
+                    f'SELECT id, timestamp, status FROM manifest_products WHERE id IN ({placeholders})', chunk):
+                stored[product_id] = (timestamp, status)
+        return stored
+
+    def set_status(self, product_ids: Iterable[str], status: str) -> None:
+        now = datetime.now().isoformat()
+        self.connection.executemany('UPDATE manifest_products SET status = ?, updated_at = ? WHERE id = ?',
+                                    [(status, now, product_id) for product_id in product_ids])
+        self.connection.commit()
+
+
+def _as_text(value) -> Union[str, None]:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
@@ -0,0 +1,236 @@
+import bisect
+import itertools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional, TextIO, Union
+
+import ujson
+
+# Seconds, suited to request latencies and batch commits
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _label_key(labels: dict[str, Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """
+    Monotonic count per label set, e.g. requests by status code
+    """
+
+    def __init__(self, name: str, description: str, lock: threading.Lock):
+        self.name = name
+        self.description = description
+        self.values: dict[LabelKey, float] = {}
+        self._lock = lock
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self.values.values())
+
+
+class Histogram:
+    """
+    Distribution of observed values per label set, kept as a count per bucket plus a sum and count. Both the JSON
+    and the Prometheus output report the buckets cumulatively, like a Prometheus histogram's le buckets
+    """
+
+    def __init__(self, name: str, description: str, lock: threading.Lock, buckets: tuple[float, ...]):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # Per label set: [count per bucket (the last one is +Inf), sum, count]
+        self.values: dict[LabelKey, list] = {}
+        self._lock = lock
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self) -> int:
+        with self._lock:
+            return sum(series[2] for series in self.values.values())
+
+    def sum(self) -> float:
+        with self._lock:
+            return sum(series[1] for series in self.values.values())
+
+
+class Metrics:
+    """
+    Registry of the counters and histograms a run records. The pipeline records into the shared METRICS registry,
+    which can be written as JSON or in the Prometheus text format at the end of a run. Metrics recorded in worker
+    processes stay in those processes.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._metrics: dict[str, Union[Counter, Histogram]] = {}
+
+    def counter(self, name: str, description: str = "") -> Counter:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, description, self._lock)
+            return self._metrics[name]
+
+    def histogram(self, name: str, description: str = "", buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, description, self._lock, buckets)
+            return self._metrics[name]
+
+    def to_dict(self) -> dict[str, Any]:
+        metrics: dict[str, Any] = {}
+        with self._lock:
+            for name, metric in self._metrics.items():
+                series = []
+                for key, value in metric.values.items():
+                    labels = dict(key)
+                    if isinstance(metric, Counter):
+                        series.append({"labels": labels, "value": value})
+                    else:
+                        bucket_counts, total, count = value
+                        series.append({"labels": labels, "sum": total, "count": count,
+                                       "buckets": dict(zip([str(bound) for bound in metric.buckets] + ["+Inf"],
+                                                           itertools.accumulate(bucket_counts)))})
+                metrics[name] = {"type": "counter" if isinstance(metric, Counter) else "histogram",
+                                 "description": metric.description, "series": series}
+        return {"started": self.started, "elapsed_seconds": time.time() - self.started, "metrics": metrics}
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, metric in self._metrics.items():
+                if metric.description:
+                    lines.append(f"# HELP {name} {metric.description}")
+                if isinstance(metric, Counter):
+                    lines.append(f"# TYPE {name} counter")
+                    for key, value in metric.values.items():
+                        lines.append(f"{name}{_format_labels(key)} {value:g}")
+                    continue
+                lines.append(f"# TYPE {name} histogram")
+                for key, (bucket_counts, total, count) in metric.values.items():
+                    for bound, cumulative in zip(list(metric.buckets) + ["+Inf"], itertools.accumulate(bucket_counts)):
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', str(bound)))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {total:g}")
+                    lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Union[str, Path]) -> None:
+        """
+        Writes the metrics to a file, in the Prometheus text format if it ends in .prom or .txt and as JSON otherwise
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as metrics_file:
+            if path.suffix in (".prom", ".txt"):
+                metrics_file.write(self.to_prometheus())
+            else:
+                ujson.dump(self.to_dict(), metrics_file, indent=2)
+
+
+METRICS = Metrics()
+
+
+class Progress:
+    """
+    Prints a one line summary of some counters to stderr every interval seconds while a stage runs: each counter's
+    total and its rate since the start. On a terminal the line is redrawn in place.
+
+        with Progress(METRICS, [("requests", "dvids_requests_total"), ...]):
+            ...
+    """
+
+    def __init__(self, metrics: Metrics, fields: list[tuple[str, str]], interval: float = 1.0,
+                 output: TextIO = sys.stderr):
+        self.metrics = metrics
+        self.fields = fields
+        self.interval = interval
+        self.output = output
+        self._redraw = output.isatty()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start = 0.0
+
+    def line(self) -> str:
+        elapsed = max(time.perf_counter() - self._start, 1e-9)
+        parts = [f"{elapsed:6.0f}s"]
+        for label, counter_name in self.fields:
+            total = self.metrics.counter(counter_name).total()
+            parts.append(f"{label} {total:,.0f} ({total / elapsed:,.1f}/s)")
+        return " | ".join(parts)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._print()
+
+    def _print(self, final: bool = False) -> None:
+        if self._redraw:
+            self.output.write("\r\033[K" + self.line() + ("\n" if final else ""))
+        else:
+            self.output.write(self.line() + "\n")
+        self.output.flush()
+
+    def __enter__(self) -> "Progress":
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._print(final=True)
+
+
+@contextmanager
+def profiled(path: Optional[Union[str, Path]]) -> Iterator[None]:
+    """
+    Runs the block under cProfile and dumps the stats to path (readable with pstats, snakeviz, ...). Does nothing
+    when path is None. For sampling instead, run the same command under `py-spy record -- python ...`
+    """
+    if path is None:
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(str(path))
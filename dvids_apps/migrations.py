@@ -0,0 +1,55 @@
+from typing import Union
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection, Engine
+
+from dvids_apps.bulk_load import create_indexes
+from dvids_apps.models.db_models import Base, ProductKeyword
+from dvids_apps.rollups import rebuild_keyword_index
+from dvids_apps.search import create_search_table
+
+# Bumped whenever a migration step is added below, stored in SQLite's user_version pragma
+SCHEMA_VERSION = 4
+# First schema version with the full text search index
+SEARCH_INDEX_VERSION = 2
+# First schema version with the keyword index and daily rollups
+ROLLUPS_VERSION = 4
+
+
+def get_schema_version(bind: Union[Engine, Connection]) -> int:
+    if isinstance(bind, Connection):
+        return bind.exec_driver_sql("PRAGMA user_version").scalar()
+    with bind.connect() as connection:
+        return get_schema_version(connection)
+
+
+def _add_body_length(engine: Engine) -> None:
+    columns = {column["name"] for column in inspect(engine).get_columns("products")}
+    if "body_length" in columns:
+        return
+    with engine.begin() as connection:
+        # SQLite can only add VIRTUAL generated columns to an existing table
+        connection.exec_driver_sql(
+            "ALTER TABLE products ADD COLUMN body_length INTEGER GENERATED ALWAYS AS (length(body)) VIRTUAL"
+        )
+
+
+def upgrade_schema(engine: Engine) -> bool:
+    """
+    Brings a database created by an older version of the models up to date: creates missing tables, adds new columns
+    and creates missing indexes. Safe to run on an up to date database. Returns whether anything had to be done
+    """
+    if get_schema_version(engine) >= SCHEMA_VERSION:
+        return False
+    has_keyword_index = inspect(engine).has_table(ProductKeyword.__tablename__)
+    Base.metadata.create_all(engine)
+    _add_body_length(engine)
+    create_search_table(engine)
+    if not has_keyword_index:
+        rebuild_keyword_index(engine)
+    # create_all only creates indexes along with new tables, so create the ones existing tables are missing. This also
+    # adds the search index triggers and fills the search index, and computes the rollups
+    create_indexes(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return True
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey
+from sqlalchemy import Column, String, Integer, Date, DateTime, ForeignKey, Computed, LargeBinary, BigInteger, Index
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -7,22 +7,24 @@ Base = declarative_base()
 class Product(Base):
     __tablename__ = "products"
     id = Column(String, primary_key=True)
-    branch = Column(String, nullable=True)
+    branch = Column(String, nullable=True, index=True)
     credits = relationship("Credit")
     description = Column(String)
     duration = Column(Integer, nullable=True)
     keywords = Column(String, nullable=True)
-    date = Column(DateTime)
-    date_published = Column(DateTime)
+    date = Column(DateTime, index=True)
+    date_published = Column(DateTime, index=True)
     files = relationship("File")
     image = Column(String, nullable=True)
     location = relationship("Location")
     timestamp = Column(DateTime, nullable=True)
     title = Column(String)
-    unit_name = Column(String, nullable=True)
+    unit_name = Column(String, nullable=True, index=True)
     url = Column(String, nullable=True)
     virin = Column(String, nullable=True)
     body = Column(String, nullable=True)
+    # Virtual so it can be added to existing databases with ALTER TABLE, the index stores the computed values
+    body_length = Column(Integer, Computed("length(body)", persisted=False), index=True)
 
     def __repr__(self) -> str:
         return f"<Product(id='{self.id}', title='{self.title}', description='{self.description}'," \
@@ -44,7 +46,7 @@ class Credit(Base):
     name = Column(String)
     rank = Column(String)
     url = Column(String)
-    asset_id = Column(String, ForeignKey("products.id"))
+    asset_id = Column(String, ForeignKey("products.id"), index=True)
 
 
 class Location(Base):
@@ -55,7 +57,7 @@ class Location(Base):
     country = Column(String)
     state_abbreviation = Column(String)
     country_abbreviation = Column(String)
-    asset_id = Column(String, ForeignKey("products.id"))
+    asset_id = Column(String, ForeignKey("products.id"), index=True)
 
 
 class File(Base):
@@ -67,4 +69,54 @@ class File(Base):
     width = Column(Integer)
     size = Column(Integer)
     bitrate = Column(Integer)
-    asset_id = Column(String, ForeignKey("products.id"))
\ No newline at end of file
+    asset_id = Column(String, ForeignKey("products.id"), index=True)
+
+
+class ProductSignature(Base):
+    __tablename__ = "product_signatures"
+    asset_id = Column(String, ForeignKey("products.id"), primary_key=True)
+    signature = Column(LargeBinary)
+    # Id of the first product seen with near-identical body text, equal to asset_id for the original
+    cluster_id = Column(String, index=True)
+
+
+class SignatureBand(Base):
+    __tablename__ = "signature_bands"
+    id = Column(Integer, primary_key=True)
+    bucket = Column(BigInteger, index=True)
+    asset_id = Column(String, ForeignKey("product_signatures.asset_id"), index=True)
+
+
+class Keyword(Base):
+    __tablename__ = "keywords"
+    id = Column(Integer, primary_key=True)
+    # Normalized (see dvids_apps.rollups.normalize_keywords). A unique constraint rather than an index, so it is kept
+    # while a bulk load drops the indexes
+    keyword = Column(String, nullable=False, unique=True)
+
+
+class ProductKeyword(Base):
+    __tablename__ = "product_keywords"
+    # The primary key serves lookups by product, the index is the inverted index from a keyword to its products
+    asset_id = Column(String, ForeignKey("products.id"), primary_key=True)
+    keyword_id = Column(Integer, ForeignKey("keywords.id"), primary_key=True, autoincrement=False)
+    __table_args__ = (Index("ix_product_keywords_keyword_id_asset_id", "keyword_id", "asset_id"),)
+
+
+class DailyRollup(Base):
+    __tablename__ = "daily_rollups"
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False, index=True)
+    unit_name = Column(String, nullable=True, index=True)
+    branch = Column(String, nullable=True, index=True)
+    product_count = Column(Integer, nullable=False)
+    # Distinct titles among the day's products of the unit and branch
+    title_count = Column(Integer, nullable=False)
+
+
+class DailyKeywordCount(Base):
+    __tablename__ = "daily_keyword_counts"
+    day = Column(Date, primary_key=True)
+    keyword_id = Column(Integer, ForeignKey("keywords.id"), primary_key=True, autoincrement=False)
+    product_count = Column(Integer, nullable=False)
+    __table_args__ = (Index("ix_daily_keyword_counts_keyword_id_day", "keyword_id", "day"),)
@@ -0,0 +1,144 @@
+from datetime import datetime
+from typing import Any, Optional, Union
+
+import ujson
+
+from dvids_apps.models.api_models import PageInfo
+
+# What an unparseable or missing date is stored as, like helpers.get_safe_datetime
+EPOCH = datetime(1970, 1, 1, 0, 0, 0)
+
+RowsTuple = tuple[dict[str, Any], list[dict[str, Any]], list[dict[str, Any]]]
+
+
+def parse_datetime(value: Any) -> datetime:
+    """
+    Parses an ISO 8601 date from the API, EPOCH if it is missing or invalid
+    """
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return EPOCH
+
+
+class ListingRecord:
+    """
+    A search result, reduced to the fields the downloader uses to decide what to look up
+    """
+    __slots__ = ("id", "timestamp", "date_published")
+
+    def __init__(self, id: str, timestamp: datetime, date_published: datetime):
+        self.id = id
+        self.timestamp = timestamp
+        self.date_published = date_published
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "ListingRecord":
+        return cls(data["id"], parse_datetime(data.get("timestamp")), parse_datetime(data.get("date_published")))
+
+
+class CreditRecord:
+    __slots__ = ("credit_id", "name", "rank", "url")
+
+    def __init__(self, credit_id: Optional[int], name: Optional[str], rank: Optional[str], url: Optional[str]):
+        self.credit_id = credit_id
+        self.name = name
+        self.rank = rank
+        self.url = url
+
+
+class FileRecord:
+    __slots__ = ("src", "type", "height", "width", "bitrate")
+
+    def __init__(self, src: Optional[str], type: Optional[str], height: Optional[int], width: Optional[int],
+                 bitrate: Optional[int]):
+        self.src = src
+        self.type = type
+        self.height = height
+        self.width = width
+        self.bitrate = bitrate
+
+
+class ProductRecord:
+    """
+    A resolved product (the /asset endpoint's result) with only the fields the database keeps and its dates already
+    parsed. Both the downloader and the database loaders turn API payloads into these, and to_rows() maps one to the
+    products/credits/files rows
+    """
+    __slots__ = ("id", "branch", "description", "keywords", "date", "date_published", "image", "timestamp", "title",
+                 "unit_name", "url", "virin", "body", "credits", "files")
+
+    def __init__(self, id: str, branch: Optional[str], description: Optional[str], keywords: Optional[str],
+                 date: datetime, date_published: datetime, image: Optional[str], timestamp: datetime,
+                 title: Optional[str], unit_name: Optional[str], url: Optional[str], virin: Optional[str],
+                 body: Optional[str], credits: list[CreditRecord], files: list[FileRecord]):
+        self.id = id
+        self.branch = branch
+        self.description = description
+        self.keywords = keywords
+        self.date = date
+        self.date_published = date_published
+        self.image = image
+        self.timestamp = timestamp
+        self.title = title
+        self.unit_name = unit_name
+        self.url = url
+        self.virin = virin
+        self.body = body
+        self.credits = credits
+        self.files = files
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "ProductRecord":
+        get = data.get
+        return cls(
+            get("id"), get("branch"), get("description"), get("keywords"), parse_datetime(get("date")),
+            parse_datetime(get("date_published")), get("image"), parse_datetime(get("timestamp")), get("title"),
+            get("unit_name"), get("url"), get("virin"), get("body"),
+            [CreditRecord(credit.get("id"), credit.get("name"), credit.get("rank"), credit.get("url"))
+             for credit in get("credits") or []],
+            [FileRecord(file.get("src"), file.get("type"), file.get("height"), file.get("width"), file.get("bitrate"))
+             for file in get("files") or []]
+        )
+
+    def to_rows(self) -> RowsTuple:
+        product_id = self.id
+        product_row = {
+            "id": product_id,
+            "branch": self.branch,
+            "description": self.description,
+            "keywords": self.keywords,
+            "date": self.date,
+            "date_published": self.date_published,
+            "image": self.image,
+            "timestamp": self.timestamp,
+            "title": self.title,
+            "unit_name": self.unit_name,
+            "url": self.url,
+            "virin": self.virin,
+            "body": self.body
+        }
+        credit_rows = [{"credit_id": credit.credit_id, "name": credit.name, "rank": credit.rank, "url": credit.url,
+                        "asset_id": product_id} for credit in self.credits]
+        file_rows = [{"src": file.src, "type": file.type, "height": file.height, "width": file.width,
+                      "bitrate": file.bitrate, "asset_id": product_id} for file in self.files]
+        return product_row, credit_rows, file_rows
+
+
+def decode_search_page(content: Union[bytes, str]) -> tuple[PageInfo, list[ListingRecord]]:
+    """
+    Decodes a /search response body into its page info and listing records, dropping the rest of each listing right
+    away
+    """
+    result = ujson.loads(content)
+    return result["page_info"], [ListingRecord.from_dict(product) for product in result["results"]]
+
+
+def decode_asset(content: Union[bytes, str]) -> dict[str, Any]:
+    """
+    Decodes an /asset response body into the resolved product. It is kept as the API sent it, that is what gets
+    saved to disk
+    """
+    return ujson.loads(content)["results"]
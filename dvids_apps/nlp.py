@@ -0,0 +1,209 @@
+import hashlib
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Optional, Union, TYPE_CHECKING
+
+import ujson
+
+if TYPE_CHECKING:
+    import numpy as np
+
+DEFAULT_MODEL = "en_core_web_lg"
+DEFAULT_BATCH_SIZE = 64
+# host:port of a running `dvids nlp-server`. When set, engines send texts to the server (which keeps the models
+# loaded between runs) instead of loading the model themselves
+NLP_SERVER_ENV = "DVIDS_NLP_SERVER"
+# Pipeline components each task needs, everything else is excluded when the model is loaded. Document vectors come
+# straight from the static word vectors so they need no components at all
+TASK_COMPONENTS = {
+    "ner": ("tok2vec", "ner"),
+    "vectors": ()
+}
+
+Entity = tuple[str, str]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nlp_cache (
+    task TEXT NOT NULL,
+    model TEXT NOT NULL,
+    key TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (task, model, key, text_hash)
+);
+"""
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class NlpCache:
+    """
+    Persistent cache of NLP results keyed by (task, model, product id, hash of the text), so unchanged articles are
+    never parsed twice and an edited article is re-parsed
+    """
+
+    def __init__(self, cache_path: Union[str, Path]):
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.executescript(_SCHEMA)
+        self.connection.commit()
+
+    def get_many(self, task: str, model: str, keys: list[tuple[str, str]]) -> dict[tuple[str, str], bytes]:
+        found: dict[tuple[str, str], bytes] = {}
+        for key, hashed in keys:
+            row = self.connection.execute(
+                "SELECT value FROM nlp_cache WHERE task = ? AND model = ? AND key = ? AND text_hash = ?",
+                (task, model, key, hashed)
+            ).fetchone()
+            if row is not None:
+                found[(key, hashed)] = row[0]
+        return found
+
+    def put_many(self, task: str, model: str, values: list[tuple[str, str, bytes]]) -> None:
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO nlp_cache (task, model, key, text_hash, value) VALUES (?, ?, ?, ?, ?)",
+            [(task, model, key, hashed, value) for key, hashed, value in values]
+        )
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class NlpEngine:
+    """
+    Runs a spaCy model over many texts for one task. Texts are parsed in batches with nlp.pipe (optionally across
+    n_process processes) with only the components the task needs, and results are cached when a cache path is given.
+    The model is only loaded once there is something that isn't cached.
+
+    With a server address (by default taken from the DVIDS_NLP_SERVER environment variable, an empty string means
+    no server) uncached texts are parsed by a long-lived `dvids nlp-server` process instead, so the model is never
+    loaded by this process at all.
+
+    Items are (key, text) pairs, the key is normally the product id.
+    """
+
+    def __init__(self, task: str, model: str = DEFAULT_MODEL, cache_path: Optional[Union[str, Path]] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, n_process: int = 1, server: Optional[str] = None):
+        if task not in TASK_COMPONENTS:
+            raise ValueError(f"Unknown NLP task {task}, expected one of {', '.join(TASK_COMPONENTS)}")
+        self.task = task
+        self.model = model
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.cache = NlpCache(cache_path) if cache_path else None
+        self.server_address = server if server is not None else os.environ.get(NLP_SERVER_ENV)
+        self._server = None
+        self._nlp = None
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            # Imported here so runs that are fully cached never pay for importing spaCy or loading the model
+            import spacy
+            keep = TASK_COMPONENTS[self.task]
+            meta = spacy.info(self.model)
+            pipe_names = meta.get("components", meta["pipeline"])
+            self._nlp = spacy.load(self.model, exclude=[name for name in pipe_names if name not in keep])
+        return self._nlp
+
+    def compute(self, texts: list[str]) -> list[Any]:
+        """
+        The task's result for each text, without looking at the cache
+        """
+        if self.server_address:
+            if self._server is None:
+                from dvids_apps.nlp_server import NlpClient
+                self._server = NlpClient(self.server_address)
+            return self._server.compute(self.task, self.model, texts)
+        doc_result = TASK_RESULTS[self.task]
+        return [doc_result(doc) for doc in self.nlp.pipe(texts, batch_size=self.batch_size, n_process=self.n_process)]
+
+    def close(self) -> None:
+        if self.cache is not None:
+            self.cache.close()
+        if self._server is not None:
+            self._server.close()
+
+    def __enter__(self) -> "NlpEngine":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _run(self, items: Iterable[tuple[str, str]], encode: Callable[..., bytes],
+             decode: Callable[[bytes], object], chunk_size: int = 1000) -> Iterator[tuple[str, object]]:
+        """
+        Yields (key, result) in input order. Works through the items a chunk at a time so the cache lookups and
+        nlp.pipe batches stay large without holding the whole corpus in memory
+        """
+        items = iter(items)
+        while True:
+            chunk = [(key, text or "") for key, text in _take(items, chunk_size)]
+            if not chunk:
+                return
+            hashed_keys = [(key, text_hash(text)) for key, text in chunk]
+            cached = self.cache.get_many(self.task, self.model, hashed_keys) if self.cache else {}
+            missing = [(hashed_key, text) for hashed_key, (_, text) in zip(hashed_keys, chunk)
+                       if hashed_key not in cached]
+            computed: dict[tuple[str, str], object] = {}
+            if missing:
+                results = self.compute([text for _, text in missing])
+                for (hashed_key, _), result in zip(missing, results):
+                    computed[hashed_key] = result
+                if self.cache:
+                    self.cache.put_many(self.task, self.model, [(key, hashed, encode(value))
+                                                                for (key, hashed), value in computed.items()])
+            for hashed_key in hashed_keys:
+                if hashed_key in computed:
+                    yield hashed_key[0], computed[hashed_key]
+                else:
+                    yield hashed_key[0], decode(cached[hashed_key])
+
+    def entities(self, items: Iterable[tuple[str, str]]) -> Iterator[tuple[str, list[Entity]]]:
+        """
+        Yields (key, [(entity text, entity label), ...]) for each item
+        """
+        if self.task != "ner":
+            raise ValueError("entities() needs an engine created for the ner task")
+        yield from self._run(items,
+                             lambda entities: ujson.dumps(entities).encode("utf-8"),
+                             lambda value: [tuple(entity) for entity in ujson.loads(value)])
+
+    def vectors(self, items: Iterable[tuple[str, str]]) -> Iterator[tuple[str, "np.ndarray"]]:
+        """
+        Yields (key, document vector) for each item, the vector is the average of the token vectors like Doc.vector
+        """
+        import numpy as np
+        if self.task != "vectors":
+            raise ValueError("vectors() needs an engine created for the vectors task")
+        yield from self._run(items,
+                             lambda vector: vector.tobytes(),
+                             lambda value: np.frombuffer(value, dtype=np.float32))
+
+
+def doc_entities(doc) -> list[Entity]:
+    return [(ent.text, ent.label_) for ent in doc.ents]
+
+
+def doc_vector(doc) -> "np.ndarray":
+    import numpy as np
+    return np.asarray(doc.vector, dtype=np.float32)
+
+
+# What each task keeps from a parsed Doc
+TASK_RESULTS: dict[str, Callable[[Any], Any]] = {
+    "ner": doc_entities,
+    "vectors": doc_vector
+}
+
+
+def _take(iterator: Iterator, count: int) -> list:
+    taken = []
+    for item in iterator:
+        taken.append(item)
+        if len(taken) >= count:
+            break
+    return taken
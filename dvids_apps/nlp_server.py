@@ -0,0 +1,162 @@
+import argparse
+import os
+import secrets
+import sys
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from pathlib import Path
+from typing import Any, Optional
+
+from dvids_apps.helpers import eprint
+from dvids_apps.nlp import NlpEngine, DEFAULT_MODEL, DEFAULT_BATCH_SIZE, TASK_COMPONENTS, NLP_SERVER_ENV
+
+DEFAULT_ADDRESS = "127.0.0.1:6790"
+# Shared secret the server and its clients authenticate each other with, requests are pickled so only local, trusted
+# clients may connect. Without the environment variable the server generates a random key and writes it to a file
+# only the user can read, where the clients pick it up
+AUTHKEY_ENV = "DVIDS_NLP_AUTHKEY"
+AUTHKEY_FILE_ENV = "DVIDS_NLP_AUTHKEY_FILE"
+DEFAULT_AUTHKEY_FILE = Path.home().joinpath(".dvids_nlp_authkey")
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def get_authkey_file() -> Path:
+    return Path(os.environ.get(AUTHKEY_FILE_ENV, DEFAULT_AUTHKEY_FILE))
+
+
+def get_authkey() -> bytes:
+    """
+    The key from DVIDS_NLP_AUTHKEY, or the one the running server wrote to its key file
+    """
+    if os.environ.get(AUTHKEY_ENV):
+        return os.environ[AUTHKEY_ENV].encode("utf-8")
+    authkey_file = get_authkey_file()
+    try:
+        return bytes.fromhex(authkey_file.read_text().strip())
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f"No NLP server key: set {AUTHKEY_ENV} or start the server, which writes one to "
+                           f"{authkey_file}") from e
+
+
+def create_authkey() -> bytes:
+    """
+    The key from DVIDS_NLP_AUTHKEY, or a new random key written to the key file with permissions for the user only
+    """
+    if os.environ.get(AUTHKEY_ENV):
+        return os.environ[AUTHKEY_ENV].encode("utf-8")
+    authkey = secrets.token_bytes(32)
+    authkey_file = get_authkey_file()
+    fd = os.open(authkey_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as key_file:
+        # The mode above only applies to new files
+        os.fchmod(key_file.fileno(), 0o600)
+        key_file.write(authkey.hex())
+    eprint(f"Wrote the server key to {authkey_file}")
+    return authkey
+
+
+class NlpClient:
+    """
+    Connection to a running NLP server
+    """
+
+    def __init__(self, address: str):
+        self.connection = Client(parse_address(address), authkey=get_authkey())
+
+    def compute(self, task: str, model: str, texts: list[str]) -> list[Any]:
+        self.connection.send(("compute", task, model, texts))
+        status, value = self.connection.recv()
+        if status != "ok":
+            raise RuntimeError(f"NLP server failed: {value}")
+        return value
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class NlpServer:
+    """
+    Keeps one NlpEngine per (task, model) loaded and computes results for clients. Connections are served one at a
+    time, the models aren't safe to share between threads and a second client would be waiting on the same CPU anyway
+    """
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, batch_size: int = DEFAULT_BATCH_SIZE, n_process: int = 1,
+                 authkey: Optional[bytes] = None):
+        self.address = address
+        self.authkey = authkey
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.engines: dict[tuple[str, str], NlpEngine] = {}
+
+    def engine(self, task: str, model: str) -> NlpEngine:
+        key = (task, model)
+        if key not in self.engines:
+            eprint(f"Loading {model} for {task}")
+            # An empty server address so the engine never forwards to a server itself
+            engine = NlpEngine(task, model, batch_size=self.batch_size, n_process=self.n_process, server="")
+            engine.nlp
+            self.engines[key] = engine
+        return self.engines[key]
+
+    def handle(self, connection: Connection) -> None:
+        while True:
+            try:
+                request = connection.recv()
+            except EOFError:
+                return
+            if request[0] == "compute":
+                _, task, model, texts = request
+                try:
+                    connection.send(("ok", self.engine(task, model).compute(texts)))
+                except SystemExit:
+                    # spaCy exits rather than raising when it can't find a model
+                    connection.send(("error", f"Unable to load model {model}"))
+                except Exception as e:
+                    # Report it to the client and keep serving
+                    connection.send(("error", f"{type(e).__name__}: {e}"))
+            else:
+                connection.send(("error", f"Unknown request {request[0]}"))
+
+    def serve_forever(self) -> None:
+        authkey = self.authkey if self.authkey is not None else create_authkey()
+        with Listener(parse_address(self.address), authkey=authkey) as listener:
+            eprint(f"Serving on {self.address}, set {NLP_SERVER_ENV}={self.address} to use it")
+            while True:
+                try:
+                    connection = listener.accept()
+                except AuthenticationError:
+                    eprint("Warning: rejected a client with the wrong authentication key")
+                    continue
+                with connection:
+                    self.handle(connection)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Keeps spaCy models loaded so NLP scripts don't load them each run")
+    parser.add_argument("--address", type=str, default=DEFAULT_ADDRESS,
+                        help="host:port to listen on. Default=%(default)s")
+    parser.add_argument("--preload", type=str, choices=sorted(TASK_COMPONENTS), action="append", default=[],
+                        help="Load the model for this task before accepting clients, can be repeated")
+    parser.add_argument("--model", type=str, default=DEFAULT_MODEL,
+                        help="Model to preload. Default=%(default)s")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Number of texts per spaCy batch. Default=%(default)s")
+    parser.add_argument("--n-process", type=int, default=1,
+                        help="Number of processes spaCy parses with. Default=%(default)s")
+    args = parser.parse_args()
+    server = NlpServer(args.address, args.batch_size, args.n_process)
+    for task in args.preload:
+        server.engine(task, args.model)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import importlib.util
+import re
+from typing import Callable, NamedTuple, Optional
+
+# Context window (prompt and completion tokens together) of the completion models
+MODEL_CONTEXT_TOKENS = {
+    "text-ada-001": 2048,
+    "text-babbage-001": 2048,
+    "text-curie-001": 2048,
+    "text-davinci-002": 4097,
+    "text-davinci-003": 4097,
+    "gpt-3.5-turbo-instruct": 4096,
+}
+DEFAULT_CONTEXT_TOKENS = 2048
+
+BATCH_INSTRUCTIONS = ("The text below is split into numbered documents. Answer for each document separately, and "
+                      "start each answer with the document's header line, e.g. ### Document 1")
+_DOCUMENT_HEADER = "### Document {number}"
+# Lenient about how the model writes the header back: "### Document 2", "**Document 2:**", "Document 2 -" ... The
+# match ends after the separator, an answer may start on the header's line
+_ANSWER_HEADER_PATTERN = re.compile(r"^[#*\s]*document\s+(\d+)\b[ \t*]*[:.)\-–—]?[ \t*]*",
+                                    re.IGNORECASE | re.MULTILINE)
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of GPT tokens in a text without the model's tokenizer: a token per punctuation mark and per
+    started four characters of a word. That overestimates English a little, so prompts packed with it stay within the
+    limit
+    """
+    return sum((len(token) + 3) // 4 for token in _TOKEN_PATTERN.findall(text))
+
+
+def get_token_counter(model: str) -> Callable[[str], int]:
+    """
+    Counts tokens with the model's own tokenizer if tiktoken is installed, with estimate_tokens otherwise
+    """
+    if importlib.util.find_spec("tiktoken") is None:
+        return estimate_tokens
+    import tiktoken
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        return estimate_tokens
+    return lambda text: len(encoding.encode(text))
+
+
+class BatchInput(NamedTuple):
+    name: str
+    text: str
+
+
+class PromptPart(NamedTuple):
+    # Index of the input the text belongs to, and which piece of it this is if the input had to be split
+    input_index: int
+    piece: int
+    text: str
+    tokens: int
+
+
+class PackedPrompt(NamedTuple):
+    prompt: str
+    parts: list[PromptPart]
+    tokens: int
+
+
+def split_text(text: str, count_tokens: Callable[[str], int], max_tokens: int) -> list[str]:
+    """
+    Splits a text into pieces of at most max_tokens, at line breaks where possible and between words otherwise
+    """
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    pieces: list[str] = []
+    current: list[str] = []
+    current_tokens = 0
+    for line in text.split("\n"):
+        line_tokens = count_tokens(line) + 1
+        if line_tokens > max_tokens:
+            # A single line too long for a piece is split between words instead
+            words = line.split(" ")
+            line_pieces = []
+            for word in words:
+                if line_pieces and count_tokens(line_pieces[-1] + " " + word) <= max_tokens:
+                    line_pieces[-1] += " " + word
+                else:
+                    line_pieces.append(word)
+            units = [(piece, count_tokens(piece) + 1) for piece in line_pieces]
+        else:
+            units = [(line, line_tokens)]
+        for unit, unit_tokens in units:
+            if current and current_tokens + unit_tokens > max_tokens:
+                pieces.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(unit)
+            current_tokens += unit_tokens
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def format_prompt(instruction: str, parts: list[PromptPart]) -> str:
+    if len(parts) == 1:
+        return instruction + "\n" + parts[0].text
+    documents = "\n\n".join(_DOCUMENT_HEADER.format(number=number) + "\n" + part.text
+                            for number, part in enumerate(parts, start=1))
+    return f"{instruction}\n{BATCH_INSTRUCTIONS}\n\n{documents}"
+
+
+def pack_prompts(instruction: str, inputs: list[BatchInput], count_tokens: Callable[[str], int],
+                 max_prompt_tokens: int, max_documents: Optional[int] = None) -> list[PackedPrompt]:
+    """
+    Packs the inputs into as few prompts of at most max_prompt_tokens as possible, in input order. Each prompt
+    carries the instruction once and every input as a numbered document, inputs too long for one prompt are split
+    into pieces that go out as separate documents
+    """
+    overhead = count_tokens(f"{instruction}\n{BATCH_INSTRUCTIONS}\n\n")
+    # Header line and blank line around every document
+    document_overhead = count_tokens(_DOCUMENT_HEADER.format(number=999)) + 2
+    max_part_tokens = max_prompt_tokens - overhead - document_overhead
+    if max_part_tokens <= 0:
+        raise ValueError(f"A prompt of {max_prompt_tokens} tokens has no room left for the input")
+    parts = [PromptPart(index, piece_number, piece, count_tokens(piece) + document_overhead)
+             for index, batch_input in enumerate(inputs)
+             for piece_number, piece in enumerate(split_text(batch_input.text, count_tokens, max_part_tokens))]
+    prompts: list[PackedPrompt] = []
+    current: list[PromptPart] = []
+    current_tokens = overhead
+    for part in parts:
+        full = max_documents is not None and len(current) >= max_documents
+        if current and (full or current_tokens + part.tokens > max_prompt_tokens):
+            prompts.append(PackedPrompt(format_prompt(instruction, current), current, current_tokens))
+            current, current_tokens = [], overhead
+        current.append(part)
+        current_tokens += part.tokens
+    if current:
+        prompts.append(PackedPrompt(format_prompt(instruction, current), current, current_tokens))
+    return prompts
+
+
+def split_answers(completion: str, num_documents: int, truncated: bool = False) -> dict[int, str]:
+    """
+    Splits a completion for a packed prompt into the answer for each document, keyed by the document's index in the
+    prompt (from 0). Documents the model didn't answer under their header, or answered with nothing, are missing. A
+    completion cut off by max_tokens (truncated) is missing the answer it ends in too, as it may be incomplete
+    """
+    if num_documents == 1:
+        return {0: completion.strip()}
+    answers: dict[int, str] = {}
+    headers = list(_ANSWER_HEADER_PATTERN.finditer(completion))
+    for header, next_header in zip(headers, headers[1:] + [None]):
+        index = int(header.group(1)) - 1
+        if next_header is None and truncated:
+            break
+        if 0 <= index < num_documents and index not in answers:
+            end = next_header.start() if next_header is not None else len(completion)
+            answer = completion[header.end():end].strip()
+            if answer:
+                answers[index] = answer
+    return answers
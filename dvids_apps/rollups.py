@@ -0,0 +1,256 @@
+import re
+from datetime import date, datetime, time, timedelta
+from typing import Any, Iterable, NamedTuple, Optional, Union
+
+from sqlalchemy import Date, delete, distinct, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql.elements import ColumnElement
+
+from dvids_apps.models.db_models import DailyKeywordCount, DailyRollup, Keyword, Product, ProductKeyword
+
+FACETS = ("day", "unit_name", "branch")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+DateLike = Union[date, datetime]
+
+
+class FacetCount(NamedTuple):
+    value: Any
+    products: int
+    # Distinct titles per day, summed over the days for the unit_name and branch facets
+    titles: int
+
+
+class KeywordCount(NamedTuple):
+    keyword: str
+    products: int
+
+
+def normalize_keyword(keyword: str) -> str:
+    return _WHITESPACE_PATTERN.sub(" ", keyword).strip().lower()
+
+
+def normalize_keywords(keywords: Optional[str]) -> list[str]:
+    """
+    Splits a product's comma separated keywords into distinct normalized keywords (lowercased, whitespace collapsed),
+    in order of first appearance
+    """
+    if not keywords:
+        return []
+    normalized = (normalize_keyword(keyword) for keyword in keywords.split(","))
+    return list(dict.fromkeys(keyword for keyword in normalized if keyword))
+
+
+def index_keywords(connection: Connection, product_rows: list[dict[str, Any]], existing_ids: list[str]) -> None:
+    """
+    Updates the keyword inverted index for a batch of product rows. existing_ids are the products that were already
+    in the database, their previous keywords are removed first
+    """
+    for i in range(0, len(existing_ids), 500):
+        chunk = existing_ids[i:i + 500]
+        connection.execute(delete(ProductKeyword.__table__).where(ProductKeyword.__table__.c.asset_id.in_(chunk)))
+    keywords_by_product = {row["id"]: normalize_keywords(row["keywords"]) for row in product_rows}
+    distinct_keywords = sorted({keyword for keywords in keywords_by_product.values() for keyword in keywords})
+    if not distinct_keywords:
+        return
+    connection.execute(sqlite_insert(Keyword.__table__).on_conflict_do_nothing(),
+                       [{"keyword": keyword} for keyword in distinct_keywords])
+    keyword_ids: dict[str, int] = {}
+    # Stay under SQLite's bound parameter limit
+    for i in range(0, len(distinct_keywords), 500):
+        chunk = distinct_keywords[i:i + 500]
+        keyword_ids.update(connection.execute(
+            select(Keyword.__table__.c.keyword, Keyword.__table__.c.id).where(Keyword.__table__.c.keyword.in_(chunk))
+        ).all())
+    connection.execute(insert(ProductKeyword.__table__),
+                       [{"asset_id": product_id, "keyword_id": keyword_ids[keyword]}
+                        for product_id, keywords in keywords_by_product.items() for keyword in keywords])
+
+
+def _day_start(day: DateLike) -> datetime:
+    return datetime.combine(day.date() if isinstance(day, datetime) else day, time())
+
+
+def _product_date_conditions(begin: Optional[DateLike], end: Optional[DateLike]) -> list[ColumnElement]:
+    conditions = []
+    if begin is not None:
+        conditions.append(Product.date >= _day_start(begin))
+    if end is not None:
+        conditions.append(Product.date < _day_start(end) + timedelta(days=1))
+    return conditions
+
+
+def _insert_rollups(connection: Connection, conditions: list[ColumnElement]) -> None:
+    """
+    Computes the rollups of the products matching the conditions (a date range) from the products table
+    """
+    day = func.date(Product.date)
+    connection.execute(insert(DailyRollup.__table__).from_select(
+        ["day", "unit_name", "branch", "product_count", "title_count"],
+        select(day, Product.unit_name, Product.branch, func.count(), func.count(distinct(Product.title)))
+        .where(*conditions)
+        .group_by(day, Product.unit_name, Product.branch)
+    ))
+    connection.execute(insert(DailyKeywordCount.__table__).from_select(
+        ["day", "keyword_id", "product_count"],
+        select(day, ProductKeyword.keyword_id, func.count())
+        .select_from(Product)
+        .join(ProductKeyword, ProductKeyword.asset_id == Product.id)
+        .where(*conditions)
+        .group_by(day, ProductKeyword.keyword_id)
+    ))
+
+
+def refresh_days(connection: Connection, days: Iterable[date]) -> None:
+    """
+    Recomputes the rollups of the given days from the products table (and the keyword index, which must be up to
+    date). Each day is a range scan of the products date index
+    """
+    for day in sorted(set(days)):
+        connection.execute(delete(DailyRollup.__table__).where(DailyRollup.__table__.c.day == day))
+        connection.execute(delete(DailyKeywordCount.__table__).where(DailyKeywordCount.__table__.c.day == day))
+        _insert_rollups(connection, _product_date_conditions(day, day))
+
+
+def rebuild_rollups(engine: Engine) -> None:
+    """
+    Recomputes every day's rollups in one pass over the products table
+    """
+    with engine.begin() as connection:
+        connection.execute(delete(DailyRollup.__table__))
+        connection.execute(delete(DailyKeywordCount.__table__))
+        _insert_rollups(connection, [])
+
+
+def rebuild_keyword_index(engine: Engine, chunk_size: int = 5000) -> None:
+    """
+    Rebuilds the keyword inverted index from the products' keywords, for databases loaded before it existed
+    """
+    with engine.begin() as connection:
+        connection.execute(delete(ProductKeyword.__table__))
+        last_id = None
+        while True:
+            query = select(Product.id, Product.keywords).order_by(Product.id).limit(chunk_size)
+            if last_id is not None:
+                query = query.where(Product.id > last_id)
+            rows = [{"id": product_id, "keywords": keywords} for product_id, keywords in connection.execute(query)]
+            if not rows:
+                break
+            index_keywords(connection, rows, [])
+            last_id = rows[-1]["id"]
+
+
+def _rollup_conditions(begin: Optional[DateLike], end: Optional[DateLike], unit_name: Optional[str],
+                       branch: Optional[str]) -> list[ColumnElement]:
+    conditions = []
+    if begin is not None:
+        conditions.append(DailyRollup.day >= _day_start(begin).date())
+    if end is not None:
+        conditions.append(DailyRollup.day <= _day_start(end).date())
+    if unit_name is not None:
+        conditions.append(DailyRollup.unit_name == unit_name)
+    if branch is not None:
+        conditions.append(DailyRollup.branch == branch)
+    return conditions
+
+
+def _product_conditions(begin: Optional[DateLike], end: Optional[DateLike], unit_name: Optional[str],
+                        branch: Optional[str]) -> list[ColumnElement]:
+    conditions = _product_date_conditions(begin, end)
+    if unit_name is not None:
+        conditions.append(Product.unit_name == unit_name)
+    if branch is not None:
+        conditions.append(Product.branch == branch)
+    return conditions
+
+
+def count_products(connection: Connection, begin: Optional[DateLike] = None, end: Optional[DateLike] = None,
+                   unit_name: Optional[str] = None, branch: Optional[str] = None) -> int:
+    """
+    Number of products dated begin to end (inclusive) of the unit and branch, from the rollups
+    """
+    query = select(func.coalesce(func.sum(DailyRollup.product_count), 0)) \
+        .where(*_rollup_conditions(begin, end, unit_name, branch))
+    return connection.execute(query).scalar()
+
+
+def facet_counts(connection: Connection, facet: str, begin: Optional[DateLike] = None,
+                 end: Optional[DateLike] = None, unit_name: Optional[str] = None, branch: Optional[str] = None,
+                 keyword: Optional[str] = None, limit: Optional[int] = None) -> list[FacetCount]:
+    """
+    Product and title counts per value of a facet (day, unit_name or branch) among the products dated begin to end
+    (inclusive), optionally only of a unit, a branch and/or with a keyword. Days come in date order, units and
+    branches with the most products first. Served from the rollups, or through the keyword index with a keyword
+    (where titles are counted distinct over the whole range)
+    """
+    if facet not in FACETS:
+        raise ValueError(f"Unknown facet {facet}, expected one of {', '.join(FACETS)}")
+    if keyword is None:
+        column = getattr(DailyRollup, facet)
+        products = func.sum(DailyRollup.product_count)
+        query = select(column, products, func.sum(DailyRollup.title_count)) \
+            .where(*_rollup_conditions(begin, end, unit_name, branch))
+    else:
+        column = func.date(Product.date, type_=Date) if facet == "day" else getattr(Product, facet)
+        products = func.count()
+        query = select(column, products, func.count(distinct(Product.title))) \
+            .select_from(ProductKeyword) \
+            .join(Keyword, Keyword.id == ProductKeyword.keyword_id) \
+            .join(Product, Product.id == ProductKeyword.asset_id) \
+            .where(Keyword.keyword == normalize_keyword(keyword),
+                   *_product_conditions(begin, end, unit_name, branch))
+    query = query.group_by(column)
+    query = query.order_by(column) if facet == "day" else query.order_by(products.desc(), column)
+    if limit is not None:
+        query = query.limit(limit)
+    return [FacetCount(*row) for row in connection.execute(query)]
+
+
+def top_keywords(connection: Connection, begin: Optional[DateLike] = None, end: Optional[DateLike] = None,
+                 unit_name: Optional[str] = None, branch: Optional[str] = None,
+                 limit: Optional[int] = 20) -> list[KeywordCount]:
+    """
+    The most frequent keywords of the products dated begin to end (inclusive), by number of products. Served from
+    the daily keyword counts, or through the keyword index when filtering on a unit or branch
+    """
+    if unit_name is None and branch is None:
+        conditions = []
+        if begin is not None:
+            conditions.append(DailyKeywordCount.day >= _day_start(begin).date())
+        if end is not None:
+            conditions.append(DailyKeywordCount.day <= _day_start(end).date())
+        products = func.sum(DailyKeywordCount.product_count)
+        query = select(Keyword.keyword, products) \
+            .select_from(DailyKeywordCount) \
+            .join(Keyword, Keyword.id == DailyKeywordCount.keyword_id) \
+            .where(*conditions) \
+            .group_by(DailyKeywordCount.keyword_id)
+    else:
+        products = func.count()
+        query = select(Keyword.keyword, products) \
+            .select_from(ProductKeyword) \
+            .join(Keyword, Keyword.id == ProductKeyword.keyword_id) \
+            .join(Product, Product.id == ProductKeyword.asset_id) \
+            .where(*_product_conditions(begin, end, unit_name, branch)) \
+            .group_by(ProductKeyword.keyword_id)
+    query = query.order_by(products.desc(), Keyword.keyword)
+    if limit is not None:
+        query = query.limit(limit)
+    return [KeywordCount(*row) for row in connection.execute(query)]
+
+
+def products_with_keyword(connection: Connection, keyword: str, begin: Optional[DateLike] = None,
+                          end: Optional[DateLike] = None, limit: Optional[int] = None) -> list[str]:
+    """
+    Ids of the products with a keyword, newest first, looked up through the keyword index
+    """
+    query = select(Product.id) \
+        .select_from(ProductKeyword) \
+        .join(Keyword, Keyword.id == ProductKeyword.keyword_id) \
+        .join(Product, Product.id == ProductKeyword.asset_id) \
+        .where(Keyword.keyword == normalize_keyword(keyword), *_product_date_conditions(begin, end)) \
+        .order_by(Product.date.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return list(connection.execute(query).scalars())
@@ -0,0 +1,175 @@
+import asyncio
+import importlib.util
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+
+from dvids_apps.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+REQUESTS = METRICS.counter('dvids_requests_total', 'HTTP requests made, by status code (error for transport errors)')
+RETRIES = METRICS.counter('dvids_request_retries_total', 'Requests retried, by status code or transport error')
+RESPONSE_BYTES = METRICS.counter('dvids_response_bytes_total', 'Response bytes received, as sent over the wire')
+DECODED_BYTES = METRICS.counter('dvids_response_decoded_bytes_total', 'Response bytes received, after decompression')
+RESPONSE_ENCODINGS = METRICS.counter('dvids_response_encodings_total', 'Responses received, by Content-Encoding')
+REQUEST_SECONDS = METRICS.histogram('dvids_request_seconds', 'Time from sending a request to receiving its response')
+THROTTLE_SECONDS = METRICS.histogram('dvids_throttle_seconds',
+                                     'Time a request waited on the rate limit and concurrency bound before being sent')
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec('h2') is not None
+
+
+def make_client(max_connections: int, http2: Optional[bool] = None, timeout: float = 30.0) -> httpx.AsyncClient:
+    """
+    Async client tuned for many small API requests to one host. Over HTTP/2 every request is a stream on a single
+    multiplexed connection, over HTTP/1.1 up to max_connections are kept alive between requests instead of the five
+    second default so a rate limited run doesn't keep reconnecting. http2=None uses HTTP/2 if the h2 package
+    (httpx[http2]) is installed. httpx asks for gzip (and brotli/zstd when their packages are installed) by default,
+    the dvids_response_encodings_total metric shows what the server actually sent
+    """
+    if http2 is None:
+        http2 = http2_available()
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                          keepalive_expiry=60.0)
+    return httpx.AsyncClient(http2=http2, limits=limits, timeout=httpx.Timeout(timeout, connect=10.0))
+
+
+class TokenBucket:
+    """
+    Async token bucket. Tokens refill continuously at `rate` per second up to `capacity`, each acquire() consumes
+    one token and waits until one is available. A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def block_for(self, seconds: float) -> None:
+        """
+        Stops handing out tokens for the given number of seconds (used when the server asks us to back off)
+        """
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a Retry-After header, which is either a number of seconds or an HTTP date. Returns None if the header
+    is missing or malformed
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RequestScheduler:
+    """
+    Shared request scheduler: bounds the number of in-flight requests, paces them with a token bucket, and
+    retries transport errors and 429/5xx responses with jittered exponential backoff (honoring Retry-After).
+    """
+
+    def __init__(self, max_concurrency: int = 10, requests_per_second: float = 10.0, max_retries: int = 5,
+                 backoff_base: float = 0.5, backoff_cap: float = 60.0):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.bucket = TokenBucket(requests_per_second)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    def backoff_delay(self, attempt: int) -> float:
+        # "Full jitter" backoff, spreads retries out so throttled requests don't come back as a burst
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def get(self, client: httpx.AsyncClient, url: str) -> httpx.Response:
+        return await self.request(client, 'GET', url)
+
+    async def request(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Makes a request, retrying up to max_retries times. If retries are exhausted on a retryable status the last
+        response is returned so the caller can handle it like any other error response, transport errors are
+        re-raised. Keyword arguments are passed on to client.request
+        """
+        attempt = 0
+        while True:
+            waiting_since = time.perf_counter()
+            await self.bucket.acquire()
+            try:
+                async with self.semaphore:
+                    sent = time.perf_counter()
+                    THROTTLE_SECONDS.observe(sent - waiting_since)
+                    logger.debug('Making request to %s', url)
+                    try:
+                        response = await client.request(method, url, **kwargs)
+                    finally:
+                        REQUEST_SECONDS.observe(time.perf_counter() - sent)
+            except httpx.HTTPError as e:
+                REQUESTS.inc(status='error')
+                if attempt >= self.max_retries:
+                    logger.error('Giving up on %s after %d attempts', url, attempt + 1)
+                    raise e
+                RETRIES.inc(reason='transport')
+                delay = self.backoff_delay(attempt)
+                logger.warning('Exception thrown for url %s, retrying in %.2f seconds', url, delay)
+            else:
+                REQUESTS.inc(status=response.status_code)
+                RESPONSE_BYTES.inc(response.num_bytes_downloaded)
+                DECODED_BYTES.inc(len(response.content))
+                RESPONSE_ENCODINGS.inc(encoding=response.headers.get('Content-Encoding', 'identity'))
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                if attempt >= self.max_retries:
+                    logger.error('Giving up on %s after %d attempts (status %d)', url, attempt + 1,
+                                 response.status_code)
+                    return response
+                RETRIES.inc(reason=response.status_code)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after is not None:
+                    delay = min(retry_after, self.backoff_cap)
+                    self.bucket.block_for(delay)
+                else:
+                    delay = self.backoff_delay(attempt)
+                logger.warning('Status %d for url %s, retrying in %.2f seconds', response.status_code, url, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from sqlalchemy import text, bindparam, DateTime
+from sqlalchemy.engine import Engine
+
+SEARCH_TABLE = "products_fts"
+SEARCH_COLUMNS = ("title", "description", "keywords", "unit_name", "body")
+# bm25 weight per column in SEARCH_COLUMNS order, a match in the title counts for more than one in the body
+SEARCH_WEIGHTS = (10.0, 5.0, 5.0, 2.0, 1.0)
+_TRIGGERS = ("products_fts_insert", "products_fts_delete", "products_fts_update")
+
+_columns = ", ".join(SEARCH_COLUMNS)
+_new_values = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS)
+_old_values = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS)
+
+# External content table: the index points at products' rowids instead of storing another copy of every body.
+# Rowids of a table without an INTEGER PRIMARY KEY can change on VACUUM, run rebuild_search_index afterwards
+CREATE_SEARCH_TABLE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+    {_columns}, content='products', content_rowid='rowid', tokenize='porter unicode61'
+)
+"""
+
+CREATE_SEARCH_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, {_columns}) VALUES (new.rowid, {_new_values});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+        INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, {_columns}) VALUES ('delete', old.rowid, {_old_values});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products BEGIN
+        INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, {_columns}) VALUES ('delete', old.rowid, {_old_values});
+        INSERT INTO {SEARCH_TABLE} (rowid, {_columns}) VALUES (new.rowid, {_new_values});
+    END
+    """
+)
+
+
+class SearchResult(NamedTuple):
+    id: str
+    title: str
+    date: datetime
+    score: float
+    snippet: str
+
+
+def create_search_table(engine: Engine) -> None:
+    with engine.begin() as connection:
+        connection.exec_driver_sql(CREATE_SEARCH_TABLE)
+
+
+def has_search_triggers(engine: Engine) -> bool:
+    with engine.connect() as connection:
+        names = connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'trigger'").scalars().all()
+    return all(trigger in names for trigger in _TRIGGERS)
+
+
+def drop_search_triggers(engine: Engine) -> None:
+    """
+    Stops maintaining the search index row by row. Used during bulk loads, call create_search_triggers and
+    rebuild_search_index afterwards
+    """
+    with engine.begin() as connection:
+        for trigger in _TRIGGERS:
+            connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+
+
+def create_search_triggers(engine: Engine) -> None:
+    with engine.begin() as connection:
+        for statement in CREATE_SEARCH_TRIGGERS:
+            connection.exec_driver_sql(statement)
+
+
+def rebuild_search_index(engine: Engine) -> None:
+    """
+    Rebuilds the whole search index from the products table
+    """
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+
+
+def search_products(engine: Engine, query: str, limit: int = 20, begin: Optional[datetime] = None,
+                    end: Optional[datetime] = None) -> list[SearchResult]:
+    """
+    Full text search over products, best matches (lowest bm25) first. The query uses FTS5 syntax: plain keywords,
+    "quoted phrases", AND/OR/NOT, prefix* and column filters such as unit_name: marines
+    """
+    conditions = [f"{SEARCH_TABLE} MATCH :query"]
+    date_parameters = []
+    if begin:
+        conditions.append("products.date >= :begin")
+        date_parameters.append(bindparam("begin", type_=DateTime))
+    if end:
+        conditions.append("products.date < :end")
+        date_parameters.append(bindparam("end", type_=DateTime))
+    weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
+    statement = text(f"""
+        SELECT products.id, products.title, products.date, bm25({SEARCH_TABLE}, {weights}) AS score,
+               snippet({SEARCH_TABLE}, -1, '[', ']', '...', 16) AS snippet
+        FROM {SEARCH_TABLE} JOIN products ON products.rowid = {SEARCH_TABLE}.rowid
+        WHERE {' AND '.join(conditions)}
+        ORDER BY score
+        LIMIT :limit
+    """).bindparams(*date_parameters).columns(date=DateTime)
+    parameters = {"query": query, "limit": limit, "begin": begin, "end": end + timedelta(days=1) if end else None}
+    with engine.connect() as connection:
+        return [SearchResult(*row) for row in connection.execute(statement, parameters)]
@@ -0,0 +1,234 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+
+import ujson
+from sqlalchemy import create_engine, select
+from sqlalchemy.engine import Connection, Engine
+
+from dvids_apps.bulk_load import BulkLoader, ProductRows, create_loading_engine, delete_products
+from dvids_apps.dedupe import Deduplicator
+from dvids_apps.migrations import upgrade_schema
+from dvids_apps.models.db_models import Product
+
+SHARD_PERIODS = ("year", "quarter", "month", "day")
+DEFAULT_SHARD_PERIOD = "month"
+LAYOUT_FILE = "shards.json"
+SHARD_SUFFIX = ".sqlite3"
+
+
+def period_start(date: datetime, period: str) -> datetime:
+    day = date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "year":
+        return day.replace(month=1, day=1)
+    if period == "quarter":
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    if period == "month":
+        return day.replace(day=1)
+    if period == "day":
+        return day
+    raise ValueError(f"Unknown shard period {period}, expected one of {', '.join(SHARD_PERIODS)}")
+
+
+def next_period_start(start: datetime, period: str) -> datetime:
+    if period == "year":
+        return start.replace(year=start.year + 1)
+    if period in ("quarter", "month"):
+        month = start.month + (3 if period == "quarter" else 1)
+        return start.replace(year=start.year + (month - 1) // 12, month=(month - 1) % 12 + 1)
+    if period == "day":
+        return start + timedelta(days=1)
+    raise ValueError(f"Unknown shard period {period}, expected one of {', '.join(SHARD_PERIODS)}")
+
+
+def shard_key(date: datetime, period: str) -> str:
+    """
+    Name of the shard holding a date, e.g. 2022-03 for month shards. Keys of one period sort chronologically
+    """
+    start = period_start(date, period)
+    if period == "year":
+        return start.strftime("%Y")
+    if period == "quarter":
+        return f"{start.year}-Q{(start.month - 1) // 3 + 1}"
+    if period == "month":
+        return start.strftime("%Y-%m")
+    return start.strftime("%Y-%m-%d")
+
+
+class ShardedDatabase:
+    """
+    A database split into one SQLite file per period (month by default) of the products' date, each with the full
+    schema. Shards are written independently, so several processes can load different periods at once, and a query
+    filtered on a date range only opens the shards overlapping it. The directory holds <key>.sqlite3 files and a
+    shards.json recording the period.
+    """
+
+    def __init__(self, directory: Union[str, Path], period: Optional[str] = None):
+        """
+        Opens the sharded database in directory. Giving a period creates the layout if the directory doesn't hold one
+        yet, and checks it matches otherwise
+        """
+        self.directory = Path(directory)
+        layout_path = self.directory.joinpath(LAYOUT_FILE)
+        if layout_path.exists():
+            with open(layout_path, "r", encoding="utf-8") as layout_file:
+                self.period = ujson.load(layout_file)["period"]
+            if period is not None and period != self.period:
+                raise ValueError(f"{self.directory} is sharded by {self.period}, not by {period}")
+        elif period is not None:
+            if period not in SHARD_PERIODS:
+                raise ValueError(f"Unknown shard period {period}, expected one of {', '.join(SHARD_PERIODS)}")
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(layout_path, "w", encoding="utf-8") as layout_file:
+                ujson.dump({"period": period}, layout_file)
+            self.period = period
+        else:
+            raise ValueError(f"{self.directory} is not a sharded database (no {LAYOUT_FILE})")
+
+    def shard_key(self, date: datetime) -> str:
+        return shard_key(date, self.period)
+
+    def shard_path(self, key: str) -> Path:
+        return self.directory.joinpath(f"{key}{SHARD_SUFFIX}")
+
+    def shard_periods(self, begin: datetime, end: datetime) -> Iterator[tuple[str, datetime, datetime]]:
+        """
+        Yields (key, first date, last date) of every period overlapping begin to end (inclusive), clipped to the range
+        """
+        start = period_start(begin, self.period)
+        while start <= end:
+            next_start = next_period_start(start, self.period)
+            yield shard_key(start, self.period), max(start, begin), min(next_start - timedelta(days=1), end)
+            start = next_start
+
+    def shard_paths(self, begin: Optional[datetime] = None, end: Optional[datetime] = None) -> list[Path]:
+        """
+        Existing shards overlapping begin to end (inclusive), or all of them, in date order
+        """
+        if begin is None or end is None:
+            return sorted(self.directory.glob(f"*{SHARD_SUFFIX}"))
+        paths = (self.shard_path(key) for key, _, _ in self.shard_periods(begin, end))
+        return [shard_path for shard_path in paths if shard_path.exists()]
+
+    def iter_connections(self, begin: Optional[datetime] = None,
+                         end: Optional[datetime] = None) -> Iterator[Connection]:
+        """
+        Yields a connection to each shard overlapping the range in date order, only one shard is open at a time.
+        Queries are run against each shard in turn (fanned out) rather than through ATTACHed databases, which SQLite
+        limits to 10 by default
+        """
+        for shard_path in self.shard_paths(begin, end):
+            engine = create_engine(f"sqlite:///{shard_path}")
+            try:
+                with engine.connect() as connection:
+                    yield connection
+            finally:
+                engine.dispose()
+
+    def loading_engine(self, key: str) -> Engine:
+        """
+        A bulk loading engine (see create_loading_engine) for a shard, creating the shard if it doesn't exist
+        """
+        engine = create_loading_engine(self.shard_path(key))
+        upgrade_schema(engine)
+        return engine
+
+    def remove_stale_copies(self, shard_by_id: dict[str, str]) -> int:
+        """
+        Deletes every copy of the given products (id -> key of the shard they were just written to) from the other
+        shards. A product re-ingested with a date in another period would otherwise be left in its old shard too and
+        counted twice by fanned out queries. Scans each shard's product ids once, returns the number of copies deleted
+        """
+        removed = 0
+        for shard_path in self.shard_paths():
+            key = shard_path.name[:-len(SHARD_SUFFIX)]
+            engine = create_engine(f"sqlite:///{shard_path}")
+            try:
+                with engine.connect() as connection:
+                    stale_ids = [product_id for product_id in connection.execute(select(Product.id)).scalars()
+                                 if shard_by_id.get(product_id, key) != key]
+                if stale_ids:
+                    removed += delete_products(engine, stale_ids)
+            finally:
+                engine.dispose()
+        return removed
+
+
+def is_sharded(database_path: Union[str, Path]) -> bool:
+    return Path(database_path).joinpath(LAYOUT_FILE).exists()
+
+
+def iter_database_connections(database_path: Union[str, Path], begin: Optional[datetime] = None,
+                              end: Optional[datetime] = None) -> Iterator[Connection]:
+    """
+    Yields connections covering begin to end: the database itself for a single file, or each overlapping shard of a
+    sharded database. Lets a query run the same way against either layout
+    """
+    if is_sharded(database_path):
+        yield from ShardedDatabase(database_path).iter_connections(begin, end)
+        return
+    engine = create_engine(f"sqlite:///{database_path}")
+    try:
+        with engine.connect() as connection:
+            yield connection
+    finally:
+        engine.dispose()
+
+
+class ShardedLoader:
+    """
+    Routes product rows to a BulkLoader per shard by the product's date, batching each shard separately. Near
+    duplicates are only detected within a shard. On a clean exit, the copies the loaded products left in other
+    shards (when their date moved to another period) are deleted
+    """
+
+    def __init__(self, database: ShardedDatabase, batch_size: int = 1000,
+                 deduplicator: Optional[Deduplicator] = None):
+        self.database = database
+        self.batch_size = batch_size
+        self.deduplicator = deduplicator
+        self.loaders: dict[str, BulkLoader] = {}
+        # Shard each product was last routed to
+        self.shard_by_id: dict[str, str] = {}
+
+    @property
+    def rows_written(self) -> int:
+        return sum(loader.rows_written for loader in self.loaders.values())
+
+    def add_rows(self, rows: ProductRows) -> None:
+        key = self.database.shard_key(rows[0]["date"])
+        loader = self.loaders.get(key)
+        if loader is None:
+            loader = self.loaders[key] = BulkLoader(self.database.loading_engine(key), self.batch_size,
+                                                    self.deduplicator)
+        loader.add_rows(rows)
+        self.shard_by_id[rows[0]["id"]] = key
+        if loader.full:
+            loader.flush()
+
+    def add_loaded(self, key: str, product_ids: Iterable[str]) -> None:
+        """
+        Records products written to a shard outside this loader (by a worker process), so their copies in other
+        shards are deleted on exit too
+        """
+        for product_id in product_ids:
+            self.shard_by_id[product_id] = key
+
+    def flush(self) -> None:
+        for loader in self.loaders.values():
+            loader.flush()
+
+    def close(self) -> None:
+        for loader in self.loaders.values():
+            loader.engine.dispose()
+
+    def __enter__(self) -> "ShardedLoader":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        try:
+            if exc_type is None:
+                self.flush()
+                self.database.remove_stale_copies(self.shard_by_id)
+        finally:
+            self.close()
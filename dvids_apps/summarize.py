@@ -0,0 +1,255 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from dvids_apps.helpers import bounded_map
+
+# SMMRY's SM_LENGTH default, the number of sentences in a summary
+SMMRY_DEFAULT_SENTENCES = 7
+METHODS = ("textrank", "tfidf", "frequency")
+DEFAULT_METHOD = "textrank"
+DAMPING = 0.85
+MAX_ITERATIONS = 50
+TOLERANCE = 1e-6
+# Cells of the padded (texts, sentences, terms) array TextRank works on at once, 32MB of float64
+MAX_PADDED_CELLS = 4_000_000
+
+STOP_WORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+herself him himself his how i if in into is it its itself just me more most my myself no nor not now of off on once
+only or other our ours ourselves out over own said same she should so some such than that the their theirs them
+themselves then there these they this those through to too under until up very was we were what when where which
+while who whom why will with would you your yours yourself yourselves
+""".split())
+# Words ending in a period that don't end a sentence, common in DVIDS articles (ranks, units, months, states)
+ABBREVIATIONS = frozenset("""
+adm brig capt cdr cmdr col cpl cpt ens gen gy lt maj msg pfc pvt sgt spc ssg sfc mr mrs ms dr st jr sr
+vs etc inc co corp ft mt jan feb mar apr jun jul aug sep sept oct nov dec ala ariz ark calif colo conn fla ga ill
+ind kan ky la md mass mich minn miss mo mont neb nev okla ore pa tenn tex va vt wash wis wyo
+""".split())
+_SENTENCE_BREAK_PATTERN = re.compile(r"(?<=[.!?])[\"'”’)\]]*\s+")
+_LAST_WORD_PATTERN = re.compile(r"([\w.]+)\.[\"'”’)\]]*$")
+_WORD_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+_SUFFIXES = ("ing", "ed", "es", "s")
+
+
+def split_sentences(text: str) -> list[str]:
+    """
+    Splits a text into sentences: at line breaks, and after ., ! or ? followed by whitespace unless the period ends
+    an abbreviation or initial (Sgt., U.S., J.) or the next piece starts in lowercase
+    """
+    sentences: list[str] = []
+    for line in text.splitlines():
+        pending = ""
+        for piece in _SENTENCE_BREAK_PATTERN.split(line.strip()):
+            if not piece:
+                continue
+            if pending:
+                last_word = _LAST_WORD_PATTERN.search(pending)
+                joined = last_word is not None and (last_word.group(1).lower() in ABBREVIATIONS
+                                                    or "." in last_word.group(1)
+                                                    or (len(last_word.group(1)) == 1 and last_word.group(1).isalpha()))
+                if joined or not (piece[0].isupper() or piece[0] in "\"'“(["):
+                    pending = f"{pending} {piece}"
+                    continue
+                sentences.append(pending)
+            pending = piece
+        if pending:
+            sentences.append(pending)
+    return sentences
+
+
+def _stem(word: str) -> str:
+    # Crude, but enough to count "soldier" and "soldiers" or "train" and "training" as the same word
+    if word.endswith("'s"):
+        word = word[:-2]
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.endswith("ss"):
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(sentence: str) -> list[str]:
+    return [_stem(word) for word in _WORD_PATTERN.findall(sentence.lower()) if word not in STOP_WORDS]
+
+
+def _textrank(entry_doc: np.ndarray, local_sentence: np.ndarray, local_term: np.ndarray, weights: np.ndarray,
+              sentence_counts: np.ndarray) -> np.ndarray:
+    """
+    PageRank over each text's sentence similarity graph, all texts at once: the sentence vectors are scattered into a
+    (texts, sentences, terms) array padded to the longest text, so the cosine similarities are one batched matrix
+    product and every power iteration a batched matrix-vector product. See _padded_groups for keeping it small
+    """
+    num_docs = len(sentence_counts)
+    max_sentences = int(sentence_counts.max())
+    vectors = np.zeros((num_docs, max_sentences, int(local_term.max()) + 1 if local_term.size else 1))
+    vectors[entry_doc, local_sentence, local_term] = weights
+    similarity = vectors @ vectors.transpose(0, 2, 1)
+    diagonal = np.arange(max_sentences)
+    similarity[:, diagonal, diagonal] = 0
+    row_sums = similarity.sum(axis=2, keepdims=True)
+    transitions = np.divide(similarity, row_sums, out=np.zeros_like(similarity), where=row_sums > 0)
+    mask = diagonal[None, :] < sentence_counts[:, None]
+    teleport = mask / sentence_counts[:, None]
+    dangling = (row_sums[:, :, 0] == 0) & mask
+    ranks = teleport.copy()
+    for _ in range(MAX_ITERATIONS):
+        # Sentences sharing no words with the rest spread their rank evenly, like the teleport
+        dangling_rank = (ranks * dangling).sum(axis=1, keepdims=True)
+        updated = (1 - DAMPING) * teleport + DAMPING * (np.einsum("bij,bi->bj", transitions, ranks)
+                                                        + dangling_rank * teleport)
+        converged = np.abs(updated - ranks).max() < TOLERANCE
+        ranks = updated
+        if converged:
+            break
+    return ranks[mask]
+
+
+def _padded_groups(sentence_counts: np.ndarray, term_counts: np.ndarray) -> list[np.ndarray]:
+    """
+    Splits texts with sentences into groups whose padded TextRank arrays stay under MAX_PADDED_CELLS. Texts are
+    grouped by size, so one long text isn't padded to across a batch of short ones. A text over the cap on its own is
+    a group of one
+    """
+    groups: list[np.ndarray] = []
+    order = [int(index) for index in np.lexsort((term_counts, sentence_counts)) if sentence_counts[index] > 0]
+    group: list[int] = []
+    max_sentences = max_terms = 0
+    for index in order:
+        sentences = max(max_sentences, int(sentence_counts[index]))
+        terms = max(max_terms, int(term_counts[index]))
+        if group and (len(group) + 1) * sentences * max(sentences, terms) > MAX_PADDED_CELLS:
+            groups.append(np.array(group))
+            group, sentences, terms = [], int(sentence_counts[index]), int(term_counts[index])
+        group.append(index)
+        max_sentences, max_terms = sentences, terms
+    if group:
+        groups.append(np.array(group))
+    return groups
+
+
+def score_sentences(sentences_per_text: list[list[str]], method: str = DEFAULT_METHOD) -> list[np.ndarray]:
+    """
+    Scores every sentence of a batch of texts, higher is more central to its text. Scores only depend on the text
+    itself (document frequencies are counted over the text's sentences), not on the rest of the batch:
+    - frequency: sum of how often the sentence's words occur in the text, like SMMRY
+    - tfidf: cosine similarity of the sentence's TF-IDF vector with the text's centroid
+    - textrank: PageRank over the cosine similarities of the sentences' TF-IDF vectors
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method}, expected one of {', '.join(METHODS)}")
+    sentence_counts = np.array([len(sentences) for sentences in sentences_per_text], dtype=np.int64)
+    num_sentences = int(sentence_counts.sum())
+    if num_sentences == 0:
+        return [np.zeros(0) for _ in sentences_per_text]
+    vocabulary: dict[str, int] = {}
+    sentence_ids: list[int] = []
+    term_ids: list[int] = []
+    sentence_index = 0
+    for sentences in sentences_per_text:
+        for sentence in sentences:
+            for token in tokenize(sentence):
+                term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                sentence_ids.append(sentence_index)
+            sentence_index += 1
+    num_terms = max(len(vocabulary), 1)
+    sentence_doc = np.repeat(np.arange(len(sentences_per_text)), sentence_counts)
+    sentence_offsets = np.concatenate(([0], np.cumsum(sentence_counts)[:-1]))
+
+    # Sparse sentence x term counts as (sentence, term) entries sorted by sentence, then per text aggregates as
+    # (text, term) entries sorted by text, each entry pointing at its aggregate
+    keys, counts = np.unique(np.array(sentence_ids, dtype=np.int64) * num_terms + np.array(term_ids, dtype=np.int64),
+                             return_counts=True)
+    entry_sentence = keys // num_terms
+    entry_doc = sentence_doc[entry_sentence]
+    doc_term_keys, entry_doc_term = np.unique(entry_doc * num_terms + keys % num_terms, return_inverse=True)
+    doc_term_doc = doc_term_keys // num_terms
+    if method == "frequency":
+        term_frequency = np.bincount(entry_doc_term, weights=counts, minlength=len(doc_term_keys))
+        scores = np.bincount(entry_sentence, weights=counts * term_frequency[entry_doc_term], minlength=num_sentences)
+        return np.split(scores, np.cumsum(sentence_counts)[:-1])
+
+    document_frequency = np.bincount(entry_doc_term, minlength=len(doc_term_keys))
+    idf = np.log((1 + sentence_counts[doc_term_doc]) / (1 + document_frequency)) + 1
+    weights = (1 + np.log(counts)) * idf[entry_doc_term]
+    norms = np.sqrt(np.bincount(entry_sentence, weights=weights ** 2, minlength=num_sentences))
+    weights = weights / norms[entry_sentence]
+    if method == "tfidf":
+        centroid = np.bincount(entry_doc_term, weights=weights, minlength=len(doc_term_keys)) \
+            / sentence_counts[doc_term_doc]
+        centroid_norms = np.sqrt(np.bincount(doc_term_doc, weights=centroid ** 2,
+                                             minlength=len(sentences_per_text)))
+        dots = np.bincount(entry_sentence, weights=weights * centroid[entry_doc_term], minlength=num_sentences)
+        scores = np.divide(dots, centroid_norms[sentence_doc], out=np.zeros(num_sentences),
+                           where=centroid_norms[sentence_doc] > 0)
+        return np.split(scores, np.cumsum(sentence_counts)[:-1])
+
+    # Index of each (text, term) aggregate among its text's terms
+    local_term = np.arange(len(doc_term_keys)) - np.searchsorted(doc_term_doc, doc_term_doc)
+    entry_local_sentence = entry_sentence - sentence_offsets[entry_doc]
+    scores = np.zeros(num_sentences)
+    group_index = np.full(len(sentences_per_text), -1)
+    for group in _padded_groups(sentence_counts, np.bincount(doc_term_doc, minlength=len(sentences_per_text))):
+        group_index[group] = np.arange(len(group))
+        in_group = group_index[entry_doc] >= 0
+        ranks = _textrank(group_index[entry_doc[in_group]], entry_local_sentence[in_group],
+                          local_term[entry_doc_term[in_group]], weights[in_group], sentence_counts[group])
+        # Ranks come back text by text in group order, each text's sentences in order
+        scores[np.concatenate([np.arange(sentence_offsets[doc], sentence_offsets[doc] + sentence_counts[doc])
+                               for doc in group])] = ranks
+        group_index[group] = -1
+    return np.split(scores, np.cumsum(sentence_counts)[:-1])
+
+
+def select_sentences(sentences: list[str], scores: np.ndarray, num_sentences: int) -> str:
+    """
+    The num_sentences best scoring sentences in their original order, joined like SMMRY's sm_api_content. Ties go to
+    the earlier sentence
+    """
+    best = np.sort(np.argsort(-scores, kind="stable")[:num_sentences])
+    return " ".join(sentences[index] for index in best)
+
+
+def summarize_batch(texts: list[str], num_sentences: int = SMMRY_DEFAULT_SENTENCES,
+                    method: str = DEFAULT_METHOD) -> list[str]:
+    """
+    Extractive summaries of a batch of texts, num_sentences sentences each (all of them for shorter texts)
+    """
+    sentences_per_text = [split_sentences(text) for text in texts]
+    return [select_sentences(sentences, scores, num_sentences)
+            for sentences, scores in zip(sentences_per_text, score_sentences(sentences_per_text, method))]
+
+
+def summarize(text: str, num_sentences: int = SMMRY_DEFAULT_SENTENCES, method: str = DEFAULT_METHOD) -> str:
+    return summarize_batch([text], num_sentences, method)[0]
+
+
+def _batches(texts: Iterable[str], batch_size: int) -> Iterator[list[str]]:
+    batch: list[str] = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def summarize_many(texts: Iterable[str], num_sentences: int = SMMRY_DEFAULT_SENTENCES, method: str = DEFAULT_METHOD,
+                   workers: int = 1, batch_size: int = 64) -> Iterator[str]:
+    """
+    Summarizes texts in batches of batch_size, spread over worker processes if workers > 1. Summaries are yielded in
+    text order
+    """
+    summarize_chunk = partial(summarize_batch, num_sentences=num_sentences, method=method)
+    if workers <= 1:
+        for batch in _batches(texts, batch_size):
+            yield from summarize_chunk(batch)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for summaries in bounded_map(executor, summarize_chunk, _batches(texts, batch_size), workers * 2):
+            yield from summaries
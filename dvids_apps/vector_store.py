@@ -0,0 +1,129 @@
+from pathlib import Path
+from typing import Hashable, Iterable, Optional, Sequence, Union
+
+import numpy as np
+import ujson
+
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.json"
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Scales every row to unit length. All-zero rows (texts without any known words) stay zero, so their cosine
+    similarity with anything is 0 like Doc.similarity
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def rowwise_cosine(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity of each row of first with the same row of second, in one pass over both matrices
+    """
+    return np.einsum("ij,ij->i", normalize_rows(first), normalize_rows(second))
+
+
+def aggregate_scores(scores: np.ndarray, groups: Sequence[Hashable]) -> dict[Hashable, dict[str, float]]:
+    """
+    Count, mean, median and sample standard deviation of the scores for each group
+    """
+    scores = np.asarray(scores)
+    groups = np.asarray(groups, dtype=object)
+    aggregates = {}
+    for group in dict.fromkeys(groups):
+        group_scores = scores[groups == group]
+        aggregates[group] = {
+            "count": int(group_scores.size),
+            "mean": float(group_scores.mean()),
+            "median": float(np.median(group_scores)),
+            "stdev": float(group_scores.std(ddof=1)) if group_scores.size > 1 else 0.0
+        }
+    return aggregates
+
+
+class VectorStore:
+    """
+    Document vectors for a set of ids, stored as a directory holding a normalized float32 matrix (vectors.npy, one row
+    per id) and the ids in row order (ids.json). The matrix is memory-mapped when opened, so only the rows a query
+    touches are paged in.
+    """
+
+    def __init__(self, directory: Union[str, Path], ids: list[str], vectors: np.ndarray):
+        self.directory = Path(directory)
+        self.ids = ids
+        self.vectors = vectors
+        self.index = {item_id: row for row, item_id in enumerate(ids)}
+
+    @classmethod
+    def open(cls, directory: Union[str, Path]) -> "VectorStore":
+        directory = Path(directory)
+        with open(directory.joinpath(IDS_FILE), encoding="utf-8") as ids_file:
+            ids = ujson.load(ids_file)
+        return cls(directory, ids, np.load(directory.joinpath(VECTORS_FILE), mmap_mode="r"))
+
+    @classmethod
+    def build(cls, directory: Union[str, Path], items: Iterable[tuple[str, np.ndarray]], count: int,
+              dimensions: int) -> "VectorStore":
+        """
+        Writes a store from (id, vector) pairs straight into a memory-mapped file, so building it never needs the
+        whole matrix in memory. count is an upper bound on the number of items
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        vectors = np.lib.format.open_memmap(directory.joinpath(VECTORS_FILE), mode="w+", dtype=np.float32,
+                                            shape=(count, dimensions))
+        ids: list[str] = []
+        for row, (item_id, vector) in enumerate(items):
+            vectors[row] = normalize_rows(vector.reshape(1, -1))[0]
+            ids.append(item_id)
+        vectors.flush()
+        del vectors
+        if len(ids) < count:
+            # Fewer items than expected, rewrite the matrix without the unused rows
+            trimmed = np.array(np.load(directory.joinpath(VECTORS_FILE), mmap_mode="r")[:len(ids)])
+            np.save(directory.joinpath(VECTORS_FILE), trimmed)
+        with open(directory.joinpath(IDS_FILE), "w", encoding="utf-8") as ids_file:
+            ujson.dump(ids, ids_file)
+        return cls.open(directory)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self.index
+
+    def get(self, ids: Sequence[str]) -> np.ndarray:
+        return np.asarray(self.vectors[[self.index[item_id] for item_id in ids]])
+
+    def pairwise_similarity(self, first_ids: Sequence[str], second_ids: Sequence[str]) -> np.ndarray:
+        """
+        Cosine similarity of each first_ids[i] with second_ids[i]
+        """
+        return np.einsum("ij,ij->i", self.get(first_ids), self.get(second_ids))
+
+    def top_k(self, query: np.ndarray, k: int = 10, exclude: Optional[set[str]] = None,
+              chunk_size: int = 100_000) -> list[tuple[str, float]]:
+        """
+        The k most similar ids to a query vector, best first. The matrix is scanned in chunks so memory use doesn't
+        grow with the size of the store
+        """
+        query = normalize_rows(np.asarray(query).reshape(1, -1))[0]
+        exclude = exclude or set()
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        wanted = k + len(exclude)
+        for start in range(0, len(self.ids), chunk_size):
+            scores = np.asarray(self.vectors[start:start + chunk_size]) @ query
+            candidates = np.argpartition(-scores, min(wanted, scores.size) - 1)[:wanted]
+            best_scores = np.concatenate([best_scores, scores[candidates]])
+            best_rows = np.concatenate([best_rows, candidates + start])
+            keep = np.argsort(-best_scores, kind="stable")[:wanted]
+            best_scores, best_rows = best_scores[keep], best_rows[keep]
+        results = [(self.ids[row], float(score)) for row, score in zip(best_rows, best_scores)
+                   if self.ids[row] not in exclude]
+        return results[:k]
+
+    def nearest_to(self, item_id: str, k: int = 10) -> list[tuple[str, float]]:
+        return self.top_k(self.vectors[self.index[item_id]], k, exclude={item_id})
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+import argparse
+import sys
+
+from dvids_apps.helpers import path, iso_date, eprint
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-path", type=path, help="Path to database", required=True)
+    parser.add_argument("--output-dir", type=path, help="Directory to write the Parquet dataset to", required=True)
+    parser.add_argument("--begin", type=iso_date, help="Begin date to export (YYYYMMDD format)")
+    parser.add_argument("--end", type=iso_date, help="End date to export (YYYYMMDD format)")
+    parser.add_argument("--date", type=iso_date, help="Single date to export (YYYYMMDD format)")
+    args = parser.parse_args()
+
+    if args.date and (args.begin or args.end):
+        eprint("Error: cannot specify both --date and one of --begin or --end")
+        return 1
+    if not args.db_path.exists():
+        eprint(f"Error: database {args.db_path} does not exist")
+        return 1
+    begin = args.date or args.begin
+    end = args.date or args.end
+
+    from sqlalchemy import create_engine
+    from dvids_apps.columnar import export_products
+
+    engine = create_engine(f"sqlite:///{args.db_path}")
+    count = export_products(engine, args.output_dir, begin, end)
+    print(f"Exported {count} products to {args.output_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
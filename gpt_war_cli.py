@@ -1,12 +1,20 @@
 #!/usr/bin/env python
+import glob
 import os
 import pathlib
 
-import openai
 import sys
 from argparse import ArgumentParser
+from typing import Iterator, Optional, TextIO, TYPE_CHECKING, Union
+
+import ujson
 
 from dvids_apps.helpers import eprint
+from dvids_apps.prompt_batching import BatchInput, PackedPrompt, PromptPart, DEFAULT_CONTEXT_TOKENS, \
+    MODEL_CONTEXT_TOKENS, format_prompt, get_token_counter, pack_prompts, split_answers
+
+if TYPE_CHECKING:
+    from dvids_apps.completions import Choice
 
 DEFAULT_PROMPTS = {
     'names': 'Provide a list of every person mentioned in the following paragraphs',
@@ -14,19 +22,177 @@ DEFAULT_PROMPTS = {
 }
 
 
+async def complete(api_key: str, prompt: str, model_type: str, cache_path: str, max_tokens: int = 1024) -> list[str]:
+    from dvids_apps.completions import CompletionClient
+    async with CompletionClient(openai_api_key=api_key, cache_path=cache_path) as client:
+        return await client.complete(prompt, model=model_type, max_tokens=max_tokens, temperature=0.2)
+
+
+def read_input_file(input_file: pathlib.Path) -> str:
+    with open(input_file) as f:
+        lines = f.readlines()
+        return '\n'.join([line.replace('\n\r', '').strip('\n') for line in lines]).strip('\n')
+
+
+def iter_batch_inputs(specs: list[str]) -> Iterator[BatchInput]:
+    """
+    Yields the inputs of a batch. Each spec is a directory (every file in it), a glob pattern, a file, or - for JSONL
+    on stdin with one {"id": ..., "text": ...} object per line (the id defaults to the line number)
+    """
+    for spec in specs:
+        if spec == '-':
+            for line_number, line in enumerate(sys.stdin, start=1):
+                if not line.strip():
+                    continue
+                item = ujson.loads(line)
+                yield BatchInput(str(item.get('id', line_number)), item['text'].strip('\n'))
+            continue
+        spec_path = pathlib.Path(spec)
+        if spec_path.is_dir():
+            files = sorted(file for file in spec_path.iterdir() if file.is_file())
+        else:
+            files = sorted(pathlib.Path(match) for match in glob.glob(spec) if os.path.isfile(match))
+        if not files:
+            eprint(f"Warning: no input files found for {spec}")
+        for file in files:
+            yield BatchInput(str(file), read_input_file(file))
+
+
+async def complete_prompts(client, prompts: list[str], model_type: str,
+                           max_tokens: int) -> list[Union["Choice", Exception]]:
+    """
+    Sends the prompts concurrently (bounded by the client's scheduler), returning the first choice of each or the
+    exception it failed with
+    """
+    import asyncio
+    from dvids_apps.completions import Choice
+    results = await asyncio.gather(*[client.complete_choices(prompt, model=model_type, max_tokens=max_tokens,
+                                                             temperature=0.2)
+                                     for prompt in prompts], return_exceptions=True)
+    return [result if isinstance(result, Exception) else (result[0] if result else Choice('', None))
+            for result in results]
+
+
+def collect_answers(prompts: list[PackedPrompt], completions: list[Union["Choice", Exception]],
+                    answers: dict[int, dict[int, str]], errors: dict[int, str]) -> list[PromptPart]:
+    """
+    Demultiplexes each completion into the answers for the inputs packed into its prompt, stored by input index and
+    piece. Returns the parts that got no answer under their header, or whose answer was cut off at --max-tokens (the
+    packed answers share one completion's budget)
+    """
+    unanswered: list[PromptPart] = []
+    for prompt, completion in zip(prompts, completions):
+        if isinstance(completion, Exception):
+            for part in prompt.parts:
+                errors[part.input_index] = str(completion)
+            continue
+        split = split_answers(completion.text, len(prompt.parts), completion.finish_reason == 'length')
+        for position, part in enumerate(prompt.parts):
+            if position in split:
+                answers.setdefault(part.input_index, {})[part.piece] = split[position]
+            else:
+                unanswered.append(part)
+    return unanswered
+
+
+async def run_batch(api_key: str, prompt_prefix: str, prompts: list[PackedPrompt], args) -> tuple[dict, dict]:
+    from dvids_apps.completions import CompletionClient
+    answers: dict[int, dict[int, str]] = {}
+    errors: dict[int, str] = {}
+    async with CompletionClient(openai_api_key=api_key, cache_path=args.cache_path,
+                                max_concurrency=args.max_concurrency) as client:
+        completions = await complete_prompts(client, [prompt.prompt for prompt in prompts], args.model_type,
+                                             args.max_tokens)
+        unanswered = collect_answers(prompts, completions, answers, errors)
+        if unanswered:
+            # The model didn't keep to the document headers for these or ran out of tokens, ask about each on its own
+            eprint(f"{len(unanswered)} documents weren't answered under their header or were cut off, sending them "
+                   f"one by one")
+            singles = [PackedPrompt(format_prompt(prompt_prefix, [part]), [part], part.tokens) for part in unanswered]
+            completions = await complete_prompts(client, [prompt.prompt for prompt in singles], args.model_type,
+                                                 args.max_tokens)
+            collect_answers(singles, completions, answers, errors)
+    return answers, errors
+
+
+def write_batch_results(inputs: list[BatchInput], answers: dict[int, dict[int, str]], errors: dict[int, str],
+                        output: TextIO) -> None:
+    """
+    Writes one JSON line per input, in input order: {"input": name, "answer": text} or {"input": name, "error": text}
+    """
+    for index, batch_input in enumerate(inputs):
+        if index in errors:
+            result = {'input': batch_input.name, 'error': errors[index]}
+        else:
+            pieces = answers.get(index, {})
+            result = {'input': batch_input.name, 'answer': '\n'.join(pieces[piece] for piece in sorted(pieces))}
+        output.write(ujson.dumps(result, escape_forward_slashes=False) + '\n')
+
+
+def batch_main(args, api_key: str, prompt_prefix: str) -> int:
+    inputs = list(iter_batch_inputs(args.inputs))
+    if not inputs:
+        eprint("Error: no inputs to process")
+        return 1
+    context_tokens = args.context_tokens or MODEL_CONTEXT_TOKENS.get(args.model_type, DEFAULT_CONTEXT_TOKENS)
+    try:
+        prompts = pack_prompts(prompt_prefix, inputs, get_token_counter(args.model_type),
+                               context_tokens - args.max_tokens, args.max_documents)
+    except ValueError as e:
+        eprint(f"Error: {e}, lower --max-tokens")
+        return 1
+    eprint(f"Packed {len(inputs)} inputs into {len(prompts)} prompts of up to {context_tokens - args.max_tokens} "
+           f"tokens")
+    if args.dry_run:
+        for prompt in prompts:
+            print(prompt.prompt)
+            print(f"--- {len(prompt.parts)} documents, ~{prompt.tokens} tokens ---")
+        return 0
+    import asyncio
+    answers, errors = asyncio.run(run_batch(api_key, prompt_prefix, prompts, args))
+    output: Optional[TextIO] = None
+    try:
+        output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        write_batch_results(inputs, answers, errors, output)
+    finally:
+        if output is not None and output is not sys.stdout:
+            output.close()
+    if errors:
+        eprint(f"Error: {len(errors)} of {len(inputs)} inputs failed")
+        return 1
+    return 0
+
+
 def main() -> int:
     parser = ArgumentParser()
     parser.add_argument("--type", type=str, help="Type of prompt to use",
                         choices=["names", "dates", "custom"], required=True)
     parser.add_argument("--prompt", type=str, help="Custom prompt to use for sending to GPT model")
-    parser.add_argument("--input", type=str, help="Input for the model. Can either be a file name or raw string",
-                        required=True)
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument("--input", type=str, help="Input for the model. Can either be a file name or raw string")
+    input_group.add_argument("--inputs", type=str, nargs="+",
+                             help="Batch mode: directories, glob patterns or files to process, or - for JSONL on "
+                                  "stdin ({\"id\": ..., \"text\": ...} per line). Inputs are packed into as few "
+                                  "prompts as fit the model's context and the answers written as JSONL")
     parser.add_argument("--api-key", type=str,
                         help="API key for OpenAI. Script defaults to os.environ['OPENAI_API_KEY']")
     parser.add_argument("--model-type", type=str, help="Name of OpenAI model to use. Default=%(default)s",
                         default="text-curie-001")
     parser.add_argument("--dry-run", action="store_true",
                         help="Flag enabling dry-run mode (no requests will be made to the API)")
+    parser.add_argument("--cache-path", type=str,
+                        help="Path to a response cache, identical prompts are answered from it instead of the API")
+    parser.add_argument("--max-tokens", type=int, default=1024,
+                        help="Maximum number of tokens in a completion, the rest of the context is left for the "
+                             "prompt. Default=%(default)s")
+    parser.add_argument("--context-tokens", type=int,
+                        help="Context size of the model in tokens. Default: known for OpenAI's completion models, "
+                             f"{DEFAULT_CONTEXT_TOKENS} otherwise")
+    parser.add_argument("--max-documents", type=int,
+                        help="Batch mode: maximum number of inputs packed into one prompt")
+    parser.add_argument("--max-concurrency", type=int, default=8,
+                        help="Batch mode: maximum number of requests in flight at once. Default=%(default)s")
+    parser.add_argument("--output", type=str, help="Batch mode: file to write the JSONL answers to. Default: stdout")
     args = parser.parse_args()
     api_key = os.environ.get('OPENAI_API_KEY', args.api_key)
     if not api_key:
@@ -36,27 +202,22 @@ def main() -> int:
     if not prompt_prefix:
         eprint("Error: custom prompt was specified but no prompt was given, must specify --prompt if --type is custom")
         return 1
+    if args.inputs:
+        return batch_main(args, api_key, prompt_prefix)
     input_file = pathlib.Path(args.input)
     if input_file.exists():
         # Assume that this is a file
-        with open(input_file) as f:
-            lines = f.readlines()
-            prompt = '\n'.join([line.replace('\n\r', '').strip('\n') for line in lines])
+        prompt = read_input_file(input_file)
     else:
         prompt = args.input
     full_prompt = prompt_prefix + "\n" + prompt.strip('\n')
     if args.dry_run:
         print(full_prompt)
         return 0
-    openai.api_key = api_key
-    x = openai.Completion.create(
-        model=args.model_type,
-        prompt=full_prompt,
-        max_tokens=1024,
-        temperature=0.2
-    )
-    for choice in x.choices:
-        print(choice.text)
+    # Only real requests need asyncio and the HTTP client, dry runs skip importing them
+    import asyncio
+    for choice in asyncio.run(complete(api_key, full_prompt, args.model_type, args.cache_path, args.max_tokens)):
+        print(choice)
     return 0
 
 
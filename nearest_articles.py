@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+import argparse
+import sys
+
+from dvids_apps.helpers import path, eprint
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", type=path, help="Vector store created by build_vector_store.py", required=True)
+    query_group = parser.add_mutually_exclusive_group(required=True)
+    query_group.add_argument("--product-id", type=str, help="Find the articles nearest to this product")
+    query_group.add_argument("--text", type=str, help="Find the articles nearest to this text")
+    parser.add_argument("--k", type=int, default=10, help="Number of articles to return. Default=%(default)s")
+    parser.add_argument("--db-path", type=path, help="Database to look up titles in")
+    args = parser.parse_args()
+
+    from dvids_apps.nlp import NlpEngine, text_hash
+    from dvids_apps.vector_store import VectorStore
+
+    store = VectorStore.open(args.store)
+    if args.product_id:
+        if args.product_id not in store:
+            eprint(f"Error: product {args.product_id} is not in the store")
+            return 1
+        results = store.nearest_to(args.product_id, args.k)
+    else:
+        with NlpEngine("vectors") as nlp_engine:
+            _, query = next(nlp_engine.vectors([(text_hash(args.text), args.text)]))
+        results = store.top_k(query, args.k)
+
+    titles: dict[str, str] = {}
+    if args.db_path:
+        from sqlalchemy import create_engine, select
+        from dvids_apps.models.db_models import Product
+
+        engine = create_engine(f"sqlite:///{args.db_path}")
+        with engine.connect() as connection:
+            titles = dict(connection.execute(
+                select(Product.id, Product.title).where(Product.id.in_([product_id for product_id, _ in results]))
+            ).all())
+    for product_id, score in results:
+        print(f"{score:.4f} {product_id} {titles.get(product_id, '')}".rstrip())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
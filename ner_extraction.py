@@ -1,40 +1,68 @@
+import os
 import sys
 from argparse import ArgumentParser
 
-import openai
-import spacy
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-
 from dvids_apps.helpers import path
-from dvids_apps.models.db_models import Product
+from dvids_apps.nlp import DEFAULT_BATCH_SIZE
+
+
+async def gpt_entities(descriptions: list[str], cache_path: str) -> list[list[str]]:
+    from dvids_apps.completions import CompletionClient
+
+    async with CompletionClient(openai_api_key=os.environ.get('OPENAI_API_KEY'), cache_path=cache_path) as client:
+        return await client.complete_many(
+            [f"Provide a list of all named entities separated by semi-colons in the following text: {description}"
+             for description in descriptions],
+            model='text-davinci-003',
+            max_tokens=3000,
+            temperature=0.2
+        )
 
 
 def main() -> int:
     parser = ArgumentParser()
     parser.add_argument("--db-path", type=path, help="Path to database", required=True)
+    parser.add_argument("--nlp-cache", type=path,
+                        help="Path to the NLP result cache. Default=<db-path>.nlp_cache.sqlite3")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Number of texts per spaCy batch. Default=%(default)s")
+    parser.add_argument("--n-process", type=int, default=1,
+                        help="Number of processes spaCy parses with. Default=%(default)s")
+    parser.add_argument("--cache-path", type=path,
+                        help="Path to the GPT response cache. Default=<db-path>.completion_cache.sqlite3")
+    parser.add_argument("--skip-duplicates", action="store_true",
+                        help="Only use one article per near-duplicate cluster (needs a database loaded with --dedupe)")
     args = parser.parse_args()
-    nlp = spacy.load("en_core_web_lg")
+
+    import asyncio
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from dvids_apps.dedupe import is_cluster_representative
+    from dvids_apps.models.db_models import Product
+    from dvids_apps.nlp import NlpEngine
+
+    nlp_cache = args.nlp_cache or f"{args.db_path}.nlp_cache.sqlite3"
     engine = create_engine(f"sqlite:///{args.db_path}")
     session = sessionmaker(bind=engine)
 
-    with session() as session:
+    with session() as session, NlpEngine("ner", cache_path=nlp_cache, batch_size=args.batch_size,
+                                         n_process=args.n_process) as nlp_engine:
         # Retrieve N articles
-        for product in session.query(Product).filter(Product.body.is_not(None))[0:10]:
-            product_doc = nlp(product.description)
+        query = session.query(Product).filter(Product.body.is_not(None))
+        if args.skip_duplicates:
+            query = query.filter(is_cluster_representative())
+        products = query[0:10]
+        entities = nlp_engine.entities((product.id, product.description) for product in products)
+        # Use GPT to get a list, all products are sent concurrently
+        completions = asyncio.run(gpt_entities([product.description for product in products],
+                                               args.cache_path or f"{args.db_path}.completion_cache.sqlite3"))
+        for (_, product_entities), choices in zip(entities, completions):
             spacy_ner_values = set()
-            for word in product_doc.ents:
-                if word.label_ != "CARDINAL":
-                    spacy_ner_values.add(word.text)
-            # Use GPT to get a list
+            for entity_text, entity_label in product_entities:
+                if entity_label != "CARDINAL":
+                    spacy_ner_values.add(entity_text)
             gpt_ner_values = set()
-            completion = openai.Completion.create(
-                model='text-davinci-003',
-                prompt=f"Provide a list of all named entities separated by semi-colons in the following text: {product.description}",
-                max_tokens=3000,
-                temperature=0.2
-            )
-            for entity in completion.choices[0].text.split(';'):
+            for entity in choices[0].split(';'):
                 gpt_ner_values.add(entity.strip())
             not_in_spacy = gpt_ner_values - spacy_ner_values
             not_in_gpt = spacy_ner_values - gpt_ner_values
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+import argparse
+import sys
+from collections import Counter
+
+from dvids_apps.helpers import path, iso_date, eprint
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-path", type=path, help="Path to database, or a sharded database's directory",
+                        required=True)
+    parser.add_argument("--facet", type=str, choices=["day", "unit_name", "branch", "keywords"], default="unit_name",
+                        help="What to count products by. Default=%(default)s")
+    parser.add_argument("--begin", type=iso_date, help="Only products dated on or after this date (YYYYMMDD format)")
+    parser.add_argument("--end", type=iso_date, help="Only products dated on or before this date (YYYYMMDD format)")
+    parser.add_argument("--unit-name", type=str, help="Only products of this unit")
+    parser.add_argument("--branch", type=str, help="Only products of this branch")
+    parser.add_argument("--keyword", type=str, help="Only products with this keyword (not with --facet keywords)")
+    parser.add_argument("--limit", type=int, default=20, help="Maximum number of values listed. Default=%(default)s")
+    args = parser.parse_args()
+
+    if not args.db_path.exists():
+        eprint(f"Error: database {args.db_path} does not exist")
+        return 1
+    if args.keyword and args.facet == "keywords":
+        eprint("Error: --keyword can't be combined with --facet keywords")
+        return 1
+    from dvids_apps.migrations import get_schema_version, ROLLUPS_VERSION
+    from dvids_apps.rollups import facet_counts, top_keywords
+    from dvids_apps.shards import is_sharded, iter_database_connections
+
+    sharded = is_sharded(args.db_path)
+    # Shards are counted in full and merged, a value just outside one shard's top results may lead overall
+    limit = None if sharded else args.limit
+    products: Counter = Counter()
+    titles: Counter = Counter()
+    for connection in iter_database_connections(args.db_path, args.begin, args.end):
+        if get_schema_version(connection) < ROLLUPS_VERSION:
+            eprint(f"Error: {args.db_path} has no rollups, run upgrade_database.py on it first")
+            return 1
+        if args.facet == "keywords":
+            for keyword, count in top_keywords(connection, args.begin, args.end, args.unit_name, args.branch, limit):
+                products[keyword] += count
+        else:
+            for value, count, title_count in facet_counts(connection, args.facet, args.begin, args.end,
+                                                          args.unit_name, args.branch, args.keyword, limit):
+                products[value] += count
+                titles[value] += title_count
+    if args.facet == "day":
+        values = sorted(products)[:args.limit]
+    else:
+        values = [value for value, _ in sorted(products.items(), key=lambda item: (-item[1], str(item[0])))]
+        values = values[:args.limit]
+    for value in values:
+        if args.facet == "keywords":
+            print(f"{products[value]:8} {value}")
+        else:
+            print(f"{products[value]:8} {titles[value]:8} {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+import argparse
+import sys
+
+from dvids_apps.helpers import path, iso_date, eprint
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-path", type=path, help="Path to database, or a sharded database's directory",
+                        required=True)
+    parser.add_argument("--query", type=str, required=True,
+                        help='FTS5 query, e.g. marines, "humanitarian relief", unit_name: wing AND storm')
+    parser.add_argument("--limit", type=int, default=20, help="Maximum number of results. Default=%(default)s")
+    parser.add_argument("--begin", type=iso_date, help="Only products dated on or after this date (YYYYMMDD format)")
+    parser.add_argument("--end", type=iso_date, help="Only products dated on or before this date (YYYYMMDD format)")
+    args = parser.parse_args()
+
+    if not args.db_path.exists():
+        eprint(f"Error: database {args.db_path} does not exist")
+        return 1
+    from sqlalchemy import create_engine
+    from sqlalchemy.exc import OperationalError
+    from dvids_apps.migrations import get_schema_version, SEARCH_INDEX_VERSION
+    from dvids_apps.search import search_products
+
+    from dvids_apps.shards import ShardedDatabase, is_sharded
+
+    # A sharded database is searched shard by shard (only the ones overlapping the dates) and the matches merged
+    db_paths = ShardedDatabase(args.db_path).shard_paths(args.begin, args.end) if is_sharded(args.db_path) \
+        else [args.db_path]
+    results = []
+    for db_path in db_paths:
+        engine = create_engine(f"sqlite:///{db_path}")
+        try:
+            if get_schema_version(engine) < SEARCH_INDEX_VERSION:
+                eprint(f"Error: {db_path} has no search index, run upgrade_database.py on it first")
+                return 1
+            results.extend(search_products(engine, args.query, args.limit, args.begin, args.end))
+        except OperationalError as e:
+            # Raised by SQLite for a malformed FTS5 query, e.g. unbalanced quotes or a dangling AND
+            eprint(f"Error: unable to search for {args.query}: {e.orig}")
+            return 1
+        finally:
+            engine.dispose()
+    # bm25 weighs terms by their frequency within each shard, so scores of different shards only roughly compare
+    results = sorted(results, key=lambda result: result.score)[:args.limit]
+    for result in results:
+        print(f"{result.score:8.2f} {result.id} ({result.date:%Y-%m-%d}) {result.title}")
+        print(f"         {result.snippet}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,13 @@
 import argparse
 import sys
-from statistics import median, mean, stdev
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import spacy
+from dvids_apps.helpers import path, eprint
+from dvids_apps.nlp import DEFAULT_BATCH_SIZE
 
-from dvids_apps.helpers import path
+if TYPE_CHECKING:
+    import numpy as np
 
 
 def load_sentence_pairs(sentence_pair_filepath: Path) -> list[tuple[str, str]]:
@@ -14,25 +16,71 @@ def load_sentence_pairs(sentence_pair_filepath: Path) -> list[tuple[str, str]]:
         return [(lines[i], lines[i + 1]) for i in range(0, len(lines) - 1, 2)]
 
 
+def load_product_ids(product_ids_filepath: Path) -> list[str]:
+    with open(product_ids_filepath, encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def print_aggregates(name: str, scores: "np.ndarray", groups: list) -> None:
+    from dvids_apps.vector_store import aggregate_scores
+    print(f"by {name}:")
+    for group, aggregate in sorted(aggregate_scores(scores, groups).items(), key=lambda item: str(item[0])):
+        print(f"  {group}: count: {aggregate['count']}, mean: {aggregate['mean']}, median: {aggregate['median']}, "
+              f"stdev: {aggregate['stdev']}")
+
+
 def main() -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument("--sentence-pairs", type=path, help="Path to file containing summary sentence pairs (each "
                                                             "pair will be separated by a newline, first sentence "
                                                             "should be smmry, second gpt)")
+    parser.add_argument("--nlp-cache", type=path, help="Path to a cache of document vectors, reused between runs")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Number of texts per spaCy batch. Default=%(default)s")
+    parser.add_argument("--n-process", type=int, default=1,
+                        help="Number of processes spaCy parses with. Default=%(default)s")
+    parser.add_argument("--product-ids", type=path,
+                        help="Path to a file with the product id of each sentence pair, one per line. Together with "
+                             "--db-path this adds per-unit and per-branch aggregates")
+    parser.add_argument("--db-path", type=path, help="Path to database to look up units and branches in")
     args = parser.parse_args()
-    nlp = spacy.load("en_core_web_lg")
+
+    import numpy as np
+    from dvids_apps.nlp import NlpEngine, text_hash
+    from dvids_apps.vector_store import rowwise_cosine
+
     sentence_pairs = load_sentence_pairs(args.sentence_pairs)
-    similarity_scores: list[float] = []
-    for smmry_summary, gpt_summary in sentence_pairs:
-        smmry_doc = nlp(smmry_summary)
-        gpt_doc = nlp(gpt_summary)
-        similarity_scores.append(smmry_doc.similarity(gpt_doc))
-    print(similarity_scores)
+    # Summaries have no product id, so they are keyed by their own hash
+    texts = [summary for pair in sentence_pairs for summary in pair]
+    with NlpEngine("vectors", cache_path=args.nlp_cache, batch_size=args.batch_size,
+                   n_process=args.n_process) as nlp_engine:
+        vectors = np.stack([vector for _, vector in nlp_engine.vectors((text_hash(text), text) for text in texts)])
+    # Even rows are the smmry summaries, odd rows the gpt ones: score every pair in one pass
+    similarity_scores = rowwise_cosine(vectors[0::2], vectors[1::2])
+    print(similarity_scores.tolist())
     print(len(similarity_scores))
-    score_mean = mean(similarity_scores)
-    score_median = median(similarity_scores)
-    score_stdev = stdev(similarity_scores)
+    score_mean = float(similarity_scores.mean())
+    score_median = float(np.median(similarity_scores))
+    score_stdev = float(similarity_scores.std(ddof=1))
     print(f"mean: {score_mean}, median: {score_median}, stdev: {score_stdev}")
+
+    if args.product_ids and args.db_path:
+        product_ids = load_product_ids(args.product_ids)
+        if len(product_ids) != len(similarity_scores):
+            eprint(f"Error: {len(product_ids)} product ids for {len(similarity_scores)} sentence pairs")
+            return 1
+        from sqlalchemy import create_engine, select
+        from dvids_apps.models.db_models import Product
+
+        engine = create_engine(f"sqlite:///{args.db_path}")
+        with engine.connect() as connection:
+            metadata = {product_id: (unit_name, branch) for product_id, unit_name, branch in connection.execute(
+                select(Product.id, Product.unit_name, Product.branch).where(Product.id.in_(set(product_ids)))
+            )}
+        print_aggregates("unit", similarity_scores,
+                         [metadata.get(product_id, (None, None))[0] for product_id in product_ids])
+        print_aggregates("branch", similarity_scores,
+                         [metadata.get(product_id, (None, None))[1] for product_id in product_ids])
     return 0
 
 
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+import argparse
+import sys
+
+from dvids_apps.helpers import path, eprint
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-path", type=path, required=True,
+                        help="Path to database to upgrade, or to a sharded database's directory to upgrade every shard")
+    args = parser.parse_args()
+    if not args.db_path.exists():
+        eprint(f"Error: database {args.db_path} does not exist")
+        return 1
+    from sqlalchemy import create_engine
+    from dvids_apps.migrations import upgrade_schema, SCHEMA_VERSION
+    from dvids_apps.shards import ShardedDatabase, is_sharded
+
+    db_paths = ShardedDatabase(args.db_path).shard_paths() if is_sharded(args.db_path) else [args.db_path]
+    for db_path in db_paths:
+        engine = create_engine(f"sqlite:///{db_path}")
+        if upgrade_schema(engine):
+            print(f"Upgraded {db_path} to schema version {SCHEMA_VERSION}")
+        else:
+            print(f"{db_path} is already at schema version {SCHEMA_VERSION}")
+        engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())